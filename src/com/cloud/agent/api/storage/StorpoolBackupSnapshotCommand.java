@@ -24,7 +24,27 @@ import org.apache.cloudstack.storage.to.SnapshotObjectTO;
 import com.cloud.agent.api.to.DataTO;
 
 public class StorpoolBackupSnapshotCommand extends StorpoolCopyCommand<SnapshotObjectTO, SnapshotObjectTO> {
+    // for an incremental backup: the StorPool device of the previous snapshot and the path of its backup on secondary storage
+    private String parentSnapshotPath;
+    private String parentBackupPath;
+
     public StorpoolBackupSnapshotCommand(final DataTO srcTO, final DataTO dstTO, final int timeout, final boolean executeInSequence) {
         super(srcTO, dstTO, timeout, executeInSequence);
     }
+
+    public String getParentSnapshotPath() {
+        return parentSnapshotPath;
+    }
+
+    public void setParentSnapshotPath(String parentSnapshotPath) {
+        this.parentSnapshotPath = parentSnapshotPath;
+    }
+
+    public String getParentBackupPath() {
+        return parentBackupPath;
+    }
+
+    public void setParentBackupPath(String parentBackupPath) {
+        this.parentBackupPath = parentBackupPath;
+    }
 }
@@ -5,6 +5,7 @@ import java.util.Map;
 import java.util.Map.Entry;
 import java.util.Set;
 
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil;
 import org.apache.log4j.Logger;
 
 import com.cloud.agent.api.Answer;
@@ -17,6 +18,7 @@ import com.cloud.hypervisor.kvm.storage.StorpoolStorageAdaptor;
 import com.cloud.resource.CommandWrapper;
 import com.cloud.resource.ResourceWrapper;
 import com.cloud.storage.template.TemplateProp;
+import com.cloud.utils.exception.CloudRuntimeException;
 import com.cloud.utils.script.OutputInterpreter;
 import com.cloud.utils.script.Script;
 import com.google.gson.JsonElement;
@@ -56,27 +58,12 @@ public final class StorPoolModifyStorageCommandWrapper extends CommandWrapper<St
     }
 
     private String getSpClusterId() {
-        Script sc = new Script("storpool_confget", 0, log);
-        OutputInterpreter.AllLinesParser parser = new OutputInterpreter.AllLinesParser();
-
-        String SP_CLUSTER_ID = null;
-        final String err = sc.execute(parser);
-        if (err != null) {
-            StorpoolStorageAdaptor.SP_LOG("Could not execute storpool_confget. Error: %s", err);
-            return SP_CLUSTER_ID;
-        }
-
-        for (String line: parser.getLines().split("\n")) {
-            String[] toks = line.split("=");
-            if( toks.length != 2 ) {
-                continue;
-            }
-            if (toks[0].equals("SP_CLUSTER_ID")) {
-                SP_CLUSTER_ID = toks[1];
-                return SP_CLUSTER_ID;
-            }
+        try {
+            return StorpoolUtil.getStorPoolConfig().get("SP_CLUSTER_ID");
+        } catch (CloudRuntimeException e) {
+            StorpoolStorageAdaptor.SP_LOG("Could not read the StorPool configuration. Error: %s", e.getMessage());
+            return null;
         }
-        return SP_CLUSTER_ID;
     }
 
     public String attachOrDetachVolume(String command, String type, String volumeUuid) {
@@ -20,12 +20,13 @@
 package com.cloud.hypervisor.kvm.resource.wrapper;
 
 import java.io.File;
+import java.nio.file.Paths;
+
 import org.apache.commons.io.FileUtils;
 import org.apache.log4j.Logger;
 
 import org.apache.cloudstack.storage.command.CopyCmdAnswer;
 import org.apache.cloudstack.storage.to.SnapshotObjectTO;
-import org.apache.cloudstack.utils.qemu.QemuImg;
 import org.apache.cloudstack.utils.qemu.QemuImg.PhysicalDiskFormat;
 import org.apache.cloudstack.utils.qemu.QemuImgFile;
 
@@ -35,6 +36,7 @@ import com.cloud.agent.api.to.NfsTO;
 import com.cloud.hypervisor.kvm.resource.LibvirtComputingResource;
 import com.cloud.hypervisor.kvm.storage.KVMStoragePool;
 import com.cloud.hypervisor.kvm.storage.KVMStoragePoolManager;
+import com.cloud.hypervisor.kvm.storage.StorPoolQemuImg;
 import com.cloud.hypervisor.kvm.storage.StorpoolStorageAdaptor;
 import com.cloud.resource.CommandWrapper;
 import com.cloud.resource.ResourceWrapper;
@@ -49,6 +51,7 @@ public final class StorpoolBackupSnapshotCommandWrapper extends CommandWrapper<S
     @Override
     public CopyCmdAnswer execute(final StorpoolBackupSnapshotCommand cmd, final LibvirtComputingResource libvirtComputingResource) {
         String srcPath = null;
+        String parentSnapshotPath = null;
         KVMStoragePool secondaryPool = null;
 
         try {
@@ -75,15 +78,27 @@ public final class StorpoolBackupSnapshotCommandWrapper extends CommandWrapper<S
             final String dstPath = dstDir + File.separator + dst.getName();
             final QemuImgFile dstFile = new QemuImgFile(dstPath, PhysicalDiskFormat.QCOW2);
 
-            final QemuImg qemu = new QemuImg(cmd.getWaitInMillSeconds());
-            qemu.convert(srcFile, dstFile);
+            final SnapshotObjectTO snapshot = new SnapshotObjectTO();
+            snapshot.setPath(dst.getPath() + File.separator + dst.getName());
+
+            if (cmd.getParentSnapshotPath() != null && new File(secondaryPool.getLocalPath(), cmd.getParentBackupPath()).exists()) {
+                StorpoolStorageAdaptor.attachOrDetachVolume("attach", "snapshot", cmd.getParentSnapshotPath());
+                parentSnapshotPath = cmd.getParentSnapshotPath();
+
+                // the backing file is relative, so the chain stays valid wherever the secondary storage is mounted
+                final String backingFile = Paths.get(dst.getPath()).relativize(Paths.get(cmd.getParentBackupPath())).toString();
+                StorPoolQemuImg.convertIncremental(srcPath, parentSnapshotPath, dstPath, backingFile, cmd.getWaitInMillSeconds());
+                // tells the management server that the backup is incremental, only then it records the parent
+                snapshot.setParentSnapshotPath(cmd.getParentBackupPath());
+            } else {
+                // a full backup, also when the backup of the parent is missing
+                StorPoolQemuImg.convert(srcFile, dstFile, cmd.getWaitInMillSeconds());
+            }
 
-            SP_LOG("StorpoolBackupSnapshotCommandWrapper srcFileFormat=%s, dstFileFormat=%s", srcFile.getFormat(), dstFile.getFormat());
+            SP_LOG("StorpoolBackupSnapshotCommandWrapper srcFileFormat=%s, dstFileFormat=%s, parent=%s", srcFile.getFormat(), dstFile.getFormat(), snapshot.getParentSnapshotPath());
             final File snapFile = new File(dstPath);
             final long size = snapFile.exists() ? snapFile.length() : 0;
 
-            final SnapshotObjectTO snapshot = new SnapshotObjectTO();
-            snapshot.setPath(dst.getPath() + File.separator + dst.getName());
             snapshot.setPhysicalSize(size);
 
             return new CopyCmdAnswer(snapshot);
@@ -96,6 +111,9 @@ public final class StorpoolBackupSnapshotCommandWrapper extends CommandWrapper<S
             if (srcPath != null) {
                 StorpoolStorageAdaptor.attachOrDetachVolume("detach", "snapshot", srcPath);
             }
+            if (parentSnapshotPath != null) {
+                StorpoolStorageAdaptor.attachOrDetachVolume("detach", "snapshot", parentSnapshotPath);
+            }
 
             if (secondaryPool != null) {
                 try {
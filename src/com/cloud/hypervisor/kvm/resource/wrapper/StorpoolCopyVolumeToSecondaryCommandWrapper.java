@@ -26,7 +26,6 @@ import java.io.File;
 import org.apache.cloudstack.storage.command.CopyCmdAnswer;
 import org.apache.cloudstack.storage.to.PrimaryDataStoreTO;
 import org.apache.cloudstack.storage.to.VolumeObjectTO;
-import org.apache.cloudstack.utils.qemu.QemuImg;
 import org.apache.cloudstack.utils.qemu.QemuImg.PhysicalDiskFormat;
 import org.apache.cloudstack.utils.qemu.QemuImgFile;
 //import org.apache.commons.io.FileUtils;
@@ -39,6 +38,7 @@ import com.cloud.hypervisor.kvm.resource.LibvirtComputingResource;
 import com.cloud.hypervisor.kvm.storage.KVMPhysicalDisk;
 import com.cloud.hypervisor.kvm.storage.KVMStoragePool;
 import com.cloud.hypervisor.kvm.storage.KVMStoragePoolManager;
+import com.cloud.hypervisor.kvm.storage.StorPoolQemuImg;
 import com.cloud.hypervisor.kvm.storage.StorpoolStorageAdaptor;
 import com.cloud.resource.CommandWrapper;
 import com.cloud.resource.ResourceWrapper;
@@ -94,8 +94,7 @@ public final class StorpoolCopyVolumeToSecondaryCommandWrapper extends CommandWr
                 PhysicalDiskFormat destFormat = newDisk.getFormat();
                 SP_LOG("StorpoolCopyVolumeToSecondaryCommandWrapper.execute: KVMPhysicalDisk name=%s, format=%s, path=%s, destinationPath=%s " , newDisk.getName(), newDisk.getFormat(), newDisk.getPath(), destPath);
                 QemuImgFile destFile = new QemuImgFile(destPath, destFormat);
-                QemuImg qemu = new QemuImg(cmd.getWaitInMillSeconds());
-                qemu.convert(srcFile, destFile);
+                StorPoolQemuImg.convert(srcFile, destFile, cmd.getWaitInMillSeconds());
 
                 final File file = new File(destPath);
                 final long size = file.exists() ? file.length() : 0;
@@ -26,7 +26,6 @@ import java.util.List;
 
 import org.apache.cloudstack.storage.command.CopyCmdAnswer;
 import org.apache.cloudstack.storage.to.TemplateObjectTO;
-import org.apache.cloudstack.utils.qemu.QemuImg;
 import org.apache.cloudstack.utils.qemu.QemuImg.PhysicalDiskFormat;
 import org.apache.cloudstack.utils.qemu.QemuImgFile;
 import org.apache.log4j.Logger;
@@ -39,6 +38,7 @@ import com.cloud.hypervisor.kvm.resource.LibvirtComputingResource;
 import com.cloud.hypervisor.kvm.storage.KVMPhysicalDisk;
 import com.cloud.hypervisor.kvm.storage.KVMStoragePool;
 import com.cloud.hypervisor.kvm.storage.KVMStoragePoolManager;
+import com.cloud.hypervisor.kvm.storage.StorPoolQemuImg;
 import com.cloud.hypervisor.kvm.storage.StorpoolStorageAdaptor;
 import com.cloud.resource.CommandWrapper;
 import com.cloud.resource.ResourceWrapper;
@@ -103,7 +103,6 @@ public final class StorpoolDownloadTemplateCommandWrapper extends CommandWrapper
 
             final QemuImgFile srcFile = new QemuImgFile(srcDisk.getPath(), srcDisk.getFormat());
 
-            final QemuImg qemu = new QemuImg(cmd.getWaitInMillSeconds());
             StorpoolStorageAdaptor.resize( Long.toString(srcDisk.getVirtualSize()), dst.getPath());
 
             if (dst instanceof TemplateObjectTO) {
@@ -115,7 +114,7 @@ public final class StorpoolDownloadTemplateCommandWrapper extends CommandWrapper
 
             final QemuImgFile dstFile = new QemuImgFile(dstPath, PhysicalDiskFormat.RAW);
 
-            qemu.convert(srcFile, dstFile);
+            StorPoolQemuImg.convert(srcFile, dstFile, cmd.getWaitInMillSeconds());
             return new CopyCmdAnswer(dst);
         } catch (final Exception e) {
             final String error = "Failed to copy template to primary: " + e.getMessage();
@@ -0,0 +1,133 @@
+// Licensed to the Apache Software Foundation (ASF) under one
+// or more contributor license agreements.  See the NOTICE file
+// distributed with this work for additional information
+// regarding copyright ownership.  The ASF licenses this file
+// to you under the Apache License, Version 2.0 (the
+// "License"); you may not use this file except in compliance
+// with the License.  You may obtain a copy of the License at
+//
+//   http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing,
+// software distributed under the License is distributed on an
+// "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, either express or implied.  See the License for the
+// specific language governing permissions and limitations
+// under the License.
+package com.cloud.hypervisor.kvm.storage;
+
+import java.io.IOException;
+import java.nio.file.ClosedWatchServiceException;
+import java.nio.file.FileSystems;
+import java.nio.file.Path;
+import java.nio.file.StandardWatchEventKinds;
+import java.nio.file.WatchKey;
+import java.nio.file.WatchService;
+import java.util.HashSet;
+import java.util.Set;
+
+import org.apache.log4j.Logger;
+
+/**
+ * Watches the StorPool device directories (/dev/storpool-byid/, /dev/storpool/) with
+ * inotify, so the threads waiting for an attached volume are woken up as soon as
+ * its symlink is created, instead of polling for it.
+ *
+ * A waiter takes the current generation, checks for its device and then waits
+ * for a change after that generation, so an event between the check and the wait
+ * is not lost.
+ */
+public final class StorPoolDeviceWatcher {
+    private static final Logger log = Logger.getLogger(StorPoolDeviceWatcher.class);
+
+    private static final Object lock = new Object();
+    private static final Set<Path> watchedDirs = new HashSet<>();
+    private static WatchService watchService;
+    private static long generation;
+
+    private StorPoolDeviceWatcher() {
+    }
+
+    /**
+     * @return a counter which is increased on every change in a watched directory
+     */
+    public static long generation() {
+        synchronized (lock) {
+            return generation;
+        }
+    }
+
+    /**
+     * Waits until there is a change in dir after the given generation or the timeout expires.
+     */
+    public static void awaitChange(final Path dir, final long lastGeneration, final long timeoutMs) {
+        final boolean watched = watch(dir);
+        synchronized (lock) {
+            final long deadline = System.currentTimeMillis() + timeoutMs;
+            long remaining = timeoutMs;
+            while (generation == lastGeneration && remaining > 0) {
+                try {
+                    // without a watch this is a plain sleep, as the old polling
+                    lock.wait(remaining);
+                } catch (InterruptedException e) {
+                    Thread.currentThread().interrupt();
+                    return;
+                }
+                if (!watched) {
+                    return;
+                }
+                remaining = deadline - System.currentTimeMillis();
+            }
+        }
+    }
+
+    private static boolean watch(final Path dir) {
+        synchronized (watchedDirs) {
+            if (watchedDirs.contains(dir)) {
+                return true;
+            }
+            try {
+                if (watchService == null) {
+                    watchService = FileSystems.getDefault().newWatchService();
+                    Thread thread = new Thread(new Runnable() {
+                        @Override
+                        public void run() {
+                            watchLoop();
+                        }
+                    }, "StorPoolDeviceWatcher");
+                    thread.setDaemon(true);
+                    thread.start();
+                }
+                dir.register(watchService, StandardWatchEventKinds.ENTRY_CREATE, StandardWatchEventKinds.ENTRY_DELETE);
+                watchedDirs.add(dir);
+                StorpoolStorageAdaptor.SP_LOG("StorPoolDeviceWatcher: watching %s", dir);
+                return true;
+            } catch (IOException e) {
+                // the directory is created by StorPool with the first attached volume
+                log.debug(String.format("Could not watch %s: %s", dir, e.getMessage()));
+                return false;
+            }
+        }
+    }
+
+    private static void watchLoop() {
+        while (true) {
+            WatchKey key;
+            try {
+                key = watchService.take();
+            } catch (InterruptedException | ClosedWatchServiceException e) {
+                return;
+            }
+            key.pollEvents();
+            if (!key.reset()) {
+                synchronized (watchedDirs) {
+                    watchedDirs.remove((Path)key.watchable());
+                }
+            }
+            synchronized (lock) {
+                generation++;
+                lock.notifyAll();
+            }
+        }
+    }
+}
@@ -0,0 +1,151 @@
+// Licensed to the Apache Software Foundation (ASF) under one
+// or more contributor license agreements.  See the NOTICE file
+// distributed with this work for additional information
+// regarding copyright ownership.  The ASF licenses this file
+// to you under the Apache License, Version 2.0 (the
+// "License"); you may not use this file except in compliance
+// with the License.  You may obtain a copy of the License at
+//
+//   http://www.apache.org/licenses/LICENSE-2.0
+//
+// Unless required by applicable law or agreed to in writing,
+// software distributed under the License is distributed on an
+// "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+// KIND, either express or implied.  See the License for the
+// specific language governing permissions and limitations
+// under the License.
+package com.cloud.hypervisor.kvm.storage;
+
+import static com.cloud.hypervisor.kvm.storage.StorpoolStorageAdaptor.SP_LOG;
+
+import org.apache.cloudstack.utils.qemu.QemuImg;
+import org.apache.cloudstack.utils.qemu.QemuImg.PhysicalDiskFormat;
+import org.apache.cloudstack.utils.qemu.QemuImgException;
+import org.apache.cloudstack.utils.qemu.QemuImgFile;
+import org.apache.log4j.Logger;
+
+import com.cloud.utils.script.OutputInterpreter;
+import com.cloud.utils.script.Script;
+
+/**
+ * qemu-img conversions of StorPool devices, tuned for large and mostly empty volumes.
+ *
+ * When the installed qemu-img supports it (2.9 and later), the device is read with
+ * several parallel coroutines ("storpool.qemu.img.coroutines" in agent.properties,
+ * default 8) and the source is read with O_DIRECT. The zero areas of 4k or more
+ * are left unallocated in the destination, which is the default of qemu-img.
+ * RAW destinations (StorPool devices) are written out of order and with O_DIRECT.
+ * With an older qemu-img the conversion is the same as QemuImg.convert.
+ */
+public final class StorPoolQemuImg {
+    private static final Logger log = Logger.getLogger(StorPoolQemuImg.class);
+
+    private static final String QEMU_IMG = "qemu-img";
+
+    private static Boolean parallelConvertSupported;
+
+    private StorPoolQemuImg() {
+    }
+
+    public static void convert(final QemuImgFile srcFile, final QemuImgFile dstFile, final int timeout) throws QemuImgException {
+        if (!isParallelConvertSupported()) {
+            new QemuImg(timeout).convert(srcFile, dstFile);
+            return;
+        }
+
+        final Script script = new Script(QEMU_IMG, timeout, log);
+        script.add("convert");
+        script.add("-f", srcFile.getFormat().toString());
+        script.add("-O", dstFile.getFormat().toString());
+        script.add("-T", "none");
+        script.add("-m", String.valueOf(getCoroutines()));
+        if (dstFile.getFormat() == PhysicalDiskFormat.RAW) {
+            // the RAW destinations are StorPool devices, written with O_DIRECT;
+            // out of order writes fragment image files, they are used only for devices
+            script.add("-t", "none");
+            script.add("-W");
+        }
+        script.add(srcFile.getFileName());
+        script.add(dstFile.getFileName());
+
+        final long start = System.currentTimeMillis();
+        execute(script);
+        SP_LOG("StorPoolQemuImg.convert: %s to %s took %s ms", srcFile.getFileName(), dstFile.getFileName(), System.currentTimeMillis() - start);
+    }
+
+    /**
+     * Writes the blocks of a RAW StorPool snapshot which differ from an older snapshot of the
+     * same volume into a QCOW2 overlay, backed by the backup of the older snapshot.
+     *
+     * The overlay is created on top of the new snapshot and rebased in safe mode on the old one,
+     * which makes qemu-img compare the two attached snapshots and copy only the changed clusters.
+     * Then the backing file is switched, without a copy, to the backup of the old snapshot, which
+     * has the same content.
+     *
+     * @param backingFile the backup of the older snapshot, relative to the directory of dstPath
+     */
+    public static void convertIncremental(final String srcPath, final String baseSnapshotPath, final String dstPath, final String backingFile,
+            final int timeout) throws QemuImgException {
+        final long start = System.currentTimeMillis();
+
+        final Script create = new Script(QEMU_IMG, timeout, log);
+        create.add("create");
+        create.add("-f", PhysicalDiskFormat.QCOW2.toString());
+        create.add("-o", "backing_file=" + srcPath + ",backing_fmt=" + PhysicalDiskFormat.RAW);
+        create.add(dstPath);
+        execute(create);
+
+        final Script diff = new Script(QEMU_IMG, timeout, log);
+        diff.add("rebase");
+        diff.add("-f", PhysicalDiskFormat.QCOW2.toString());
+        diff.add("-t", "none");
+        diff.add("-b", baseSnapshotPath);
+        diff.add("-F", PhysicalDiskFormat.RAW.toString());
+        diff.add(dstPath);
+        execute(diff);
+
+        final Script rebase = new Script(QEMU_IMG, timeout, log);
+        rebase.add("rebase");
+        rebase.add("-u");
+        rebase.add("-f", PhysicalDiskFormat.QCOW2.toString());
+        rebase.add("-b", backingFile);
+        rebase.add("-F", PhysicalDiskFormat.QCOW2.toString());
+        rebase.add(dstPath);
+        execute(rebase);
+
+        SP_LOG("StorPoolQemuImg.convertIncremental: %s to %s based on %s (backing file %s) took %s ms", srcPath, dstPath, baseSnapshotPath, backingFile,
+                System.currentTimeMillis() - start);
+    }
+
+    private static void execute(final Script script) throws QemuImgException {
+        final String result = script.execute();
+        if (result != null) {
+            throw new QemuImgException(result);
+        }
+    }
+
+    private static int getCoroutines() {
+        String coroutines = StorpoolStorageAdaptor.getAgentProperty("storpool.qemu.img.coroutines", "8");
+        try {
+            // qemu-img accepts between 1 and 16 coroutines
+            return Math.max(1, Math.min(16, Integer.parseInt(coroutines)));
+        } catch (NumberFormatException e) {
+            log.warn("Invalid storpool.qemu.img.coroutines in agent.properties: " + coroutines);
+            return 8;
+        }
+    }
+
+    private static synchronized boolean isParallelConvertSupported() {
+        if (parallelConvertSupported == null) {
+            final Script script = new Script(QEMU_IMG, 10000, log);
+            script.add("--help");
+            final OutputInterpreter.AllLinesParser parser = new OutputInterpreter.AllLinesParser();
+            final String result = script.execute(parser);
+            // "qemu-img --help" exits with 1 on some versions, then the output is returned as the error
+            final String help = result != null ? result : parser.getLines();
+            parallelConvertSupported = help != null && help.contains("num_coroutines");
+            SP_LOG("StorPoolQemuImg: parallel convert supported=%s", parallelConvertSupported);
+        }
+        return parallelConvertSupported;
+    }
+}
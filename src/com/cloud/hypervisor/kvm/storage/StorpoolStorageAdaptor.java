@@ -18,19 +18,27 @@ package com.cloud.hypervisor.kvm.storage;
 
 
 import java.io.BufferedReader;
-import java.io.BufferedWriter;
 import java.io.File;
-import java.io.FileWriter;
+import java.io.IOException;
 import java.io.InputStreamReader;
-import java.io.PrintWriter;
-import java.text.SimpleDateFormat;
-import java.util.Calendar;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.util.ArrayList;
+import java.util.Collection;
+import java.util.Collections;
 import java.util.HashMap;
 import java.util.List;
 import java.util.Map;
+import java.util.Properties;
 import java.util.UUID;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.atomic.AtomicLong;
 
+import org.apache.cloudstack.storage.datastore.util.StorPoolLogWriter;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil;
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpApiResponse;
 import org.apache.cloudstack.utils.qemu.QemuImg;
 import org.apache.cloudstack.utils.qemu.QemuImg.PhysicalDiskFormat;
 import org.apache.cloudstack.utils.qemu.QemuImgException;
@@ -44,6 +52,7 @@ import com.cloud.storage.Storage;
 import com.cloud.storage.Storage.ImageFormat;
 import com.cloud.storage.Storage.ProvisioningType;
 import com.cloud.storage.Storage.StoragePoolType;
+import com.cloud.utils.PropertiesUtil;
 import com.cloud.utils.exception.CloudRuntimeException;
 import com.cloud.utils.script.OutputInterpreter;
 import com.cloud.utils.script.Script;
@@ -55,14 +64,60 @@ import com.google.gson.JsonPrimitive;
 
 @StorageAdaptorInfo(storagePoolType=StoragePoolType.SharedMountPoint)
 public class StorpoolStorageAdaptor implements StorageAdaptor {
+    public enum SpLogLevel {
+        OFF, INFO, DEBUG
+    }
+
+    private static final StorPoolLogWriter spLogWriter = new StorPoolLogWriter(new File("/var/log/cloudstack/agent/storpool-agent.log"), 107374182400L, false);
+    private static final SpLogLevel spLogLevel = spLogLevel();
+
+    private static Properties agentProperties;
+
+    /**
+     * @return the value of a property in agent.properties or defaultValue if it's not set
+     */
+    public static synchronized String getAgentProperty(String name, String defaultValue) {
+        if (agentProperties == null) {
+            agentProperties = new Properties();
+            File file = PropertiesUtil.findConfigFile("agent.properties");
+            if (file != null) {
+                try {
+                    agentProperties = PropertiesUtil.loadFromFile(file);
+                } catch (IOException e) {
+                    Logger.getLogger(StorpoolStorageAdaptor.class).warn("Could not read agent.properties: " + e.getMessage());
+                }
+            }
+        }
+        String value = agentProperties.getProperty(name);
+        return value != null ? value.trim() : defaultValue;
+    }
+
+    /**
+     * The level of storpool-agent.log is set with storpool.log.level=OFF|INFO|DEBUG
+     * in agent.properties, the default is DEBUG.
+     */
+    private static SpLogLevel spLogLevel() {
+        String level = getAgentProperty("storpool.log.level", SpLogLevel.DEBUG.name());
+        try {
+            return SpLogLevel.valueOf(level.toUpperCase());
+        } catch (IllegalArgumentException e) {
+            Logger.getLogger(StorpoolStorageAdaptor.class).warn("Invalid storpool.log.level in agent.properties: " + level);
+            return SpLogLevel.DEBUG;
+        }
+    }
+
     public static void SP_LOG(String fmt, Object... args) {
-        try (PrintWriter spLogFile = new PrintWriter(new BufferedWriter(new FileWriter("/var/log/cloudstack/agent/storpool-agent.log", true)))) {
-            final String line = String.format(fmt, args);
-            String timeStamp = new SimpleDateFormat("yyyy-MM-dd HH:mm:ss,ms").format(Calendar.getInstance().getTime());
-            spLogFile.println(timeStamp +" "+line);
-            spLogFile.flush();
-        } catch (Exception e) {
-            throw new RuntimeException(e);
+        if (spLogLevel != SpLogLevel.OFF) {
+            spLogWriter.log(String.format(fmt, args));
+        }
+    }
+
+    /**
+     * Logs the frequent calls (storage pool and disk lookups), which are skipped unless the level is DEBUG.
+     */
+    public static void SP_DEBUG(String fmt, Object... args) {
+        if (spLogLevel == SpLogLevel.DEBUG) {
+            spLogWriter.log(String.format(fmt, args));
         }
     }
 
@@ -70,6 +125,13 @@ public class StorpoolStorageAdaptor implements StorageAdaptor {
 
     private static final Map<String, KVMStoragePool> storageUuidToStoragePool = new HashMap<String, KVMStoragePool>();
 
+    private static final Map<String, Boolean> installedCommands = new ConcurrentHashMap<>();
+
+    // sizes of the attached devices, dropped after attach, detach, resize and pool refresh
+    private static final Map<String, Long> deviceSizes = new ConcurrentHashMap<>();
+    // changed by every drop, a size read before a drop is not cached
+    private static final AtomicLong deviceSizesGeneration = new AtomicLong();
+
     private static final int gitBuildVersionMajor = gitBuildVersionMajor();
 
 
@@ -84,13 +146,13 @@ public class StorpoolStorageAdaptor implements StorageAdaptor {
 
     @Override
     public KVMStoragePool getStoragePool(String uuid) {
-        SP_LOG("StorpooolStorageAdaptor.getStoragePool: uuid=%s", uuid);
+        SP_DEBUG("StorpooolStorageAdaptor.getStoragePool: uuid=%s", uuid);
         return storageUuidToStoragePool.get(uuid);
     }
 
     @Override
     public KVMStoragePool getStoragePool(String uuid, boolean refreshInfo) {
-        SP_LOG("StorpooolStorageAdaptor.getStoragePool: uuid=%s, refresh=%s", uuid, refreshInfo);
+        SP_DEBUG("StorpooolStorageAdaptor.getStoragePool: uuid=%s, refresh=%s", uuid, refreshInfo);
         return storageUuidToStoragePool.get(uuid);
     }
 
@@ -107,13 +169,18 @@ public class StorpoolStorageAdaptor implements StorageAdaptor {
     }
 
     private static long getDeviceSize(final String devPath) {
-        SP_LOG("StorpooolStorageAdaptor.getDeviceSize: path=%s", devPath);
+        SP_DEBUG("StorpooolStorageAdaptor.getDeviceSize: path=%s", devPath);
 
         if (getVolumeNameFromPath(devPath, true) != null) {
             File file = new File(devPath);
             if (!file.exists()) {
                 return 0;
             }
+            long size = getDeviceSizeFromSysfs(file);
+            if (size >= 0) {
+                return size;
+            }
+
             Script sc = new Script("blockdev", 0, log);
             sc.add("--getsize64", devPath);
 
@@ -132,22 +199,45 @@ public class StorpoolStorageAdaptor implements StorageAdaptor {
         return 0;
     }
 
+    /**
+     * Reads the size of the block device from /sys/class/block/<device>/size (in 512 byte sectors).
+     *
+     * @return the size in bytes or -1 if it couldn't be read
+     */
+    private static long getDeviceSizeFromSysfs(final File devPath) {
+        try {
+            final Path device = devPath.toPath().toRealPath();
+            final Path sizeFile = Paths.get("/sys/class/block", device.getFileName().toString(), "size");
+            final String sectors = new String(Files.readAllBytes(sizeFile), StandardCharsets.UTF_8).trim();
+            return Long.parseLong(sectors) * 512;
+        } catch (IOException | NumberFormatException e) {
+            log.debug(String.format("Unable to read the size of %s from sysfs: %s", devPath, e.getMessage()));
+            return -1;
+        }
+    }
+
+    /**
+     * Waits for the device of an attached volume. The waiting thread is woken up by
+     * StorPoolDeviceWatcher when the symlink appears, the size is checked at least
+     * every 100ms in case the device is there but not ready yet.
+     */
     private static boolean waitForDeviceSymlink(String devPath) {
-        final int numTries = 10;
-        final int sleepTime = 100;
+        final long timeout = 1000;
+        final long checkInterval = 100;
+        final Path dir = Paths.get(devPath).getParent();
+        final long deadline = System.currentTimeMillis() + timeout;
 
-        for(int i = 0; i < numTries; i++) {
+        while (true) {
+            final long generation = StorPoolDeviceWatcher.generation();
             if (getDeviceSize(devPath) != 0) {
                 return true;
-            } else {
-                try {
-                    Thread.sleep(sleepTime);
-                } catch (Exception ex) {
-                    // don't do anything
-                }
             }
+            final long remaining = deadline - System.currentTimeMillis();
+            if (remaining <= 0) {
+                return false;
+            }
+            StorPoolDeviceWatcher.awaitChange(dir, generation, Math.min(remaining, checkInterval));
         }
-        return false;
     }
 
     public static String getVolumeNameFromPath(final String volumeUuid, boolean tildeNeeded) {
@@ -162,13 +252,110 @@ public class StorpoolStorageAdaptor implements StorageAdaptor {
     }
 
     public static boolean attachOrDetachVolume(String command, String type, String volumeUuid) {
-        final String name = getVolumeNameFromPath(volumeUuid, true);
-        if (name == null) {
+        return attachOrDetachVolumes(command, type, Collections.singletonList(volumeUuid));
+    }
+
+    /**
+     * Attaches or detaches several volumes or snapshots on this host with a single
+     * VolumesReassign request to the StorPool API. The storpool CLI is used only
+     * when the API can't be reached with the local StorPool configuration.
+     */
+    public static boolean attachOrDetachVolumes(String command, String type, List<String> volumeUuids) {
+        final List<String> devPaths = new ArrayList<>();
+        final List<String> names = new ArrayList<>();
+        for (String volumeUuid : volumeUuids) {
+            final String name = getVolumeNameFromPath(volumeUuid, true);
+            if (name != null) {
+                devPaths.add(volumeUuid);
+                names.add(name);
+            }
+        }
+        if (names.isEmpty()) {
             return false;
         }
 
-        SP_LOG("StorpooolStorageAdaptor.attachOrDetachVolume: cmd=%s, type=%s, uuid=%s, name=%s, buildVersion=%s", command, type, volumeUuid, name, gitBuildVersionMajor);
+        SP_LOG("StorpooolStorageAdaptor.attachOrDetachVolumes: cmd=%s, type=%s, uuids=%s, names=%s, buildVersion=%s", command, type, devPaths, names, gitBuildVersionMajor);
+
+        String err;
+        try {
+            err = reassign(command, type, names);
+        } catch (CloudRuntimeException e) {
+            SP_LOG("StorPool API is not available, using the storpool CLI. Error: %s", e.getMessage());
+            err = null;
+            for (String name : names) {
+                err = attachOrDetachWithCli(command, type, name);
+                if (err != null) {
+                    break;
+                }
+            }
+        } finally {
+            dropDeviceSizes(devPaths);
+        }
+
+        if (err != null) {
+            SP_LOG(err);
+            log.warn(err);
+            throw new CloudRuntimeException(err);
+        }
+
+        if (command.equals("attach")) {
+            boolean attached = true;
+            for (String devPath : devPaths) {
+                attached &= waitForDeviceSymlink(devPath);
+            }
+            return attached;
+        } else {
+            return true;
+        }
+    }
+
+    /**
+     * @return the error of the VolumesReassign request or null on success
+     * @throws CloudRuntimeException if the API is not configured on this host or can't be reached
+     */
+    private static String reassign(String command, String type, List<String> names) {
+        final String ourId = StorpoolUtil.getStorPoolConfig().get("SP_OURID");
+        if (ourId == null || !StringUtils.isNumeric(ourId)) {
+            throw new CloudRuntimeException("Invalid StorPool config. Missing or invalid SP_OURID: " + ourId);
+        }
+        final List<Integer> here = Collections.singletonList(Integer.parseInt(ourId));
+
+        final List<Map<String, Object>> reassignDescs = new ArrayList<>();
+        for (String name : names) {
+            Map<String, Object> reassignDesc = new HashMap<>();
+            reassignDesc.put(type, name);
+            if (command.equals("attach")) {
+                reassignDesc.put(type.equals("snapshot") ? "ro" : "rw", here);
+                reassignDesc.put("onRemoteAttached", gitBuildVersionMajor < 12 ? "detachForce" : "export");
+            } else {
+                reassignDesc.put("detach", here);
+            }
+            reassignDescs.add(reassignDesc);
+        }
+
+        // a detach can fail while the device is still in use, it's retried like with the CLI
+        final int numTries = command.equals("detach") ? 10 : 1;
+        final int sleepTime = 1000;
+        String err = null;
 
+        for (int i = 0; i < numTries; i++) {
+            SpApiResponse resp = StorpoolUtil.volumesReassign(reassignDescs, null);
+            if (resp.getError() == null) {
+                return null;
+            }
+            err = String.format("Unable to %s %s %s. Error: %s", command, type, names, resp.getError());
+            if (i + 1 < numTries) {
+                try {
+                    Thread.sleep(sleepTime);
+                } catch (Exception ex) {
+                    // don't do anything
+                }
+            }
+        }
+        return err;
+    }
+
+    private static String attachOrDetachWithCli(String command, String type, String name) {
         final int numTries = 10;
         final int sleepTime = 1000;
         String err = null;
@@ -204,18 +391,7 @@ public class StorpoolStorageAdaptor implements StorageAdaptor {
                 break;
             }
         }
-
-        if (err != null) {
-            SP_LOG(err);
-            log.warn(err);
-            throw new CloudRuntimeException(err);
-        }
-
-        if (command.equals("attach")) {
-            return waitForDeviceSymlink(volumeUuid);
-        } else {
-            return true;
-        }
+        return err;
     }
 
     public static boolean resize(String newSize, String volumeUuid ) {
@@ -236,7 +412,12 @@ public class StorpoolStorageAdaptor implements StorageAdaptor {
         sc.add("shrinkOk");
 
         OutputInterpreter.OneLineParser parser = new OutputInterpreter.OneLineParser();
-        String res = sc.execute(parser);
+        String res;
+        try {
+            res = sc.execute(parser);
+        } finally {
+            dropDeviceSizes(Collections.singletonList(volumeUuid));
+        }
         if (res != null) {
             String err = String.format("Unable to resize volume %s. Error: %s", name, res);
             SP_LOG(err);
@@ -249,11 +430,11 @@ public class StorpoolStorageAdaptor implements StorageAdaptor {
 
     @Override
     public KVMPhysicalDisk getPhysicalDisk(String volumeUuid, KVMStoragePool pool) {
-        SP_LOG("StorpooolStorageAdaptor.getPhysicalDisk: uuid=%s, pool=%s", volumeUuid, pool);
+        SP_DEBUG("StorpooolStorageAdaptor.getPhysicalDisk: uuid=%s, pool=%s", volumeUuid, pool);
 
         log.debug(String.format("getPhysicalDisk: uuid=%s, pool=%s", volumeUuid, pool));
 
-        final long deviceSize = getDeviceSize(volumeUuid);
+        final long deviceSize = getCachedDeviceSize(volumeUuid);
 
         KVMPhysicalDisk physicalDisk = new KVMPhysicalDisk(volumeUuid, volumeUuid, pool);
         physicalDisk.setFormat(PhysicalDiskFormat.RAW);
@@ -274,6 +455,35 @@ public class StorpoolStorageAdaptor implements StorageAdaptor {
         return attachOrDetachVolume("attach", "volume", volumeUuid);
     }
 
+    private static long getCachedDeviceSize(String devPath) {
+        Long size = deviceSizes.get(devPath);
+        // the device could have been detached from this host by another one
+        if (size != null && new File(devPath).exists()) {
+            return size;
+        }
+        final long generation = deviceSizesGeneration.get();
+        size = getDeviceSize(devPath);
+        // a missing device is not cached, it may be attached by someone else
+        if (size == 0) {
+            deviceSizes.remove(devPath);
+            return size;
+        }
+        deviceSizes.put(devPath, size);
+        // the size could have been read before an attach, detach or resize, which dropped the cached one
+        if (generation != deviceSizesGeneration.get()) {
+            deviceSizes.remove(devPath, size);
+        }
+        return size;
+    }
+
+    /**
+     * Drops the cached sizes after the devices were attached, detached or resized
+     */
+    private static void dropDeviceSizes(Collection<String> devPaths) {
+        deviceSizesGeneration.incrementAndGet();
+        deviceSizes.keySet().removeAll(devPaths);
+    }
+
     @Override
     public boolean disconnectPhysicalDisk(String volumeUuid, KVMStoragePool pool) {
         SP_LOG("StorpooolStorageAdaptor.disconnectPhysicalDisk: uuid=%s, pool=%s", volumeUuid, pool);
@@ -368,7 +578,10 @@ public class StorpoolStorageAdaptor implements StorageAdaptor {
 
     @Override
     public boolean refresh(KVMStoragePool pool) {
-        SP_LOG("StorpooolStorageAdaptor.refresh: pool=%s", pool);
+        SP_DEBUG("StorpooolStorageAdaptor.refresh: pool=%s", pool);
+        // the volumes may have been resized through the StorPool API
+        deviceSizesGeneration.incrementAndGet();
+        deviceSizes.clear();
         return true;
     }
 
@@ -477,7 +690,7 @@ public class StorpoolStorageAdaptor implements StorageAdaptor {
 
             destFile = new QemuImgFile(destDisk.getPath(), QemuImg.PhysicalDiskFormat.RAW);
 
-            qemu.convert(srcFile, destFile);
+            StorPoolQemuImg.convert(srcFile, destFile, timeout);
             attachOrDetachVolume("detach", "volume", volume);
             volumeFreeze(volume);
         } catch (QemuImgException | LibvirtException e) {
@@ -538,18 +751,37 @@ public class StorpoolStorageAdaptor implements StorageAdaptor {
         return type.equalsIgnoreCase("bzip2") || type.equalsIgnoreCase("gzip") || type.equalsIgnoreCase("zip");
     }
 
+    /**
+     * The parallel bzip2 decompressors (lbzip2, pbzip2) are used when they are installed.
+     * gzip data can't be decompressed in parallel, so it is extracted with gzip.
+     * A QCOW2 template can't be converted from a pipe, so it's still extracted to a file.
+     */
     private String getExtractCommandForDownloadedFile(String downloadedTemplateFile, String templateFile) {
         if (downloadedTemplateFile.endsWith(".zip")) {
             return "unzip -p " + downloadedTemplateFile + " | cat > " + templateFile;
         } else if (downloadedTemplateFile.endsWith(".bz2")) {
-            return "bunzip2 -c " + downloadedTemplateFile + " > " + templateFile;
+            return getDecompressor("lbzip2", "pbzip2", "bunzip2") + " -dc " + downloadedTemplateFile + " > " + templateFile;
         } else if (downloadedTemplateFile.endsWith(".gz")) {
-            return "gunzip -c " + downloadedTemplateFile + " > " + templateFile;
+            return "gzip -dc " + downloadedTemplateFile + " > " + templateFile;
         } else {
             throw new CloudRuntimeException("Unable to extract template " + downloadedTemplateFile);
         }
     }
 
+    private static String getDecompressor(String... commands) {
+        for (String command : commands) {
+            Boolean installed = installedCommands.get(command);
+            if (installed == null) {
+                installed = Script.runSimpleBashScript("which " + command) != null;
+                installedCommands.put(command, installed);
+            }
+            if (installed) {
+                return command;
+            }
+        }
+        return commands[commands.length - 1];
+    }
+
     private String getNameFromResponse(String resp, boolean tildeNeeded) {
         JsonParser jsonParser = new JsonParser();
         JsonObject respObj = (JsonObject) jsonParser.parse(resp);
@@ -53,6 +53,7 @@ import org.apache.cloudstack.storage.datastore.util.StorpoolUtil;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpApiResponse;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpConnectionDesc;
 import org.apache.cloudstack.storage.snapshot.BackupManager;
+import org.apache.cloudstack.storage.snapshot.StorpoolSnapshotStrategy;
 import org.apache.cloudstack.storage.to.PrimaryDataStoreTO;
 import org.apache.cloudstack.storage.to.SnapshotObjectTO;
 import org.apache.cloudstack.storage.to.TemplateObjectTO;
@@ -141,6 +142,8 @@ public class StorpoolPrimaryDataStoreDriver implements PrimaryDataStoreDriver {
     private ServiceOfferingDetailsDao serviceOfferingDetailDao;
     @Inject
     private StoragePoolHostDao storagePoolHostDao;
+    @Inject
+    private StorpoolSnapshotStrategy snapshotStrategy;
 
 
     @Override
@@ -364,7 +367,11 @@ public class StorpoolPrimaryDataStoreDriver implements PrimaryDataStoreDriver {
     @Override
     public void deleteAsync(DataStore dataStore, DataObject data, AsyncCompletionCallback<CommandResult> callback) {
         String err = null;
-        if (data.getType() == DataObjectType.VOLUME) {
+        if (data.getType() == DataObjectType.VOLUME && ((VolumeInfo)data).getPath() == null) {
+            // e.g. the old record of a volume migrated to another primary storage of the same StorPool cluster, the StorPool volume belongs to the new record
+            StorpoolUtil.spLog("StorpoolPrimaryDataStoreDriver.deleteAsync volume without a path, nothing to delete: uuid=%s, dataStore=%s", data.getUuid(),
+                    dataStore.getUuid());
+        } else if (data.getType() == DataObjectType.VOLUME) {
             try {
                 VolumeInfo vinfo = (VolumeInfo)data;
                 String name = StorpoolStorageAdaptor.getVolumeNameFromPath(vinfo.getPath(), true);
@@ -403,6 +410,16 @@ public class StorpoolPrimaryDataStoreDriver implements PrimaryDataStoreDriver {
         callback.complete(res);
     }
 
+    /**
+     * @return true if the agent based the backup of a snapshot on the backup of an older snapshot
+     */
+    private static boolean isIncrementalBackup(Answer answer) {
+        if (!(answer instanceof CopyCmdAnswer) || !(((CopyCmdAnswer)answer).getNewData() instanceof SnapshotObjectTO)) {
+            return false;
+        }
+        return ((SnapshotObjectTO)((CopyCmdAnswer)answer).getNewData()).getParentSnapshotPath() != null;
+    }
+
     private void logDataObject(final String pref, DataObject data) {
         final DataStore dstore = data.getDataStore();
         String name = null;
@@ -484,11 +501,14 @@ public class StorpoolPrimaryDataStoreDriver implements PrimaryDataStoreDriver {
                     answer = new CopyCmdAnswer(snapshot);
                 } else {
                     // copy snapshot to secondary storage (backup snapshot)
-                    cmd = new StorpoolBackupSnapshotCommand(srcData.getTO(), dstData.getTO(), StorPoolHelper.getTimeout(StorPoolHelper.BackupSnapshotWait, configDao), VirtualMachineManager.ExecuteInSequence.value());
+                    StorpoolBackupSnapshotCommand backupCmd = new StorpoolBackupSnapshotCommand(srcData.getTO(), dstData.getTO(),
+                            StorPoolHelper.getTimeout(StorPoolHelper.BackupSnapshotWait, configDao), VirtualMachineManager.ExecuteInSequence.value());
+                    cmd = backupCmd;
 
                     final String snapName =  StorpoolStorageAdaptor.getVolumeNameFromPath(((SnapshotInfo) srcData).getPath(), true);
                     SpConnectionDesc conn = StorpoolUtil.getSpConnection(srcData.getDataStore().getUuid(), srcData.getDataStore().getId(), storagePoolDetailsDao, primaryStoreDao);
                     try {
+                        Long parentId = snapshotStrategy.prepareIncrementalBackup((SnapshotInfo)srcData, dstData.getDataStore(), backupCmd, conn);
                         HostVO host = StorPoolHelper.findHostOnClusterByGlobalId(snapName, clusterDao, hostDao);
 
                         EndPoint ep = host != null ? RemoteHostEndPoint.getHypervisorHostEndPoint(host) : selector.select(srcData, dstData);
@@ -496,6 +516,9 @@ public class StorpoolPrimaryDataStoreDriver implements PrimaryDataStoreDriver {
                             err = "No remote endpoint to send command, check if host or ssvm is down?";
                         } else {
                             answer = ep.sendMessage(cmd);
+                            // the agent makes a full backup when the backup of the base snapshot is missing
+                            boolean incremental = parentId != null && answer != null && answer.getResult() && isIncrementalBackup(answer);
+                            snapshotStrategy.updateBackupParent((SnapshotInfo)srcData, dstData.getDataStore(), incremental ? parentId : 0);
                             // if error during snapshot backup, cleanup the StorPool snapshot
                             if (answer != null && !answer.getResult()) {
                                 StorpoolUtil.spLog(String.format("Error while backing-up snapshot '%s' - cleaning up StorPool snapshot. Error: %s", snapName, answer.getDetails()));
@@ -560,6 +583,10 @@ public class StorpoolPrimaryDataStoreDriver implements PrimaryDataStoreDriver {
                 String snapshotName = (templDataStoreVO != null && templDataStoreVO.getLocalDownloadPath() != null)
                         ? StorpoolStorageAdaptor.getVolumeNameFromPath(templDataStoreVO.getLocalDownloadPath(), true)
                         : null;
+                if (snapshotName == null) {
+                    // the template may be already on another primary storage in the same StorPool cluster
+                    snapshotName = StorPoolHelper.findSeededTemplateSnapshot(tinfo.getId(), dstData.getDataStore().getId(), conn, primaryStoreDao);
+                }
                 String name = tinfo.getUuid();
 
                 SpApiResponse resp = null;
@@ -854,6 +881,7 @@ public class StorpoolPrimaryDataStoreDriver implements PrimaryDataStoreDriver {
                 StorPoolHelper.addSnapshotDetails(snapshot.getId(), snapshot.getUuid(), snapTo.getPath(), _snapshotDetailsDao);
                 //add primary storage of snapshot
                 StorPoolHelper.addSnapshotDetails(snapshot.getId(), StorpoolUtil.SP_STORAGE_POOL_ID, String.valueOf(snapshot.getDataStore().getId()), _snapshotDetailsDao);
+                StorPoolHelper.cacheSnapshotLocation(snapshot.getId(), snapTo.getPath(), snapshot.getDataStore().getId());
                 StorpoolUtil.spLog("StorpoolPrimaryDataStoreDriverImpl.takeSnapshot: snapshot: name=%s, uuid=%s, volume: name=%s, uuid=%s", name, snapshot.getUuid(), volumeName, vinfo.getUuid());
             }
         } catch (Exception e) {
@@ -34,7 +34,9 @@ import org.apache.cloudstack.storage.datastore.db.PrimaryDataStoreDao;
 import org.apache.cloudstack.storage.datastore.db.StoragePoolDetailVO;
 import org.apache.cloudstack.storage.datastore.db.StoragePoolDetailsDao;
 import org.apache.cloudstack.storage.datastore.db.StoragePoolVO;
+import org.apache.cloudstack.storage.datastore.util.StorPoolApiBatch;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil;
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpApiError;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpApiResponse;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpConnectionDesc;
 import org.apache.cloudstack.storage.volume.datastore.PrimaryDataStoreHelper;
@@ -190,6 +192,7 @@ public class StorpoolPrimaryDataStoreLifeCycle implements PrimaryDataStoreLifeCy
             StorpoolUtil.spLog("    %s=%s", e.getKey(), e.getValue());
         }
         StorpoolUtil.spLog("");
+        StorpoolUtil.invalidateSpConnection(storagePool.getId());
 
         log.debug("updateStoragePool");
         return;
@@ -283,24 +286,35 @@ public class StorpoolPrimaryDataStoreLifeCycle implements PrimaryDataStoreLifeCy
         List<VMTemplateStoragePoolVO> lstTemplatePoolRefs = vmTemplatePoolDao.listByPoolId(storagePoolId);
 
         if (lstTemplatePoolRefs != null) {
+            StorPoolApiBatch batch = new StorPoolApiBatch();
             for (VMTemplateStoragePoolVO templatePoolRef : lstTemplatePoolRefs) {
-                SpApiResponse resp = StorpoolUtil.snapshotDelete(
-                        StorpoolStorageAdaptor.getVolumeNameFromPath(templatePoolRef.getLocalDownloadPath(), true), conn);
-                if (resp.getError() != null) {
-                    throw new CloudRuntimeException(String.format("Could not delete StorPool's snapshot from template_spool_ref table due to %s", resp.getError()));
+                batch.snapshotDelete(StorpoolStorageAdaptor.getVolumeNameFromPath(templatePoolRef.getLocalDownloadPath(), true), conn);
+            }
+            List<SpApiResponse> responses = batch.execute();
+            SpApiError error = null;
+            for (int i = 0; i < responses.size(); i++) {
+                if (responses.get(i).getError() != null) {
+                    error = error != null ? error : responses.get(i).getError();
+                    continue;
                 }
-                vmTemplatePoolDao.remove(templatePoolRef.getId());
+                vmTemplatePoolDao.remove(lstTemplatePoolRefs.get(i).getId());
+            }
+            if (error != null) {
+                throw new CloudRuntimeException(String.format("Could not delete StorPool's snapshot from template_spool_ref table due to %s", error));
             }
         }
         boolean isDeleted = dataStoreHelper.deletePrimaryDataStore(store);
         if (isDeleted) {
             List<StoragePoolDetailVO> volumesOnHosts = storagePoolDetailsDao.listDetails(storagePoolId);
+            StorPoolApiBatch batch = new StorPoolApiBatch();
             for (StoragePoolDetailVO storagePoolDetailVO : volumesOnHosts) {
                 if (storagePoolDetailVO.getValue() != null && storagePoolDetailVO.getName().contains(StorpoolUtil.SP_VOLUME_ON_CLUSTER)) {
-                    StorpoolUtil.volumeDelete(StorpoolStorageAdaptor.getVolumeNameFromPath(storagePoolDetailVO.getValue(), true), conn);
+                    batch.volumeDelete(StorpoolStorageAdaptor.getVolumeNameFromPath(storagePoolDetailVO.getValue(), true), conn);
                 }
             }
+            batch.execute();
             storagePoolDetailsDao.removeDetails(storagePoolId);
+            StorpoolUtil.invalidateSpConnection(storagePoolId);
         }
         return isDeleted;
     }
@@ -0,0 +1,226 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one
+ * or more contributor license agreements.  See the NOTICE file
+ * distributed with this work for additional information
+ * regarding copyright ownership.  The ASF licenses this file
+ * to you under the Apache License, Version 2.0 (the
+ * "License"); you may not use this file except in compliance
+ * with the License.  You may obtain a copy of the License at
+ *
+ *   http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing,
+ * software distributed under the License is distributed on an
+ * "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+ * KIND, either express or implied.  See the License for the
+ * specific language governing permissions and limitations
+ * under the License.
+ */
+package org.apache.cloudstack.storage.datastore.util;
+
+import java.util.ArrayList;
+import java.util.HashMap;
+import java.util.LinkedHashMap;
+import java.util.List;
+import java.util.Map;
+import java.util.concurrent.Callable;
+import java.util.concurrent.CompletableFuture;
+import java.util.concurrent.ExecutionException;
+
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpApiError;
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpApiResponse;
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpConnectionDesc;
+import org.apache.log4j.Logger;
+
+import com.cloud.utils.exception.CloudRuntimeException;
+
+/**
+ * Collects several StorPool API requests and sends them in parallel through
+ * StorPoolAsyncApi, instead of one serialized round trip per volume.
+ * The volume reassignments of a batch are merged in a single VolumesReassign
+ * request per API endpoint.
+ *
+ * The results are returned in the order in which the requests were added.
+ * A failed request does not stop the others, its result holds the error.
+ */
+public class StorPoolApiBatch {
+    private static final Logger log = Logger.getLogger(StorPoolApiBatch.class);
+
+    private final List<Callable<SpApiResponse>> requests = new ArrayList<>();
+    private final List<SpConnectionDesc> connections = new ArrayList<>();
+    private final Map<Integer, Map<String, Object>> reassigns = new HashMap<>();
+
+    public int size() {
+        return requests.size();
+    }
+
+    public int volumeCreate(final String name, final String parentName, final Long size, final String vmUuid, final String vcPolicy,
+            final String csTag, final Long iops, final SpConnectionDesc conn) {
+        return add(conn, new Callable<SpApiResponse>() {
+            @Override
+            public SpApiResponse call() {
+                return StorpoolUtil.volumeCreate(name, parentName, size, vmUuid, vcPolicy, csTag, iops, conn);
+            }
+        });
+    }
+
+    public int volumeCopy(final String name, final String baseOn, final String csTag, final Long iops, final SpConnectionDesc conn) {
+        return add(conn, new Callable<SpApiResponse>() {
+            @Override
+            public SpApiResponse call() {
+                return StorpoolUtil.volumeCopy(name, baseOn, csTag, iops, conn);
+            }
+        });
+    }
+
+    public int volumeUpdate(final String name, final Long newSize, final Boolean shrinkOk, final Long iops, final SpConnectionDesc conn) {
+        return add(conn, new Callable<SpApiResponse>() {
+            @Override
+            public SpApiResponse call() {
+                return StorpoolUtil.volumeUpdate(name, newSize, shrinkOk, iops, conn);
+            }
+        });
+    }
+
+    public int volumeUpdateTags(final String name, final String uuid, final Long iops, final String vcPolicy, final SpConnectionDesc conn) {
+        return add(conn, new Callable<SpApiResponse>() {
+            @Override
+            public SpApiResponse call() {
+                return StorpoolUtil.volumeUpadateTags(name, uuid, iops, conn, vcPolicy);
+            }
+        });
+    }
+
+    public int volumeDelete(final String name, final SpConnectionDesc conn) {
+        return add(conn, new Callable<SpApiResponse>() {
+            @Override
+            public SpApiResponse call() {
+                return StorpoolUtil.volumeDelete(name, conn);
+            }
+        });
+    }
+
+    public int snapshotDelete(final String name, final SpConnectionDesc conn) {
+        return add(conn, new Callable<SpApiResponse>() {
+            @Override
+            public SpApiResponse call() {
+                return StorpoolUtil.snapshotDelete(name, conn);
+            }
+        });
+    }
+
+    /**
+     * Adds a reassignment in the format of the VolumesReassign API, e.g.
+     * {"volume": name, "detach": "all", "force": true}
+     */
+    public int reassign(final Map<String, Object> reassignDesc, final SpConnectionDesc conn) {
+        final int index = add(conn, null);
+        reassigns.put(index, reassignDesc);
+        return index;
+    }
+
+    private int add(SpConnectionDesc conn, Callable<SpApiResponse> request) {
+        requests.add(request);
+        connections.add(conn);
+        return requests.size() - 1;
+    }
+
+    /**
+     * Sends all requests of the batch and waits for them to complete.
+     *
+     * @return the response of every request, in the order they were added
+     */
+    public List<SpApiResponse> execute() {
+        final SpApiResponse[] results = new SpApiResponse[requests.size()];
+        final Map<Integer, CompletableFuture<SpApiResponse>> futures = new LinkedHashMap<>();
+
+        for (final List<Integer> group : groupReassignsByEndpoint()) {
+            final Callable<SpApiResponse> merged = new Callable<SpApiResponse>() {
+                @Override
+                public SpApiResponse call() {
+                    return reassignGroup(group, results);
+                }
+            };
+            futures.put(-group.get(0) - 1, StorPoolAsyncApi.submit(connections.get(group.get(0)), merged));
+        }
+        for (int i = 0; i < requests.size(); i++) {
+            if (requests.get(i) != null) {
+                futures.put(i, StorPoolAsyncApi.submit(connections.get(i), requests.get(i)));
+            }
+        }
+
+        for (Map.Entry<Integer, CompletableFuture<SpApiResponse>> entry : futures.entrySet()) {
+            SpApiResponse resp;
+            try {
+                resp = entry.getValue().get();
+            } catch (InterruptedException e) {
+                Thread.currentThread().interrupt();
+                resp = errorResponse(e);
+            } catch (ExecutionException e) {
+                resp = errorResponse(e.getCause());
+            }
+            if (entry.getKey() >= 0) {
+                results[entry.getKey()] = resp;
+            } else if (resp.getError() != null) {
+                log.warn(String.format("StorPool batch reassign failed: %s", resp.getError()));
+            }
+        }
+
+        List<SpApiResponse> responses = new ArrayList<>(results.length);
+        for (SpApiResponse resp : results) {
+            responses.add(resp);
+        }
+        return responses;
+    }
+
+    private List<List<Integer>> groupReassignsByEndpoint() {
+        Map<String, List<Integer>> groups = new LinkedHashMap<>();
+        for (Integer index : reassigns.keySet()) {
+            SpConnectionDesc conn = connections.get(index);
+            String key = conn.getHostPort() + ";" + conn.getAuthToken();
+            List<Integer> group = groups.get(key);
+            if (group == null) {
+                group = new ArrayList<>();
+                groups.put(key, group);
+            }
+            group.add(index);
+        }
+        return new ArrayList<>(groups.values());
+    }
+
+    /**
+     * VolumesReassign is applied atomically. If the merged request fails, every
+     * reassignment is retried on its own, so each one gets its own result.
+     */
+    private SpApiResponse reassignGroup(List<Integer> group, SpApiResponse[] results) {
+        SpConnectionDesc conn = connections.get(group.get(0));
+        List<Map<String, Object>> json = new ArrayList<>();
+        for (Integer index : group) {
+            json.add(reassigns.get(index));
+        }
+        SpApiResponse resp = StorpoolUtil.volumesReassign(json, conn);
+        if (resp.getError() == null || group.size() == 1) {
+            for (Integer index : group) {
+                results[index] = resp;
+            }
+            return resp;
+        }
+        StorpoolUtil.spLog("Batched reassign of %s objects failed with %s, retrying one by one", group.size(), resp.getError());
+        for (Integer index : group) {
+            List<Map<String, Object>> single = new ArrayList<>();
+            single.add(reassigns.get(index));
+            results[index] = StorpoolUtil.volumesReassign(single, conn);
+        }
+        return resp;
+    }
+
+    private static SpApiResponse errorResponse(Throwable e) {
+        log.warn("StorPool batch request failed", e);
+        SpApiError error = new SpApiError();
+        error.setName(e instanceof CloudRuntimeException ? "requestFailed" : e.getClass().getSimpleName());
+        error.setDescr(e.getMessage());
+        SpApiResponse resp = new SpApiResponse();
+        resp.setError(error);
+        return resp;
+    }
+}
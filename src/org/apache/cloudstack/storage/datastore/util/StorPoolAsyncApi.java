@@ -0,0 +1,85 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one
+ * or more contributor license agreements.  See the NOTICE file
+ * distributed with this work for additional information
+ * regarding copyright ownership.  The ASF licenses this file
+ * to you under the Apache License, Version 2.0 (the
+ * "License"); you may not use this file except in compliance
+ * with the License.  You may obtain a copy of the License at
+ *
+ *   http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing,
+ * software distributed under the License is distributed on an
+ * "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+ * KIND, either express or implied.  See the License for the
+ * specific language governing permissions and limitations
+ * under the License.
+ */
+package org.apache.cloudstack.storage.datastore.util;
+
+import java.util.Map;
+import java.util.concurrent.Callable;
+import java.util.concurrent.CompletableFuture;
+import java.util.concurrent.CompletionException;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.LinkedBlockingQueue;
+import java.util.concurrent.ThreadPoolExecutor;
+import java.util.concurrent.TimeUnit;
+import java.util.function.Supplier;
+
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpApiResponse;
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpConnectionDesc;
+import org.apache.cloudstack.storage.snapshot.BackupManager;
+import org.apache.log4j.Logger;
+
+import com.cloud.utils.concurrency.NamedThreadFactory;
+
+/**
+ * Sends StorPool API requests asynchronously. The requests are sent by a small
+ * pool of threads per API endpoint, so at most sp.api.max.concurrent.requests
+ * requests run in parallel against one StorPool cluster, and the caller gets a
+ * CompletableFuture instead of waiting for the response. Used by StorPoolApiBatch.
+ */
+public class StorPoolAsyncApi {
+    private static final Logger log = Logger.getLogger(StorPoolAsyncApi.class);
+
+    private static final Map<String, ThreadPoolExecutor> executors = new ConcurrentHashMap<>();
+
+    private static ThreadPoolExecutor getExecutor(final String hostPort) {
+        ThreadPoolExecutor executor = executors.get(hostPort);
+        if (executor == null) {
+            synchronized (executors) {
+                executor = executors.get(hostPort);
+                if (executor == null) {
+                    int threads = BackupManager.ApiMaxConcurrentRequests.value();
+                    executor = new ThreadPoolExecutor(threads, threads, 60, TimeUnit.SECONDS, new LinkedBlockingQueue<Runnable>(),
+                            new NamedThreadFactory("StorPoolApi-" + hostPort));
+                    executor.allowCoreThreadTimeOut(true);
+                    executors.put(hostPort, executor);
+                    log.info(String.format("Created StorPool API request executor for %s with %s threads", hostPort, threads));
+                }
+            }
+        }
+        return executor;
+    }
+
+    /**
+     * Sends a request to the StorPool API endpoint of conn. An exception thrown by the
+     * request completes the future exceptionally.
+     */
+    public static CompletableFuture<SpApiResponse> submit(final SpConnectionDesc conn, final Callable<SpApiResponse> request) {
+        return CompletableFuture.supplyAsync(new Supplier<SpApiResponse>() {
+            @Override
+            public SpApiResponse get() {
+                try {
+                    return request.call();
+                } catch (RuntimeException e) {
+                    throw e;
+                } catch (Exception e) {
+                    throw new CompletionException(e);
+                }
+            }
+        }, getExecutor(conn.getHostPort()));
+    }
+}
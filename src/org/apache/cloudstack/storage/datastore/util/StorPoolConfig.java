@@ -0,0 +1,201 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one
+ * or more contributor license agreements.  See the NOTICE file
+ * distributed with this work for additional information
+ * regarding copyright ownership.  The ASF licenses this file
+ * to you under the Apache License, Version 2.0 (the
+ * "License"); you may not use this file except in compliance
+ * with the License.  You may obtain a copy of the License at
+ *
+ *   http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing,
+ * software distributed under the License is distributed on an
+ * "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+ * KIND, either express or implied.  See the License for the
+ * specific language governing permissions and limitations
+ * under the License.
+ */
+package org.apache.cloudstack.storage.datastore.util;
+
+import java.io.File;
+import java.io.IOException;
+import java.net.InetAddress;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.util.ArrayList;
+import java.util.Arrays;
+import java.util.Collections;
+import java.util.HashMap;
+import java.util.List;
+import java.util.Map;
+
+import org.apache.log4j.Logger;
+
+/**
+ * Reads the StorPool configuration (/etc/storpool.conf and /etc/storpool.conf.d/*.conf)
+ * the same way storpool_confget does, without running it. The files are parsed
+ * once and parsed again only when one of them is changed, added or removed.
+ *
+ * Values in a [hostname] section apply only to that host. Later values override
+ * earlier ones, the files in storpool.conf.d are read in alphabetical order.
+ */
+public final class StorPoolConfig {
+    private static final Logger log = Logger.getLogger(StorPoolConfig.class);
+
+    public static final String CONFIG_FILE = "/etc/storpool.conf";
+    public static final String CONFIG_DIR = "/etc/storpool.conf.d";
+    private static final String HOSTNAME_FILE = "/proc/sys/kernel/hostname";
+
+    // how often the files are checked for changes
+    private static final long CHECK_INTERVAL_MS = 1000;
+
+    private static final class Entry {
+        private final String section;
+        private final String key;
+        private final String value;
+
+        Entry(String section, String key, String value) {
+            this.section = section;
+            this.key = key;
+            this.value = value;
+        }
+    }
+
+    private static List<Entry> entries;
+    private static List<String> filesStamp;
+    private static long lastCheck;
+    private static final Map<String, Map<String, String>> hostConfigs = new HashMap<>();
+
+    private StorPoolConfig() {
+    }
+
+    /**
+     * @return the StorPool configuration of this host or null if there is no /etc/storpool.conf
+     */
+    public static Map<String, String> getConfig() {
+        return getConfig(getHostName());
+    }
+
+    /**
+     * @return the StorPool configuration of the given host or null if there is no /etc/storpool.conf
+     */
+    public static synchronized Map<String, String> getConfig(String hostName) {
+        reloadIfChanged();
+        if (entries == null) {
+            return null;
+        }
+        Map<String, String> config = hostConfigs.get(hostName);
+        if (config == null) {
+            config = new HashMap<>();
+            String shortName = hostName != null && hostName.contains(".") ? hostName.substring(0, hostName.indexOf('.')) : hostName;
+            for (Entry entry : entries) {
+                if (entry.section == null || entry.section.equals(hostName) || entry.section.equals(shortName)) {
+                    config.put(entry.key, entry.value);
+                }
+            }
+            config = Collections.unmodifiableMap(config);
+            hostConfigs.put(hostName, config);
+        }
+        return config;
+    }
+
+    public static String get(String key) {
+        Map<String, String> config = getConfig();
+        return config != null ? config.get(key) : null;
+    }
+
+    public static String getHostName() {
+        try {
+            String hostName = new String(Files.readAllBytes(new File(HOSTNAME_FILE).toPath()), StandardCharsets.UTF_8).trim();
+            if (!hostName.isEmpty()) {
+                return hostName;
+            }
+        } catch (IOException e) {
+            log.debug(String.format("Could not read %s: %s", HOSTNAME_FILE, e.getMessage()));
+        }
+        try {
+            return InetAddress.getLocalHost().getHostName();
+        } catch (IOException e) {
+            log.warn("Could not get the host name: " + e.getMessage());
+            return null;
+        }
+    }
+
+    private static void reloadIfChanged() {
+        long now = System.currentTimeMillis();
+        if (filesStamp != null && now - lastCheck < CHECK_INTERVAL_MS) {
+            return;
+        }
+        lastCheck = now;
+
+        List<File> files = configFiles();
+        List<String> stamp = new ArrayList<>();
+        for (File file : files) {
+            stamp.add(file.getPath() + ":" + file.lastModified() + ":" + file.length());
+        }
+        if (stamp.equals(filesStamp)) {
+            return;
+        }
+
+        hostConfigs.clear();
+        filesStamp = stamp;
+        if (files.isEmpty()) {
+            entries = null;
+            return;
+        }
+        List<Entry> parsed = new ArrayList<>();
+        for (File file : files) {
+            try {
+                parse(file, parsed);
+            } catch (IOException e) {
+                log.warn(String.format("Could not read StorPool configuration file %s: %s", file, e.getMessage()));
+            }
+        }
+        entries = parsed;
+        log.debug(String.format("Loaded StorPool configuration from %s", files));
+    }
+
+    private static List<File> configFiles() {
+        List<File> files = new ArrayList<>();
+        File main = new File(CONFIG_FILE);
+        if (!main.isFile()) {
+            return files;
+        }
+        files.add(main);
+        File[] confD = new File(CONFIG_DIR).listFiles();
+        if (confD != null) {
+            Arrays.sort(confD);
+            for (File file : confD) {
+                if (file.isFile() && file.getName().endsWith(".conf")) {
+                    files.add(file);
+                }
+            }
+        }
+        return files;
+    }
+
+    private static void parse(File file, List<Entry> parsed) throws IOException {
+        String section = null;
+        for (String line : Files.readAllLines(file.toPath(), StandardCharsets.UTF_8)) {
+            line = line.trim();
+            if (line.isEmpty() || line.startsWith("#")) {
+                continue;
+            }
+            if (line.startsWith("[") && line.endsWith("]")) {
+                section = line.substring(1, line.length() - 1).trim();
+                continue;
+            }
+            int idx = line.indexOf('=');
+            if (idx <= 0) {
+                continue;
+            }
+            String key = line.substring(0, idx).trim();
+            String value = line.substring(idx + 1).trim();
+            if (value.length() >= 2 && (value.charAt(0) == '"' || value.charAt(0) == '\'') && value.charAt(value.length() - 1) == value.charAt(0)) {
+                value = value.substring(1, value.length() - 1);
+            }
+            parsed.add(new Entry(section, key, value));
+        }
+    }
+}
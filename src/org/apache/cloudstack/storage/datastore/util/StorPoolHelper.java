@@ -4,7 +4,9 @@ import java.io.IOException;
 import java.sql.PreparedStatement;
 import java.sql.Timestamp;
 import java.text.SimpleDateFormat;
+import java.util.Collections;
 import java.util.HashMap;
+import java.util.LinkedHashMap;
 import java.util.List;
 import java.util.Map;
 
@@ -17,6 +19,7 @@ import org.apache.cloudstack.storage.datastore.db.StoragePoolVO;
 import org.apache.cloudstack.storage.datastore.db.TemplateDataStoreDao;
 import org.apache.cloudstack.storage.datastore.db.TemplateDataStoreVO;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpApiResponse;
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpConnectionDesc;
 import org.apache.cloudstack.storage.snapshot.BackupManager;
 import org.apache.cloudstack.storage.to.VolumeObjectTO;
 import org.apache.commons.collections.CollectionUtils;
@@ -35,6 +38,7 @@ import com.cloud.hypervisor.kvm.storage.StorpoolStorageAdaptor;
 import com.cloud.server.ResourceTag;
 import com.cloud.server.ResourceTag.ResourceObjectType;
 import com.cloud.storage.DataStoreRole;
+import com.cloud.storage.VMTemplateStorageResourceAssoc.Status;
 import com.cloud.storage.VMTemplateStoragePoolVO;
 import com.cloud.storage.VolumeVO;
 import com.cloud.storage.dao.SnapshotDetailsDao;
@@ -81,28 +85,104 @@ public class StorPoolHelper {
         snapshotDetailsDao.persist(details);
     }
 
+    /**
+     * The StorPool name (globalId) of a CloudStack snapshot and the id of the primary storage
+     * on which it was taken, if it is known
+     */
+    public static final class SnapshotLocation {
+        private final String name;
+        private final Long poolId;
+
+        SnapshotLocation(String name, Long poolId) {
+            this.name = name;
+            this.poolId = poolId;
+        }
+
+        public String getName() {
+            return name;
+        }
+
+        public Long getPoolId() {
+            return poolId;
+        }
+    }
+
+    private static final int MAX_CACHED_SNAPSHOT_LOCATIONS = 10000;
+
+    // the most recently used snapshots, so the revert, delete and copy of a snapshot do not look it up in the DB
+    private static final Map<Long, SnapshotLocation> snapshotLocations = Collections.synchronizedMap(
+            new LinkedHashMap<Long, SnapshotLocation>(16, 0.75f, true) {
+                @Override
+                protected boolean removeEldestEntry(Map.Entry<Long, SnapshotLocation> eldest) {
+                    return size() > MAX_CACHED_SNAPSHOT_LOCATIONS;
+                }
+            });
+
+    /**
+     * Remembers the StorPool snapshot of a CloudStack snapshot, e.g. when it is taken.
+     */
+    public static void cacheSnapshotLocation(Long snapshotId, String snapshotPath, Long poolId) {
+        String name = StorpoolStorageAdaptor.getVolumeNameFromPath(snapshotPath, true);
+        if (name != null) {
+            snapshotLocations.put(snapshotId, new SnapshotLocation(name, poolId));
+        }
+    }
+
+    /**
+     * Forgets the StorPool snapshot of a CloudStack snapshot, when it is deleted.
+     */
+    public static void invalidateSnapshotLocation(Long snapshotId) {
+        snapshotLocations.remove(snapshotId);
+    }
+
     public static String getSnapshotName(Long snapshotId, String snapshotUuid, SnapshotDataStoreDao snapshotStoreDao,
             SnapshotDetailsDao snapshotDetailsDao) {
+        SnapshotLocation location = getSnapshotLocation(snapshotId, snapshotUuid, snapshotStoreDao, snapshotDetailsDao);
+        return location != null ? location.getName() : null;
+    }
 
+    /**
+     * @return the StorPool name and primary storage of a snapshot, or null if the snapshot is not on StorPool
+     */
+    public static SnapshotLocation getSnapshotLocation(Long snapshotId, String snapshotUuid, SnapshotDataStoreDao snapshotStoreDao,
+            SnapshotDetailsDao snapshotDetailsDao) {
+        SnapshotLocation location = snapshotLocations.get(snapshotId);
+        if (location != null) {
+            return location;
+        }
+
+        String name = null;
         SnapshotDetailsVO snapshotDetails = snapshotDetailsDao.findDetail(snapshotId, snapshotUuid);
 
         if (snapshotDetails != null) {
-            return StorpoolStorageAdaptor.getVolumeNameFromPath(snapshotDetails.getValue(), true);
+            name = StorpoolStorageAdaptor.getVolumeNameFromPath(snapshotDetails.getValue(), true);
         } else {
             List<SnapshotDataStoreVO> snapshots = snapshotStoreDao.findBySnapshotId(snapshotId);
             if (!CollectionUtils.isEmpty(snapshots)) {
                 for (SnapshotDataStoreVO snapshotDataStoreVO : snapshots) {
-                    String name = StorpoolStorageAdaptor.getVolumeNameFromPath(snapshotDataStoreVO.getInstallPath(), true);
+                    name = StorpoolStorageAdaptor.getVolumeNameFromPath(snapshotDataStoreVO.getInstallPath(), true);
                     if (name == null) {
                         continue;
                     } else {
                         addSnapshotDetails(snapshotId, snapshotUuid, snapshotDataStoreVO.getInstallPath(), snapshotDetailsDao);
-                        return name;
+                        break;
                     }
                 }
             }
         }
-        return null;
+        if (name == null) {
+            return null;
+        }
+
+        Long poolId = null;
+        SnapshotDetailsVO poolDetail = snapshotDetailsDao.findDetail(snapshotId, StorpoolUtil.SP_STORAGE_POOL_ID);
+        if (poolDetail != null) {
+            poolId = NumbersUtil.parseLong(poolDetail.getValue(), 0L);
+            poolId = poolId > 0 ? poolId : null;
+        }
+        location = new SnapshotLocation(name, poolId);
+        snapshotLocations.put(snapshotId, location);
+        return location;
     }
 
     public static void updateSnapshotDetailsValue(Long id, String valueOrName, String snapshotOrVolume) {
@@ -118,6 +198,10 @@ public class StorPoolHelper {
                 StorpoolUtil.spLog("Could not update snapshot detail with id=%s", id);
             }
             if (sql != null) {
+                if (snapshotOrVolume.equals("snapshot")) {
+                    // the detail is found by its own id, not by the snapshot id
+                    snapshotLocations.clear();
+                }
                 pstmt = txn.prepareAutoCloseStatement(sql);
                 pstmt.setString(1, valueOrName);
                 pstmt.setLong(2, id);
@@ -237,6 +321,41 @@ public class StorPoolHelper {
         return sc.find();
     }
 
+    /**
+     * Finds the StorPool snapshot of a template which was already seeded on another StorPool
+     * primary storage, in the same StorPool cluster as conn. A template on a new primary
+     * storage can be cloned from it, instead of downloaded again from secondary storage.
+     *
+     * @return the name of the snapshot or null if the template has to be downloaded
+     */
+    public static String findSeededTemplateSnapshot(long templateId, long poolId, SpConnectionDesc conn, PrimaryDataStoreDao primaryStoreDao) {
+        QueryBuilder<VMTemplateStoragePoolVO> sc = QueryBuilder.create(VMTemplateStoragePoolVO.class);
+        sc.and(sc.entity().getTemplateId(), Op.EQ, templateId);
+        sc.and(sc.entity().getDownloadState(), Op.EQ, Status.DOWNLOADED);
+        for (VMTemplateStoragePoolVO templatePoolRef : sc.list()) {
+            if (templatePoolRef.getPoolId() == poolId) {
+                continue;
+            }
+            StoragePoolVO pool = primaryStoreDao.findById(templatePoolRef.getPoolId());
+            if (pool == null || !StorpoolUtil.SP_PROVIDER_NAME.equals(pool.getStorageProviderName())) {
+                continue;
+            }
+            String name = StorpoolStorageAdaptor.getVolumeNameFromPath(templatePoolRef.getInstallPath(), true);
+            if (name == null) {
+                continue;
+            }
+            try {
+                if (StorpoolUtil.snapshotExistsInCluster(name, conn)) {
+                    StorpoolUtil.spLog("Template %s will be cloned from StorPool snapshot %s of primary storage %s", templateId, name, pool.getName());
+                    return name;
+                }
+            } catch (CloudRuntimeException e) {
+                StorpoolUtil.spLog("Could not check StorPool snapshot %s of template %s: %s", name, templateId, e.getMessage());
+            }
+        }
+        return null;
+    }
+
     public static void updateVmStoreTemplate(Long id, DataStoreRole role, String path,
             TemplateDataStoreDao templStoreDao) {
         TemplateDataStoreVO templ = templStoreDao.findByTemplate(id, role);
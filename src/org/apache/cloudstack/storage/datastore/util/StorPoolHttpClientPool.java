@@ -0,0 +1,178 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one
+ * or more contributor license agreements.  See the NOTICE file
+ * distributed with this work for additional information
+ * regarding copyright ownership.  The ASF licenses this file
+ * to you under the Apache License, Version 2.0 (the
+ * "License"); you may not use this file except in compliance
+ * with the License.  You may obtain a copy of the License at
+ *
+ *   http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing,
+ * software distributed under the License is distributed on an
+ * "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+ * KIND, either express or implied.  See the License for the
+ * specific language governing permissions and limitations
+ * under the License.
+ */
+package org.apache.cloudstack.storage.datastore.util;
+
+import java.io.IOException;
+import java.util.Date;
+import java.util.HashMap;
+import java.util.Map;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.Executors;
+import java.util.concurrent.ScheduledExecutorService;
+import java.util.concurrent.TimeUnit;
+import java.util.function.BiFunction;
+
+import org.apache.cloudstack.storage.snapshot.BackupManager;
+import org.apache.http.HttpResponse;
+import org.apache.http.conn.ConnectionKeepAliveStrategy;
+import org.apache.http.impl.client.CloseableHttpClient;
+import org.apache.http.impl.client.DefaultConnectionKeepAliveStrategy;
+import org.apache.http.impl.client.HttpClients;
+import org.apache.http.impl.conn.PoolingHttpClientConnectionManager;
+import org.apache.http.pool.PoolStats;
+import org.apache.http.protocol.HttpContext;
+import org.apache.log4j.Logger;
+
+import com.cloud.utils.concurrency.NamedThreadFactory;
+
+/**
+ * Keeps one keep-alive HTTP client per StorPool API endpoint (host:port), so
+ * the API requests reuse already established connections instead of building
+ * a new client and TCP connection for every call.
+ *
+ * The client of an endpoint which is no longer used, e.g. after a primary storage
+ * was removed or was changed to another endpoint, is closed after it was not used
+ * for sp.api.client.idle.timeout seconds.
+ */
+public class StorPoolHttpClientPool {
+    private static final Logger log = Logger.getLogger(StorPoolHttpClientPool.class);
+
+    private static final Map<String, PooledClient> clients = new ConcurrentHashMap<>();
+
+    private static final long EVICTION_INTERVAL = 60;
+    private static ScheduledExecutorService evictionExecutor;
+
+    private static class PooledClient {
+        private final PoolingHttpClientConnectionManager connectionManager;
+        private final CloseableHttpClient httpClient;
+        // when the client was handed out for the last time, in milliseconds
+        private volatile long lastUsed;
+
+        PooledClient(final int maxConnections, final long idleTimeout) {
+            connectionManager = new PoolingHttpClientConnectionManager();
+            connectionManager.setMaxTotal(maxConnections);
+            connectionManager.setDefaultMaxPerRoute(maxConnections);
+            connectionManager.setValidateAfterInactivity(2000);
+
+            httpClient = HttpClients.custom()
+                    .setConnectionManager(connectionManager)
+                    .setKeepAliveStrategy(keepAliveStrategy(idleTimeout))
+                    .evictExpiredConnections()
+                    .evictIdleConnections(idleTimeout, TimeUnit.SECONDS)
+                    .build();
+        }
+
+        void close() {
+            try {
+                httpClient.close();
+            } catch (IOException e) {
+                log.warn("Could not close StorPool API HTTP client: " + e.getMessage());
+            }
+        }
+    }
+
+    /**
+     * The StorPool API does not always send a Keep-Alive header, in which case
+     * the connection is kept for the configured idle timeout.
+     */
+    private static ConnectionKeepAliveStrategy keepAliveStrategy(final long idleTimeout) {
+        return new ConnectionKeepAliveStrategy() {
+            @Override
+            public long getKeepAliveDuration(HttpResponse response, HttpContext context) {
+                long duration = DefaultConnectionKeepAliveStrategy.INSTANCE.getKeepAliveDuration(response, context);
+                long max = TimeUnit.SECONDS.toMillis(idleTimeout);
+                return duration > 0 && duration < max ? duration : max;
+            }
+        };
+    }
+
+    public static CloseableHttpClient getHttpClient(final String hostPort) {
+        // the client is handed out and marked as used atomically with the eviction of idle clients
+        PooledClient client = clients.compute(hostPort, new BiFunction<String, PooledClient, PooledClient>() {
+            @Override
+            public PooledClient apply(String key, PooledClient client) {
+                if (client == null) {
+                    int maxConnections = BackupManager.ApiMaxConnections.value();
+                    long idleTimeout = BackupManager.ApiConnectionIdleTimeout.value();
+                    client = new PooledClient(maxConnections, idleTimeout);
+                    log.info(String.format("Created StorPool API connection pool for %s with max connections=%s and idle timeout=%ss",
+                            hostPort, maxConnections, idleTimeout));
+                    startEviction();
+                }
+                client.lastUsed = System.currentTimeMillis();
+                return client;
+            }
+        });
+        return client.httpClient;
+    }
+
+    private static synchronized void startEviction() {
+        if (evictionExecutor != null) {
+            return;
+        }
+        evictionExecutor = Executors.newSingleThreadScheduledExecutor(new NamedThreadFactory("StorPoolHttpClientEviction"));
+        evictionExecutor.scheduleWithFixedDelay(new Runnable() {
+            @Override
+            public void run() {
+                try {
+                    evictIdleClients();
+                } catch (RuntimeException e) {
+                    log.warn("Could not close the idle StorPool API HTTP clients: " + e.getMessage());
+                }
+            }
+        }, EVICTION_INTERVAL, EVICTION_INTERVAL, TimeUnit.SECONDS);
+    }
+
+    /**
+     * Closes the clients which were not handed out for sp.api.client.idle.timeout seconds
+     * and have no leased connections, i.e. no request is sent through them.
+     */
+    private static void evictIdleClients() {
+        final long minLastUsed = System.currentTimeMillis() - TimeUnit.SECONDS.toMillis(BackupManager.ApiClientIdleTimeout.value());
+        for (String hostPort : clients.keySet()) {
+            clients.computeIfPresent(hostPort, new BiFunction<String, PooledClient, PooledClient>() {
+                @Override
+                public PooledClient apply(String key, PooledClient client) {
+                    if (client.lastUsed > minLastUsed || client.connectionManager.getTotalStats().getLeased() > 0) {
+                        return client;
+                    }
+                    client.close();
+                    log.info(String.format("Closed the StorPool API connection pool for %s, it was not used since %s", key, new Date(client.lastUsed)));
+                    return null;
+                }
+            });
+        }
+    }
+
+    public static PoolStats getPoolStats(final String hostPort) {
+        PooledClient client = clients.get(hostPort);
+        return client != null ? client.connectionManager.getTotalStats() : null;
+    }
+
+    /**
+     * @return the leased, available, pending and max connections for every StorPool API endpoint
+     */
+    public static Map<String, PoolStats> getPoolStats() {
+        Map<String, PoolStats> stats = new HashMap<>();
+        for (Map.Entry<String, PooledClient> entry : clients.entrySet()) {
+            stats.put(entry.getKey(), entry.getValue().connectionManager.getTotalStats());
+        }
+        return stats;
+    }
+}
@@ -0,0 +1,182 @@
+/*
+ * Licensed to the Apache Software Foundation (ASF) under one
+ * or more contributor license agreements.  See the NOTICE file
+ * distributed with this work for additional information
+ * regarding copyright ownership.  The ASF licenses this file
+ * to you under the Apache License, Version 2.0 (the
+ * "License"); you may not use this file except in compliance
+ * with the License.  You may obtain a copy of the License at
+ *
+ *   http://www.apache.org/licenses/LICENSE-2.0
+ *
+ * Unless required by applicable law or agreed to in writing,
+ * software distributed under the License is distributed on an
+ * "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+ * KIND, either express or implied.  See the License for the
+ * specific language governing permissions and limitations
+ * under the License.
+ */
+package org.apache.cloudstack.storage.datastore.util;
+
+import java.io.BufferedWriter;
+import java.io.File;
+import java.io.FileOutputStream;
+import java.io.IOException;
+import java.io.OutputStreamWriter;
+import java.io.Writer;
+import java.nio.charset.StandardCharsets;
+import java.util.ArrayList;
+import java.util.List;
+import java.util.concurrent.ArrayBlockingQueue;
+import java.util.concurrent.BlockingQueue;
+import java.util.concurrent.TimeUnit;
+import java.util.concurrent.atomic.AtomicLong;
+
+import org.apache.commons.io.output.CountingOutputStream;
+import org.apache.commons.lang3.time.FastDateFormat;
+import org.apache.log4j.Logger;
+
+/**
+ * Writes the lines of a StorPool log file from a background thread. The callers
+ * only format the line and put it in a bounded queue, the writer thread writes
+ * the queued lines through a buffer and flushes once per batch.
+ *
+ * When the queue is full the new lines are dropped and their count is written
+ * in the log, so a slow disk never blocks the storage operations.
+ * The file is renamed with a timestamp suffix when more than maxSize bytes were
+ * written to it and, if rotateOnStart is set, when it is opened for the first time.
+ * When the file can't be renamed, the writer keeps appending to it and tries again
+ * after ROTATE_RETRY_INTERVAL.
+ */
+public class StorPoolLogWriter {
+    private static final Logger log = Logger.getLogger(StorPoolLogWriter.class);
+
+    private static final FastDateFormat TIMESTAMP_FORMAT = FastDateFormat.getInstance("yyyy-MM-dd HH:mm:ss,SSS");
+    private static final FastDateFormat ROTATE_FORMAT = FastDateFormat.getInstance("yyyyMMddHHmmss");
+    private static final String LINE_SEPARATOR = System.lineSeparator();
+
+    private static final int QUEUE_CAPACITY = 16384;
+    private static final int MAX_BATCH = 512;
+    private static final long ROTATE_RETRY_INTERVAL = TimeUnit.MINUTES.toMillis(10);
+
+    private final File file;
+    private final long maxSize;
+    private final BlockingQueue<String> queue = new ArrayBlockingQueue<>(QUEUE_CAPACITY);
+    private final AtomicLong dropped = new AtomicLong();
+    private final Thread writerThread;
+
+    private Writer writer;
+    // the bytes written to the file, counted after they are encoded
+    private CountingOutputStream counter;
+    private long sizeOnOpen;
+    private boolean rotate;
+    // the time of the next rotation attempt after a failed one
+    private long nextRotation;
+
+    public StorPoolLogWriter(final File file, final long maxSize, final boolean rotateOnStart) {
+        this.file = file;
+        this.maxSize = maxSize;
+        this.rotate = rotateOnStart;
+        this.writerThread = new Thread(new Runnable() {
+            @Override
+            public void run() {
+                writeLoop();
+            }
+        }, "StorPoolLogWriter-" + file.getName());
+        writerThread.setDaemon(true);
+        writerThread.start();
+        Runtime.getRuntime().addShutdownHook(new Thread(new Runnable() {
+            @Override
+            public void run() {
+                flush();
+            }
+        }, "StorPoolLogWriter-shutdown-" + file.getName()));
+    }
+
+    /**
+     * Adds a line prefixed with the current time, without waiting for it to be written.
+     */
+    public void log(final String message) {
+        String line = TIMESTAMP_FORMAT.format(System.currentTimeMillis()) + " " + message;
+        if (!queue.offer(line)) {
+            dropped.incrementAndGet();
+        }
+    }
+
+    private void writeLoop() {
+        List<String> batch = new ArrayList<>(MAX_BATCH);
+        while (true) {
+            try {
+                String line = queue.poll(1, TimeUnit.SECONDS);
+                if (line == null) {
+                    continue;
+                }
+                batch.add(line);
+                queue.drainTo(batch, MAX_BATCH - 1);
+                write(batch);
+            } catch (InterruptedException e) {
+                return;
+            } catch (Exception e) {
+                log.warn(String.format("Could not write to %s: %s", file, e.getMessage()));
+            } finally {
+                batch.clear();
+            }
+        }
+    }
+
+    private synchronized void write(final List<String> lines) throws IOException {
+        if (writer == null) {
+            open();
+        }
+        long droppedLines = dropped.getAndSet(0);
+        if (droppedLines > 0) {
+            writeLine(TIMESTAMP_FORMAT.format(System.currentTimeMillis()) + " " + droppedLines + " log lines were dropped");
+        }
+        for (String line : lines) {
+            writeLine(line);
+        }
+        writer.flush();
+        if (sizeOnOpen + counter.getByteCount() > maxSize && System.currentTimeMillis() >= nextRotation) {
+            writer.close();
+            writer = null;
+            rotate = true;
+        }
+    }
+
+    private void writeLine(final String line) throws IOException {
+        writer.write(line);
+        writer.write(LINE_SEPARATOR);
+    }
+
+    private void open() throws IOException {
+        if (rotate && file.exists()) {
+            final File rotated = new File(file + "-" + ROTATE_FORMAT.format(System.currentTimeMillis()));
+            if (file.renameTo(rotated)) {
+                log.debug("Renamed " + file + " to " + rotated);
+                nextRotation = 0;
+            } else {
+                nextRotation = System.currentTimeMillis() + ROTATE_RETRY_INTERVAL;
+                log.warn("Unable to rename " + file + " to " + rotated + ", will try again in " + ROTATE_RETRY_INTERVAL / 1000 + " seconds");
+            }
+        } else if (!file.exists()) {
+            file.getParentFile().mkdirs();
+        }
+        counter = new CountingOutputStream(new FileOutputStream(file, true));
+        writer = new BufferedWriter(new OutputStreamWriter(counter, StandardCharsets.UTF_8), 64 * 1024);
+        sizeOnOpen = file.length();
+        rotate = false;
+    }
+
+    /**
+     * Writes the lines which are still queued, e.g. when the JVM exits.
+     */
+    public void flush() {
+        List<String> lines = new ArrayList<>();
+        queue.drainTo(lines);
+        try {
+            write(lines);
+        } catch (IOException e) {
+            log.warn(String.format("Could not flush %s: %s", file, e.getMessage()));
+        }
+    }
+}
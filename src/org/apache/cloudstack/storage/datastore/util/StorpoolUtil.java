@@ -22,19 +22,20 @@ import java.io.BufferedReader;
 import java.io.File;
 import java.io.IOException;
 import java.io.InputStreamReader;
-import java.io.PrintWriter;
 import java.io.UnsupportedEncodingException;
 import java.net.URI;
 import java.net.URISyntaxException;
-import java.sql.Timestamp;
-import java.text.SimpleDateFormat;
+import java.nio.charset.StandardCharsets;
 import java.util.ArrayList;
-import java.util.Calendar;
+import java.util.Collections;
 import java.util.HashMap;
 import java.util.LinkedHashMap;
 import java.util.List;
 import java.util.Map;
 import java.util.UUID;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.TimeUnit;
+import java.util.function.Consumer;
 
 import org.apache.cloudstack.storage.datastore.db.PrimaryDataStoreDao;
 import org.apache.cloudstack.storage.datastore.db.StoragePoolDetailVO;
@@ -43,15 +44,16 @@ import org.apache.cloudstack.storage.datastore.db.StoragePoolVO;
 import org.apache.cloudstack.storage.snapshot.BackupManager;
 import org.apache.cloudstack.storage.to.VolumeObjectTO;
 import org.apache.commons.lang3.StringUtils;
-import org.apache.http.HttpResponse;
 import org.apache.http.client.ClientProtocolException;
+import org.apache.http.client.methods.CloseableHttpResponse;
 import org.apache.http.client.methods.HttpGet;
 import org.apache.http.client.methods.HttpPost;
 import org.apache.http.client.methods.HttpRequestBase;
 import org.apache.http.entity.ContentType;
 import org.apache.http.entity.StringEntity;
 import org.apache.http.impl.client.CloseableHttpClient;
-import org.apache.http.impl.client.HttpClientBuilder;
+import org.apache.http.pool.PoolStats;
+import org.apache.http.util.EntityUtils;
 import org.apache.log4j.Logger;
 
 import com.cloud.hypervisor.kvm.storage.StorpoolStorageAdaptor;
@@ -59,16 +61,19 @@ import com.cloud.utils.exception.CloudRuntimeException;
 import com.cloud.utils.script.OutputInterpreter;
 import com.cloud.utils.script.Script;
 import com.google.gson.Gson;
-import com.google.gson.JsonArray;
 import com.google.gson.JsonElement;
 import com.google.gson.JsonObject;
+import com.google.gson.JsonParseException;
 import com.google.gson.JsonParser;
-import com.google.gson.JsonPrimitive;
+import com.google.gson.stream.JsonReader;
+import com.google.gson.stream.JsonToken;
 
 
 public class StorpoolUtil {
     private static final Logger log = Logger.getLogger(StorpoolUtil.class);
 
+    private static final Gson GSON = new Gson();
+
     private static JsonObject gitPropertiesJson = readGitPropertiesJson();
 
     private static JsonObject readGitPropertiesJson() {
@@ -88,43 +93,12 @@ public class StorpoolUtil {
         }
     }
 
-    private static final File spLogFile = new File("/var/log/cloudstack/management/storpool-plugin.log");
-    private static PrintWriter spLogPrinterWriter = spLogFileInitialize();
-
-    private static PrintWriter spLogFileInitialize() {
-        try {
-            log.info("INITIALIZE SP-LOG_FILE");
-            if (spLogFile.exists()) {
-                final SimpleDateFormat sdf = new SimpleDateFormat("yyyyMMddHHmmss");
-                final Timestamp timestamp = new Timestamp(System.currentTimeMillis());
-                final File spLogFileRename = new File(spLogFile + "-" + sdf.format(timestamp));
-                final boolean ret = spLogFile.renameTo(spLogFileRename);
-                if (!ret) {
-                    log.warn("Unable to rename" + spLogFile + " to " + spLogFileRename);
-                } else {
-                    log.debug("Renamed " + spLogFile + " to " + spLogFileRename);
-                }
-            } else {
-                spLogFile.getParentFile().mkdirs();
-            }
-            return new PrintWriter(spLogFile);
-        } catch (Exception e) {
-            log.info("INITIALIZE SP-LOG_FILE: " + e.getMessage());
-            throw new RuntimeException(e);
-        }
-    }
+    private static final StorPoolLogWriter spLogWriter = new StorPoolLogWriter(new File("/var/log/cloudstack/management/storpool-plugin.log"), 107374182400L, true);
 
     public static void spLog(String fmt, Object... args) {
-        String timeStamp = new SimpleDateFormat("yyyy-MM-dd HH:mm:ss,ms").format(Calendar.getInstance().getTime());
-        spLogPrinterWriter.println(String.format(timeStamp +" "+fmt, args));
-        spLogPrinterWriter.flush();
-        if ( spLogFile.length() > 107374182400L ) {
-            spLogPrinterWriter.close();
-            spLogPrinterWriter = spLogFileInitialize();
-        }
+        spLogWriter.log(String.format(fmt, args));
     }
 
-
     public static final String SP_PROVIDER_NAME = "StorPool";
     public static final String SP_DEV_PATH = "/dev/storpool-byid/";
     public static final String SP_OLD_PATH = "/dev/storpool/";
@@ -194,39 +168,10 @@ public class StorpoolUtil {
             if (urlSplit.length == 1 && !urlSplit[0].contains("=")) {
                 this.templateName = url;
 
-                Script sc = new Script("storpool_confget", 0, log);
-                OutputInterpreter.AllLinesParser parser = new OutputInterpreter.AllLinesParser();
-
-                final String err = sc.execute(parser);
-                if (err != null) {
-                    final String errMsg = String.format("Could not execute storpool_confget. Error: %s", err);
-                    log.warn(errMsg);
-                    throw new CloudRuntimeException(errMsg);
-                }
-
-                String SP_API_HOST = null;
-                String SP_API_PORT = null;
-
-                for (String line: parser.getLines().split("\n")) {
-                    String[] toks = line.split("=");
-                    if( toks.length != 2 ) {
-                        continue;
-                    }
-
-                    switch (toks[0]) {
-                        case "SP_API_HTTP_HOST":
-                            SP_API_HOST = toks[1];
-                            break;
-
-                        case "SP_API_HTTP_PORT":
-                            SP_API_PORT = toks[1];
-                            break;
-
-                        case "SP_AUTH_TOKEN":
-                            this.authToken = toks[1];
-                            break;
-                    }
-                }
+                Map<String, String> config = getStorPoolConfig();
+                String SP_API_HOST = config.get("SP_API_HTTP_HOST");
+                String SP_API_PORT = config.get("SP_API_HTTP_PORT");
+                this.authToken = config.get("SP_AUTH_TOKEN");
 
                 if (SP_API_HOST == null)
                     throw new CloudRuntimeException("Invalid StorPool config. Missing SP_API_HTTP_HOST");
@@ -277,8 +222,80 @@ public class StorpoolUtil {
         }
     }
 
+    /**
+     * @return the StorPool configuration of this host. It is read directly from the
+     * config files, storpool_confget is used only if there is no /etc/storpool.conf
+     */
+    public static Map<String, String> getStorPoolConfig() {
+        Map<String, String> config = StorPoolConfig.getConfig();
+        if (config != null) {
+            return config;
+        }
+
+        Script sc = new Script("storpool_confget", 0, log);
+        OutputInterpreter.AllLinesParser parser = new OutputInterpreter.AllLinesParser();
+
+        final String err = sc.execute(parser);
+        if (err != null) {
+            final String errMsg = String.format("Could not execute storpool_confget. Error: %s", err);
+            log.warn(errMsg);
+            throw new CloudRuntimeException(errMsg);
+        }
+
+        config = new HashMap<>();
+        for (String line: parser.getLines().split("\n")) {
+            String[] toks = line.split("=");
+            if( toks.length != 2 ) {
+                continue;
+            }
+            config.put(toks[0], toks[1]);
+        }
+        return config;
+    }
+
+    private static final class CachedSpConnection {
+        private final SpConnectionDesc conn;
+        private final long expiresAt;
+
+        CachedSpConnection(SpConnectionDesc conn, long expiresAt) {
+            this.conn = conn;
+            this.expiresAt = expiresAt;
+        }
+    }
+
+    private static final Map<Long, CachedSpConnection> spConnections = new ConcurrentHashMap<>();
+
+    /**
+     * Returns the connection details of a StorPool primary storage. They are cached
+     * per storage pool for sp.connection.cache.ttl seconds, so the storage operations
+     * do not read the pool details and the alternative endpoint settings from the DB
+     * every time.
+     */
     public static SpConnectionDesc getSpConnection(String url, long poolId, StoragePoolDetailsDao poolDetails,
             PrimaryDataStoreDao storagePool) {
+        CachedSpConnection cached = spConnections.get(poolId);
+        long now = System.currentTimeMillis();
+        if (cached != null && cached.expiresAt > now) {
+            return cached.conn;
+        }
+        SpConnectionDesc conn = resolveSpConnection(url, poolId, poolDetails, storagePool);
+        long ttl = BackupManager.SpConnectionCacheTtl.value();
+        if (ttl > 0) {
+            spConnections.put(poolId, new CachedSpConnection(conn, now + TimeUnit.SECONDS.toMillis(ttl)));
+        }
+        return conn;
+    }
+
+    /**
+     * Drops the cached connection details of a storage pool, e.g. when the pool
+     * is updated or removed.
+     */
+    public static void invalidateSpConnection(long poolId) {
+        spConnections.remove(poolId);
+    }
+
+    private static SpConnectionDesc resolveSpConnection(String url, long poolId, StoragePoolDetailsDao poolDetails,
+            PrimaryDataStoreDao storagePool) {
         boolean isAlternateEndpointEnabled = BackupManager.AlternativeEndPointEnabled.valueIn(poolId);
         if (isAlternateEndpointEnabled) {
             String alternateEndpoint = BackupManager.AlternativeEndpoint.valueIn(poolId);
@@ -327,7 +344,7 @@ public class StorpoolUtil {
 
     public static class SpApiResponse {
         private SpApiError error;
-        public JsonElement fullJson;
+        private Object data;
 
         public SpApiResponse() {}
 
@@ -339,6 +356,71 @@ public class StorpoolUtil {
         {
             this.error = error;
         }
+
+        /**
+         * @return the data of the response, if it was decoded as the given type, otherwise null
+         */
+        public <T> T getData(Class<T> type) {
+            return type.isInstance(data) ? type.cast(data) : null;
+        }
+
+        public void setData(Object data) {
+            this.data = data;
+        }
+    }
+
+    /**
+     * The data of VolumeCreate and VolumeUpdate responses
+     */
+    public static class SpVolumeData {
+        private String name;
+        private String globalId;
+
+        public String getName() {
+            return name;
+        }
+
+        public String getGlobalId() {
+            return globalId;
+        }
+    }
+
+    /**
+     * The data of a VolumeSnapshot response
+     */
+    public static class SpSnapshotData extends SpVolumeData {
+        private String snapshotGlobalId;
+
+        public String getSnapshotGlobalId() {
+            return snapshotGlobalId;
+        }
+    }
+
+    /**
+     * A snapshot from the data of a VolumesGroupSnapshot response
+     */
+    public static class SpGroupSnapshotMember extends SpSnapshotData {
+        private String volume;
+        private String volumeGlobalId;
+
+        public String getVolume() {
+            return volume;
+        }
+
+        public String getVolumeGlobalId() {
+            return volumeGlobalId;
+        }
+    }
+
+    /**
+     * The data of a VolumesGroupSnapshot response
+     */
+    public static class SpGroupSnapshotData {
+        private List<SpGroupSnapshotMember> snapshots;
+
+        public List<SpGroupSnapshotMember> getSnapshots() {
+            return snapshots != null ? snapshots : Collections.<SpGroupSnapshotMember>emptyList();
+        }
     }
 
     public static String devPath(final String name) {
@@ -346,6 +428,11 @@ public class StorpoolUtil {
     }
 
     public static int getStorpoolId(final String hostName) {
+        Map<String, String> config = StorPoolConfig.getConfig(hostName);
+        if (config != null && config.get("SP_OURID") != null) {
+            return Integer.parseInt(config.get("SP_OURID"));
+        }
+
         Script sc = new Script("/usr/lib/storpool/confget", 0, log);
         sc.add("-f", "/etc/storpool.conf");
         sc.add("-s", hostName);
@@ -368,7 +455,44 @@ public class StorpoolUtil {
 //        throw new CloudRuntimeException(msg);
 //    }
 
-    private static SpApiResponse spApiRequest(HttpRequestBase req, String query, SpConnectionDesc conn) {
+    /**
+     * Reads the body of a StorPool API response
+     */
+    private interface SpResponseReader<T> {
+        T read(JsonReader reader) throws IOException;
+    }
+
+    /**
+     * Decodes the response in a single pass, the data is decoded as dataType or skipped if it is null
+     */
+    private static SpResponseReader<SpApiResponse> responseReader(final Class<?> dataType) {
+        return new SpResponseReader<SpApiResponse>() {
+            @Override
+            public SpApiResponse read(JsonReader reader) throws IOException {
+                SpApiResponse apiResp = new SpApiResponse();
+                reader.beginObject();
+                while (reader.hasNext()) {
+                    String field = reader.nextName();
+                    if (field.equals("error") && reader.peek() == JsonToken.BEGIN_OBJECT) {
+                        apiResp.setError(GSON.fromJson(reader, SpApiError.class));
+                    } else if (field.equals("data") && dataType != null
+                            && reader.peek() == (dataType.isArray() ? JsonToken.BEGIN_ARRAY : JsonToken.BEGIN_OBJECT)) {
+                        apiResp.setData(GSON.fromJson(reader, dataType));
+                    } else {
+                        reader.skipValue();
+                    }
+                }
+                reader.endObject();
+                return apiResp;
+            }
+        };
+    }
+
+    private static SpApiResponse spApiRequest(HttpRequestBase req, String query, SpConnectionDesc conn, Class<?> dataType) {
+        return spApiRequest(req, query, conn, responseReader(dataType));
+    }
+
+    private static <T> T spApiRequest(HttpRequestBase req, String query, SpConnectionDesc conn, SpResponseReader<T> responseReader) {
         String SP_API_HOST = null;
         String SP_API_PORT = null;
         String SP_AUTH_TOKEN = null;
@@ -386,27 +510,32 @@ public class StorpoolUtil {
         }
 
 
-        try (CloseableHttpClient httpClient = HttpClientBuilder.create().build()) {
-            final String qry = String.format("http://%s/ctrl/1.0/%s", conn.getHostPort(), query);
+        final CloseableHttpClient httpClient = StorPoolHttpClientPool.getHttpClient(conn.getHostPort());
+        final PoolStats stats = StorPoolHttpClientPool.getPoolStats(conn.getHostPort());
+        if (stats != null && stats.getLeased() >= stats.getMax()) {
+            log.debug(String.format("All connections to StorPool API %s are in use, request will wait. Pool stats: %s", conn.getHostPort(), stats));
+        }
+        final String qry = String.format("http://%s/ctrl/1.0/%s", conn.getHostPort(), query);
+        try {
             final URI uri = new URI(qry);
 
             req.setURI(uri);
             req.addHeader("Authorization", String.format("Storpool v1:%s", conn.getAuthToken()));
+        } catch (URISyntaxException ex) {
+            throw new CloudRuntimeException(ex.getMessage());
+        }
 
-            final HttpResponse resp = httpClient.execute(req);
+        try (CloseableHttpResponse resp = httpClient.execute(req)) {
 //            Storpool error message is returned in response body, so try and extract it
 //            final int respCode = resp.getStatusLine().getStatusCode();
 //            if (respCode != 200) {
 //                spError("Failed to execute %s. StorPool API requrned error code %d", qry, respCode);
 //            }
 
-            Gson gson = new Gson();
-            BufferedReader br = new BufferedReader(new InputStreamReader(resp.getEntity().getContent()));
-
-            JsonElement el = new JsonParser().parse(br);
-
-            SpApiResponse apiResp = gson.fromJson(el, SpApiResponse.class);
-            apiResp.fullJson = el;
+            JsonReader reader = new JsonReader(new BufferedReader(new InputStreamReader(resp.getEntity().getContent(), StandardCharsets.UTF_8)));
+            T apiResp = responseReader.read(reader);
+            // let the connection go back to the pool
+            EntityUtils.consume(resp.getEntity());
             return apiResp;
         } catch (UnsupportedEncodingException ex) {
             throw new CloudRuntimeException(ex.getMessage());
@@ -414,26 +543,33 @@ public class StorpoolUtil {
             throw new CloudRuntimeException(ex.getMessage());
         } catch (IOException ex) {
             throw new CloudRuntimeException(ex.getMessage());
-        } catch (URISyntaxException ex) {
-            throw new CloudRuntimeException(ex.getMessage());
+        } catch (IllegalStateException | JsonParseException ex) {
+            throw new CloudRuntimeException(String.format("Invalid response from StorPool API %s: %s", qry, ex.getMessage()));
         }
     }
 
     private static SpApiResponse GET(String query, SpConnectionDesc conn) {
-        return spApiRequest(new HttpGet(), query, conn);
+        return GET(query, conn, null);
+    }
+
+    private static SpApiResponse GET(String query, SpConnectionDesc conn, Class<?> dataType) {
+        return spApiRequest(new HttpGet(), query, conn, dataType);
     }
 
     private static SpApiResponse POST(String query, Object json, SpConnectionDesc conn) {
+        return POST(query, json, conn, null);
+    }
+
+    private static SpApiResponse POST(String query, Object json, SpConnectionDesc conn, Class<?> dataType) {
         HttpPost req = new HttpPost();
         if (json != null) {
-            Gson gson = new Gson();
-            String js = gson.toJson(json);
+            String js = GSON.toJson(json);
             StringEntity input = new StringEntity(js, ContentType.APPLICATION_JSON);
             log.info("Request:" + js);
             req.setEntity(input);
         }
 
-        return spApiRequest(req, query, conn);
+        return spApiRequest(req, query, conn, dataType);
     }
 
 
@@ -447,18 +583,174 @@ public class StorpoolUtil {
         return resp.getError() == null ? true : objectExists(resp.getError());
     }
 
-    public static JsonArray snapshotsList(SpConnectionDesc conn) {
-        SpApiResponse resp = GET("MultiCluster/SnapshotsList", conn);
-        JsonObject obj = resp.fullJson.getAsJsonObject();
-        JsonArray data = obj.getAsJsonArray("data");
-        return data;
+    /**
+     * Unlike snapshotExists, checks only the StorPool cluster of the API endpoint of conn,
+     * where the snapshot can be used as a parent without being transferred first
+     */
+    public static boolean snapshotExistsInCluster(final String name, SpConnectionDesc conn) {
+        SpApiResponse resp = GET("Snapshot/" + name, conn);
+        return resp.getError() == null ? true : objectExists(resp.getError());
     }
 
-    public static JsonArray volumesList(SpConnectionDesc conn) {
-        SpApiResponse resp = GET("MultiCluster/VolumesList", conn);
-        JsonObject obj = resp.fullJson.getAsJsonObject();
-        JsonArray data = obj.getAsJsonArray("data");
-        return data;
+    /**
+     * Checks only the StorPool cluster of the API endpoint of conn, like snapshotExistsInCluster
+     */
+    public static boolean volumeExistsInCluster(final String name, SpConnectionDesc conn) {
+        SpApiResponse resp = GET("Volume/" + name, conn);
+        return resp.getError() == null ? true : objectExists(resp.getError());
+    }
+
+    /**
+     * The fields of a StorPool volume or snapshot needed by CloudStack, read from
+     * the VolumesList and SnapshotsList API calls
+     */
+    public static class SpObjectInfo {
+        private String name;
+        private String globalId;
+        private long size;
+        private String csTag;
+        private String uuid;
+        private boolean deleted;
+        private String clusterId;
+        private String templateName;
+        private long creationTimestamp;
+
+        public String getName() {
+            return name;
+        }
+
+        public String getGlobalId() {
+            return globalId;
+        }
+
+        public long getSize() {
+            return size;
+        }
+
+        public String getCsTag() {
+            return csTag;
+        }
+
+        public String getUuid() {
+            return uuid;
+        }
+
+        public boolean isDeleted() {
+            return deleted;
+        }
+
+        public String getClusterId() {
+            return clusterId;
+        }
+
+        public String getTemplateName() {
+            return templateName;
+        }
+
+        /**
+         * @return the time when the snapshot was created, in seconds, or 0 for volumes
+         */
+        public long getCreationTimestamp() {
+            return creationTimestamp;
+        }
+    }
+
+    /**
+     * Lists all snapshots. The response is parsed while it is received and every
+     * snapshot is passed to the consumer, without keeping the whole list in memory.
+     */
+    public static void snapshotsList(SpConnectionDesc conn, Consumer<SpObjectInfo> consumer) {
+        objectsList("MultiCluster/SnapshotsList", conn, consumer);
+    }
+
+    /**
+     * Lists all volumes. The response is parsed while it is received and every
+     * volume is passed to the consumer, without keeping the whole list in memory.
+     */
+    public static void volumesList(SpConnectionDesc conn, Consumer<SpObjectInfo> consumer) {
+        objectsList("MultiCluster/VolumesList", conn, consumer);
+    }
+
+    private static void objectsList(final String query, SpConnectionDesc conn, final Consumer<SpObjectInfo> consumer) {
+        SpApiError error = spApiRequest(new HttpGet(), query, conn, new SpResponseReader<SpApiError>() {
+            @Override
+            public SpApiError read(JsonReader reader) throws IOException {
+                SpApiError error = null;
+                reader.beginObject();
+                while (reader.hasNext()) {
+                    String field = reader.nextName();
+                    if (field.equals("data") && reader.peek() == JsonToken.BEGIN_ARRAY) {
+                        reader.beginArray();
+                        while (reader.hasNext()) {
+                            consumer.accept(readObjectInfo(reader));
+                        }
+                        reader.endArray();
+                    } else if (field.equals("error") && reader.peek() == JsonToken.BEGIN_OBJECT) {
+                        error = GSON.fromJson(reader, SpApiError.class);
+                    } else {
+                        reader.skipValue();
+                    }
+                }
+                reader.endObject();
+                return error;
+            }
+        });
+        if (error != null) {
+            throw new CloudRuntimeException(String.format("Could not list StorPool objects with %s due to %s", query, error));
+        }
+    }
+
+    private static SpObjectInfo readObjectInfo(JsonReader reader) throws IOException {
+        SpObjectInfo info = new SpObjectInfo();
+        reader.beginObject();
+        while (reader.hasNext()) {
+            String field = reader.nextName();
+            if (reader.peek() == JsonToken.NULL) {
+                reader.nextNull();
+                continue;
+            }
+            switch (field) {
+            case "name":
+                info.name = reader.nextString();
+                break;
+            case "globalId":
+                info.globalId = reader.nextString();
+                break;
+            case "size":
+                info.size = reader.nextLong();
+                break;
+            case "deleted":
+                info.deleted = reader.nextBoolean();
+                break;
+            case "clusterId":
+                info.clusterId = reader.nextString();
+                break;
+            case "templateName":
+                info.templateName = reader.nextString();
+                break;
+            case "creationTimestamp":
+                info.creationTimestamp = (long) reader.nextDouble();
+                break;
+            case "tags":
+                reader.beginObject();
+                while (reader.hasNext()) {
+                    String tag = reader.nextName();
+                    if (tag.equals("cs") && reader.peek() == JsonToken.STRING) {
+                        info.csTag = reader.nextString();
+                    } else if (tag.equals("uuid") && reader.peek() == JsonToken.STRING) {
+                        info.uuid = reader.nextString();
+                    } else {
+                        reader.skipValue();
+                    }
+                }
+                reader.endObject();
+                break;
+            default:
+                reader.skipValue();
+            }
+        }
+        reader.endObject();
+        return info;
     }
 
     private static boolean objectExists(SpApiError err) {
@@ -469,32 +761,30 @@ public class StorpoolUtil {
     }
 
     public static Long snapshotSize(final String name, SpConnectionDesc conn) {
-        SpApiResponse resp = GET("MultiCluster/Snapshot/" + name, conn);
-        JsonObject obj = resp.fullJson.getAsJsonObject();
+        SpApiResponse resp = GET("MultiCluster/Snapshot/" + name, conn, SpObjectInfo[].class);
 
         if (resp.getError() != null && !objectExists(resp.getError())) {
             return null;
         }
-        JsonObject data = obj.getAsJsonArray("data").get(0).getAsJsonObject();
-        return data.getAsJsonPrimitive("size").getAsLong();
+        return describedObject(resp).getSize();
     }
 
     public static String getSnapshotClusterID(String name, SpConnectionDesc conn) {
-        SpApiResponse resp = GET("MultiCluster/Snapshot/" + name, conn);
-        JsonObject obj = resp.fullJson.getAsJsonObject();
-
-        JsonObject data = obj.getAsJsonArray("data").get(0).getAsJsonObject();
-        JsonPrimitive clusterId = data.getAsJsonPrimitive("clusterId");
-        return clusterId != null ? clusterId.getAsString() : null;
+        SpApiResponse resp = GET("MultiCluster/Snapshot/" + name, conn, SpObjectInfo[].class);
+        return describedObject(resp).getClusterId();
     }
 
     public static String getVolumeClusterID(String name, SpConnectionDesc conn) {
-        SpApiResponse resp = GET("MultiCluster/Volume/" + name, conn);
-        JsonObject obj = resp.fullJson.getAsJsonObject();
+        SpApiResponse resp = GET("MultiCluster/Volume/" + name, conn, SpObjectInfo[].class);
+        return describedObject(resp).getClusterId();
+    }
 
-        JsonObject data = obj.getAsJsonArray("data").get(0).getAsJsonObject();
-        JsonPrimitive clusterId = data.getAsJsonPrimitive("clusterId");
-        return clusterId != null ? clusterId.getAsString() : null;
+    private static SpObjectInfo describedObject(SpApiResponse resp) {
+        SpObjectInfo[] data = resp.getData(SpObjectInfo[].class);
+        if (data == null || data.length == 0) {
+            throw new CloudRuntimeException(String.format("Could not describe StorPool object due to %s", resp.getError()));
+        }
+        return data[0];
     }
 
     public static SpApiResponse volumeCreate(final String name, final String parentName, final Long size, String vmUuid, String vcPolicy, String csTag, Long iops, SpConnectionDesc conn) {
@@ -506,7 +796,7 @@ public class StorpoolUtil {
         json.put("template", conn.getTemplateName());
         Map<String, String> tags = StorPoolHelper.addStorPoolTags(name, vmUuid, csTag, vcPolicy);
         json.put("tags", tags);
-        return POST("MultiCluster/VolumeCreate", json, conn);
+        return POST("MultiCluster/VolumeCreate", json, conn, SpVolumeData.class);
     }
 
     public static SpApiResponse volumeCreateWithDifferentTemplate(final String name, final String parentName, final Long size, String template, String vmUuid, String vcPolicy, String csTag, SpConnectionDesc conn) {
@@ -517,7 +807,7 @@ public class StorpoolUtil {
         json.put("template", template);
         Map<String, String> tags = StorPoolHelper.addStorPoolTags(name, vmUuid, csTag, vcPolicy);
         json.put("tags", tags);
-        return POST("MultiCluster/VolumeCreate", json, conn);
+        return POST("MultiCluster/VolumeCreate", json, conn, SpVolumeData.class);
     }
 
     public static SpApiResponse volumeCreate(SpConnectionDesc conn) {
@@ -528,7 +818,7 @@ public class StorpoolUtil {
         Map<String, String> tags = new HashMap<>();
         tags.put("cs", "check-volume-is-on-host");
         json.put("tags", tags);
-        return POST("MultiCluster/VolumeCreate", json, conn);
+        return POST("MultiCluster/VolumeCreate", json, conn, SpVolumeData.class);
     }
 
     public static SpApiResponse volumeCopy(final String name, final String baseOn, String csTag, Long iops, SpConnectionDesc conn) {
@@ -540,7 +830,7 @@ public class StorpoolUtil {
         json.put("template", conn.getTemplateName());
         Map<String, String> tags = StorPoolHelper.addStorPoolTags(name, null, csTag, null);
         json.put("tags", tags);
-        return POST("MultiCluster/VolumeCreate", json, conn);
+        return POST("MultiCluster/VolumeCreate", json, conn, SpVolumeData.class);
     }
 
     public static SpApiResponse volumeUpdateRename(final String name, String newName, String uuid, SpConnectionDesc conn) {
@@ -550,7 +840,7 @@ public class StorpoolUtil {
         tags.put("uuid", uuid);
         json.put("tags", tags);
 
-        return POST("MultiCluster/VolumeUpdate/" + name, json, conn);
+        return POST("MultiCluster/VolumeUpdate/" + name, json, conn, SpVolumeData.class);
     }
 
     public static SpApiResponse volumeUpdate(final String name, final Long newSize, final Boolean shrinkOk, Long iops, SpConnectionDesc conn) {
@@ -559,7 +849,7 @@ public class StorpoolUtil {
         json.put("size", newSize);
         json.put("shrinkOk", shrinkOk);
 
-        return POST("MultiCluster/VolumeUpdate/" + name, json, conn);
+        return POST("MultiCluster/VolumeUpdate/" + name, json, conn, SpVolumeData.class);
     }
 
     public static SpApiResponse volumeUpadateTags(final String name, final String uuid, Long iops, SpConnectionDesc conn, String vcPolicy) {
@@ -567,13 +857,13 @@ public class StorpoolUtil {
          Map<String, String> tags = StorPoolHelper.addStorPoolTags(null, uuid, null, vcPolicy);
          json.put("iops", iops);
          json.put("tags", tags);
-         return POST("MultiCluster/VolumeUpdate/" + name, json, conn);
+         return POST("MultiCluster/VolumeUpdate/" + name, json, conn, SpVolumeData.class);
     }
 
     public static SpApiResponse volumeUpadate(String name, String newTemplate,SpConnectionDesc conn) {
         Map<String, Object> json = new HashMap<>();
         json.put("template", newTemplate);
-        return POST("MultiCluster/VolumeUpdate/" + name, json, conn);
+        return POST("MultiCluster/VolumeUpdate/" + name, json, conn, SpVolumeData.class);
    }
 
     public static SpApiResponse volumeSnapshot(final String volumeName, final String snapshotName, String vmUuid, String csTag, String vcPolicy, SpConnectionDesc conn) {
@@ -582,7 +872,7 @@ public class StorpoolUtil {
         json.put("name", "");
         json.put("tags", tags);
 
-        return POST("MultiCluster/VolumeSnapshot/" + volumeName, json , conn);
+        return POST("MultiCluster/VolumeSnapshot/" + volumeName, json, conn, SpSnapshotData.class);
     }
 
     public static SpApiResponse volumesGroupSnapshot(final List<VolumeObjectTO> volumeTOs, final String vmUuid, final String snapshotName, String csTag, SpConnectionDesc conn) {
@@ -599,7 +889,7 @@ public class StorpoolUtil {
          json.put("tags", tags);
          json.put("volumes", volumes);
          log.info("json:"+ json);
-         return POST("MultiCluster/VolumesGroupSnapshot", json, conn);
+         return POST("MultiCluster/VolumesGroupSnapshot", json, conn, SpGroupSnapshotData.class);
     }
 
     public static SpApiResponse volumeRevert(final String name, final String snapshotName, SpConnectionDesc conn) {
@@ -660,21 +950,35 @@ public class StorpoolUtil {
         reassignDesc.put("force", true);
         json.add(reassignDesc);
 
-        return POST("MultiCluster/VolumesReassign", json, conn);
+        return volumesReassign(json, conn);
+    }
+
+    public static SpApiResponse volumesReassign(final List<Map<String, Object>> reassignDescs, SpConnectionDesc conn) {
+        return POST("MultiCluster/VolumesReassign", reassignDescs, conn);
     }
 
     public static String getSnapshotNameFromResponse(SpApiResponse resp, boolean tildeNeeded, String globalIdOrRemote) {
-        JsonObject obj = resp.fullJson.getAsJsonObject();
-        JsonPrimitive data = obj.getAsJsonObject("data").getAsJsonPrimitive(globalIdOrRemote);
-        String name = data !=null ? data.getAsString() : null;
+        SpSnapshotData data = resp.getData(SpSnapshotData.class);
+        String name = null;
+        if (data != null) {
+            switch (globalIdOrRemote) {
+            case GLOBAL_ID:
+                name = data.getSnapshotGlobalId();
+                break;
+            case "globalId":
+                name = data.getGlobalId();
+                break;
+            default:
+                name = data.getName();
+            }
+        }
         name = name != null ? !tildeNeeded ? name : "~" + name : name;
         return name;
     }
 
     public static String getNameFromResponse(SpApiResponse resp, boolean tildeNeeded) {
-        JsonObject obj = resp.fullJson.getAsJsonObject();
-        JsonPrimitive data = obj.getAsJsonObject("data").getAsJsonPrimitive("name");
-        String name = data !=null ? data.getAsString() : null;
+        SpVolumeData data = resp.getData(SpVolumeData.class);
+        String name = data != null ? data.getName() : null;
         name = name != null ? name.startsWith("~") && !tildeNeeded ? name.split("~")[1] : name : name;
         return name;
     }
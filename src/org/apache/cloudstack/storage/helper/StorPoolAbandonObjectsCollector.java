@@ -1,36 +1,60 @@
 package org.apache.cloudstack.storage.helper;
 
-import java.sql.PreparedStatement;
-import java.sql.ResultSet;
-import java.sql.SQLException;
+import java.io.BufferedReader;
+import java.io.BufferedWriter;
+import java.io.IOException;
+import java.nio.charset.StandardCharsets;
+import java.nio.file.Files;
+import java.nio.file.Path;
+import java.nio.file.Paths;
+import java.nio.file.StandardCopyOption;
+import java.util.ArrayList;
+import java.util.Collection;
+import java.util.Collections;
+import java.util.EnumMap;
+import java.util.EnumSet;
 import java.util.HashMap;
+import java.util.HashSet;
+import java.util.LinkedHashMap;
 import java.util.List;
 import java.util.Map;
+import java.util.Set;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.ExecutionException;
+import java.util.concurrent.ExecutorService;
 import java.util.concurrent.Executors;
+import java.util.concurrent.Future;
 import java.util.concurrent.ScheduledExecutorService;
 import java.util.concurrent.TimeUnit;
+import java.util.function.BiConsumer;
+import java.util.function.Consumer;
 
 import javax.inject.Inject;
 
 import org.apache.cloudstack.framework.config.ConfigKey;
 import org.apache.cloudstack.framework.config.Configurable;
+import org.apache.cloudstack.framework.config.dao.ConfigurationDao;
 import org.apache.cloudstack.managed.context.ManagedContextRunnable;
 import org.apache.cloudstack.storage.datastore.db.PrimaryDataStoreDao;
 import org.apache.cloudstack.storage.datastore.db.StoragePoolDetailsDao;
 import org.apache.cloudstack.storage.datastore.db.StoragePoolVO;
 import org.apache.cloudstack.storage.datastore.util.StorPoolHelper;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil;
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpApiResponse;
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpConnectionDesc;
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpObjectInfo;
+import org.apache.cloudstack.storage.helper.StorPoolAbandonedObjectsEngine.ObjectType;
+import org.apache.cloudstack.storage.snapshot.BackupManager;
 import org.apache.log4j.Logger;
 
+import com.cloud.dc.ClusterVO;
+import com.cloud.dc.dao.ClusterDao;
 import com.cloud.utils.component.ManagerBase;
 import com.cloud.utils.concurrency.NamedThreadFactory;
-import com.cloud.utils.db.DB;
-import com.cloud.utils.db.Transaction;
-import com.cloud.utils.db.TransactionCallbackNoReturn;
-import com.cloud.utils.db.TransactionLegacy;
-import com.cloud.utils.db.TransactionStatus;
-import com.google.gson.JsonArray;
-import com.google.gson.JsonObject;
+import com.cloud.utils.crypt.DBEncryptionUtil;
+import com.cloud.utils.exception.CloudRuntimeException;
+import com.google.gson.Gson;
+import com.google.gson.JsonSyntaxException;
 
 public class StorPoolAbandonObjectsCollector extends ManagerBase implements Configurable {
     private static Logger log = Logger.getLogger(StorPoolAbandonObjectsCollector.class);
@@ -38,9 +62,15 @@ public class StorPoolAbandonObjectsCollector extends ManagerBase implements Conf
     private PrimaryDataStoreDao storagePoolDao;
     @Inject
     private StoragePoolDetailsDao storagePoolDetailsDao;
+    @Inject
+    private ConfigurationDao configurationDao;
+    @Inject
+    private ClusterDao clusterDao;
 
     private ScheduledExecutorService _volumeTagsUpdateExecutor;
     private static final String ABANDON_LOG = "/var/log/cloudstack/management/storpool-abandoned-objects";
+    private static final String ABANDON_REPORT = "/var/log/cloudstack/management/storpool-abandoned-objects.jsonl";
+    private static final Gson GSON = new Gson();
 
 
     static final ConfigKey<Integer> volumeCheckupTagsInterval = new ConfigKey<Integer>("Advanced", Integer.class,
@@ -51,6 +81,52 @@ public class StorPoolAbandonObjectsCollector extends ManagerBase implements Conf
             "storpool.snapshot.tags.checkup", "86400",
             "Minimal interval (in seconds) to check and report if StorPool snapshot exists in CloudStack snapshots database",
             false);
+    static final ConfigKey<Integer> fullScanInterval = new ConfigKey<Integer>("Advanced", Integer.class,
+            "storpool.abandon.objects.full.scan.interval", "86400",
+            "Minimal interval (in seconds) between two checks of all StorPool volumes and snapshots in the CloudStack database. "
+            + "The checks between them look up only the StorPool objects created since the previous check",
+            true);
+    static final ConfigKey<String> volumesReconciliationState = new ConfigKey<String>("Hidden", String.class,
+            "storpool.volume.tags.checkup.state", "0:0",
+            "The time of the last full check of StorPool volumes and the digest of the volumes seen by the last check",
+            true);
+    static final ConfigKey<String> snapshotsReconciliationState = new ConfigKey<String>("Hidden", String.class,
+            "storpool.snapshot.tags.checkup.state", "0:0",
+            "The time of the last full check of StorPool snapshots and the digest of the snapshots seen by the last check",
+            true);
+    static final ConfigKey<String> abandonedObjectsEngine = new ConfigKey<String>("Advanced", String.class,
+            "storpool.abandon.objects.engine", StorPoolSqlAbandonedObjectsEngine.NAME,
+            "How the StorPool objects are compared with the CloudStack database: \"sql\" loads them in temporary tables and joins them, "
+            + "\"memory\" reads the StorPool paths from the CloudStack tables and compares them in memory",
+            true);
+    static final ConfigKey<Integer> listThreads = new ConfigKey<Integer>("Advanced", Integer.class,
+            "storpool.abandon.objects.list.threads", "4",
+            "Maximum number of StorPool API endpoints, whose volumes or snapshots are listed in parallel when checking for abandoned objects",
+            false);
+    static final ConfigKey<Boolean> reaperEnabled = new ConfigKey<Boolean>("Advanced", Boolean.class,
+            "storpool.abandon.objects.reaper.enabled", "false",
+            "Delete the StorPool volumes and snapshots, which are not known to CloudStack for at least storpool.abandon.objects.reaper.min.age hours. "
+            + "Only the objects in the StorPool template and cluster of a StorPool primary storage of this CloudStack are deleted",
+            true);
+    static final ConfigKey<Integer> reaperMinAge = new ConfigKey<Integer>("Advanced", Integer.class,
+            "storpool.abandon.objects.reaper.min.age", "168",
+            "Minimal time (in hours) since a StorPool object was found not known to CloudStack, before it is deleted",
+            true);
+    static final ConfigKey<Integer> reaperBatchSize = new ConfigKey<Integer>("Advanced", Integer.class,
+            "storpool.abandon.objects.reaper.batch.size", "10",
+            "Maximum number of abandoned StorPool objects deleted one after another, before a pause of storpool.abandon.objects.reaper.batch.interval seconds",
+            true);
+    static final ConfigKey<Integer> reaperBatchInterval = new ConfigKey<Integer>("Advanced", Integer.class,
+            "storpool.abandon.objects.reaper.batch.interval", "60",
+            "Pause (in seconds) between two batches of deleted abandoned StorPool objects",
+            true);
+
+    private ExecutorService listExecutor;
+    private final Map<String, StorPoolAbandonedObjectsEngine> engines = new HashMap<>();
+    // the objects not known to CloudStack, by device path
+    private final Map<String, StorPoolAbandonedObject> abandonedObjects = new ConcurrentHashMap<>();
+    private final Reconciliation volumesReconciliation = new Reconciliation("volumes", volumesReconciliationState);
+    private final Reconciliation snapshotsReconciliation = new Reconciliation("snapshots", snapshotsReconciliationState);
 
     @Override
     public String getConfigComponentName() {
@@ -59,7 +135,8 @@ public class StorPoolAbandonObjectsCollector extends ManagerBase implements Conf
 
     @Override
     public ConfigKey<?>[] getConfigKeys() {
-        return new ConfigKey<?>[] { volumeCheckupTagsInterval, snapshotCheckupTagsInterval };
+        return new ConfigKey<?>[] { volumeCheckupTagsInterval, snapshotCheckupTagsInterval, fullScanInterval, volumesReconciliationState,
+                snapshotsReconciliationState, abandonedObjectsEngine, listThreads, reaperEnabled, reaperMinAge, reaperBatchSize, reaperBatchInterval };
     }
 
     @Override
@@ -69,9 +146,15 @@ public class StorPoolAbandonObjectsCollector extends ManagerBase implements Conf
     }
 
     private void init() {
+        for (StorPoolAbandonedObjectsEngine engine : new StorPoolAbandonedObjectsEngine[] { new StorPoolSqlAbandonedObjectsEngine(),
+                new StorPoolInMemoryAbandonedObjectsEngine() }) {
+            engines.put(engine.getName(), engine);
+        }
         _volumeTagsUpdateExecutor = Executors.newScheduledThreadPool(2,
                 new NamedThreadFactory("StorPoolAbandonObjectsCollector"));
         StorPoolHelper.appendLogger(log, ABANDON_LOG, "abandon");
+        readReport();
+        listExecutor = Executors.newFixedThreadPool(Math.max(1, listThreads.value()), new NamedThreadFactory("StorPoolAbandonObjectsList"));
         if (volumeCheckupTagsInterval.value() > 0) {
             _volumeTagsUpdateExecutor.scheduleAtFixedRate(new StorPoolVolumesTagsUpdate(),
                     volumeCheckupTagsInterval.value(), volumeCheckupTagsInterval.value(), TimeUnit.SECONDS);
@@ -85,78 +168,24 @@ public class StorPoolAbandonObjectsCollector extends ManagerBase implements Conf
     class StorPoolVolumesTagsUpdate extends ManagedContextRunnable {
 
         @Override
-        @DB
         protected void runInContext() {
-            List<StoragePoolVO> spPools = storagePoolDao.findPoolsByProvider(StorpoolUtil.SP_PROVIDER_NAME);
+            final List<StoragePoolVO> spPools = storagePoolDao.findPoolsByProvider(StorpoolUtil.SP_PROVIDER_NAME);
             if (spPools != null && spPools.size() > 0) {
-                Map<String, String> volumes = new HashMap<>();
-                for (StoragePoolVO storagePoolVO : spPools) {
-                    try {
-                        JsonArray arr = StorpoolUtil.volumesList(StorpoolUtil.getSpConnection(storagePoolVO.getUuid(), storagePoolVO.getId(), storagePoolDetailsDao, storagePoolDao));
-                        volumes.putAll(getStorPoolNamesAndCsTag(arr));
-                    } catch (Exception e) {
-                        log.debug(String.format("Could not collect abandon objects due to %s", e.getMessage()));
-                    }
-                }
-                Transaction.execute(new TransactionCallbackNoReturn() {
+                final Map<String, StorPoolAbandonedObject> listedVolumes = new ConcurrentHashMap<>();
+                boolean complete = listObjects(spPools, false, new BiConsumer<SpConnectionDesc, SpObjectInfo>() {
                     @Override
-                    public void doInTransactionWithoutResult(TransactionStatus status) {
-                        TransactionLegacy txn = TransactionLegacy.open(TransactionLegacy.CLOUD_DB);
-
-                        try {
-                            PreparedStatement pstmt = txn.prepareAutoCloseStatement(
-                                    "CREATE TEMPORARY TABLE `cloud`.`volumes1`(`id` bigint unsigned NOT NULL auto_increment, `name` varchar(255) NOT NULL,`tag` varchar(255) NOT NULL, PRIMARY KEY (`id`))");
-                            pstmt.executeUpdate();
-
-                            pstmt = txn.prepareAutoCloseStatement(
-                                    "CREATE TEMPORARY TABLE `cloud`.`volumes_on_host1`(`id` bigint unsigned NOT NULL auto_increment, `name` varchar(255) NOT NULL,`tag` varchar(255) NOT NULL, PRIMARY KEY (`id`))");
-                            pstmt.executeUpdate();
-
-                        } catch (SQLException e) {
-                            log.info(String.format("[ignored] SQL failed to delete vm work job: %s ",
-                                    e.getLocalizedMessage()));
-                        } catch (Throwable e) {
-                            log.info(String.format("[ignored] caught an error during delete vm work job: %s",
-                                    e.getLocalizedMessage()));
-                        }
-
-                        try {
-                            PreparedStatement pstmt = txn.prepareStatement("INSERT INTO `cloud`.`volumes1` (name, tag) VALUES (?, ?)");
-                            PreparedStatement volumesOnHostpstmt = txn.prepareStatement("INSERT INTO `cloud`.`volumes_on_host1` (name, tag) VALUES (?, ?)");
-                            for (Map.Entry<String, String> volume : volumes.entrySet()) {
-                                if (volume.getValue().equals("volume")) {
-                                    addRecordToDb(volume.getKey(), pstmt, volume.getValue(), true);
-                                } else if (volume.getValue().equals("check-volume-is-on-host")) {
-                                    addRecordToDb(volume.getKey(), volumesOnHostpstmt, volume.getValue(), true);
-                                }
-                            }
-                            pstmt.executeBatch();
-                            volumesOnHostpstmt.executeBatch();
-                            String sql = "SELECT f.* FROM `cloud`.`volumes1` f LEFT JOIN `cloud`.`volumes` v ON f.name=v.path where v.path is NULL OR NOT state=?";
-                            findMissingRecordsInCS(txn, sql, "volume");
-
-                            String sqlVolumeOnHost = "SELECT f.* FROM `cloud`.`volumes_on_host1` f LEFT JOIN `cloud`.`storage_pool_details` v ON f.name=v.value where v.value is NULL";
-                            findMissingRecordsInCS(txn, sqlVolumeOnHost, "volumes_on_host");
-                        } catch (SQLException e) {
-                            log.info(String.format("[ignored] SQL failed due to: %s ",
-                                    e.getLocalizedMessage()));
-                        } catch (Throwable e) {
-                            log.info(String.format("[ignored] caught an error: %s",
-                                    e.getLocalizedMessage()));
-                        } finally {
-                            try {
-                                PreparedStatement pstmt = txn.prepareStatement("DROP TABLE `cloud`.`volumes1`");
-                                pstmt.executeUpdate();
-                                pstmt = txn.prepareStatement("DROP TABLE `cloud`.`volumes_on_host1`");
-                                pstmt.executeUpdate();
-                            } catch (SQLException e) {
-                                txn.close();
-                                log.info(String.format("createTemporaryVolumeTable %s", e.getMessage()));
-                            }
-                            txn.close();
+                    public void accept(SpConnectionDesc conn, SpObjectInfo volume) {
+                        if (isCloudStackObject(volume)
+                                && (volume.getCsTag().equals("volume") || volume.getCsTag().equals("check-volume-is-on-host"))) {
+                            ObjectType type = volume.getCsTag().equals("volume") ? ObjectType.VOLUME : ObjectType.VOLUME_ON_HOST;
+                            listedVolumes.put(volume.getName(), new StorPoolAbandonedObject(type, volume, conn));
                         }
                     }
                 });
+                Map<String, StorPoolAbandonedObject> volumes = volumesReconciliation.objectsToReconcile(listedVolumes, complete);
+                Set<ObjectType> failed = findMissingRecordsInCS(listedVolumes, volumes, false, complete);
+                volumesReconciliation.reconciled(listedVolumes, volumes, failed, complete);
+                reapAbandonedObjects(false);
             }
         }
     }
@@ -164,138 +193,497 @@ public class StorPoolAbandonObjectsCollector extends ManagerBase implements Conf
     class StorPoolSnapshotsTagsUpdate extends ManagedContextRunnable {
 
         @Override
-        @DB
         protected void runInContext() {
-            List<StoragePoolVO> spPools = storagePoolDao.findPoolsByProvider(StorpoolUtil.SP_PROVIDER_NAME);
-            Map<String, String> snapshots = new HashMap<String, String>();
+            final List<StoragePoolVO> spPools = storagePoolDao.findPoolsByProvider(StorpoolUtil.SP_PROVIDER_NAME);
             if (spPools != null && spPools.size() > 0) {
-                for (StoragePoolVO storagePoolVO : spPools) {
-                    try {
-                        JsonArray arr = StorpoolUtil.snapshotsList(StorpoolUtil.getSpConnection(storagePoolVO.getUuid(), storagePoolVO.getId(), storagePoolDetailsDao, storagePoolDao));
-                        snapshots.putAll(getStorPoolNamesAndCsTag(arr));
-                    } catch (Exception e) {
-                        log.debug(String.format("Cannot collect abandon objects dues to %s", e.getMessage()));
-                    }
-                }
-                Transaction.execute(new TransactionCallbackNoReturn() {
+                final Map<String, StorPoolAbandonedObject> listedSnapshots = new ConcurrentHashMap<>();
+                boolean complete = listObjects(spPools, true, new BiConsumer<SpConnectionDesc, SpObjectInfo>() {
                     @Override
-                    public void doInTransactionWithoutResult(TransactionStatus status) {
-                        TransactionLegacy txn = TransactionLegacy.open(TransactionLegacy.CLOUD_DB);
-
-                        try{
-                            PreparedStatement pstmt = txn.prepareAutoCloseStatement(
-                                    "CREATE TEMPORARY TABLE `cloud`.`snapshots1`(`id` bigint unsigned NOT NULL auto_increment, `name` varchar(255) NOT NULL,`tag` varchar(255) NOT NULL, PRIMARY KEY (`id`))");
-                            pstmt.executeUpdate();
-
-                            pstmt = txn.prepareAutoCloseStatement(
-                                    "CREATE TEMPORARY TABLE `cloud`.`vm_snapshots1`(`id` bigint unsigned NOT NULL auto_increment, `name` varchar(255) NOT NULL,`tag` varchar(255) NOT NULL, PRIMARY KEY (`id`))");
-                            pstmt.executeUpdate();
-
-                            pstmt = txn.prepareAutoCloseStatement(
-                                    "CREATE TEMPORARY TABLE `cloud`.`vm_templates1`(`id` bigint unsigned NOT NULL auto_increment, `name` varchar(255) NOT NULL,`tag` varchar(255) NOT NULL, PRIMARY KEY (`id`))");
-                            pstmt.executeUpdate();
-                        } catch (SQLException e) {
-                            log.info(String.format("[ignored] SQL failed to delete vm work job: %s ",
-                                    e.getLocalizedMessage()));
-                        } catch (Throwable e) {
-                            log.info(String.format("[ignored] caught an error during delete vm work job: %s",
-                                    e.getLocalizedMessage()));
-                        }
-
-                        try {
-                            PreparedStatement snapshotsPstmt = txn.prepareStatement("INSERT INTO `cloud`.`snapshots1` (name, tag) VALUES (?, ?)");
-                            PreparedStatement groupSnapshotsPstmt = txn.prepareStatement("INSERT INTO `cloud`.`vm_snapshots1` (name, tag) VALUES (?, ?)");
-                            PreparedStatement templatePstmt = txn.prepareStatement("INSERT INTO `cloud`.`vm_templates1` (name, tag) VALUES (?, ?)");
-                            for (Map.Entry<String, String> snapshot : snapshots.entrySet()) {
-                                if (!snapshot.getValue().equals("group") && !snapshot.getValue().equals("template")) {
-                                    addRecordToDb(snapshot.getKey(), snapshotsPstmt, snapshot.getValue(), true);
-                                } else if (snapshot.getValue().equals("group")) {
-                                    addRecordToDb(snapshot.getKey(), groupSnapshotsPstmt, snapshot.getValue(), true);
-                                } else if (snapshot.getValue().equals("template")) {
-                                    addRecordToDb(snapshot.getKey(), templatePstmt, snapshot.getValue(), true);
-                                }
-                            }
-                            snapshotsPstmt.executeBatch();
-                            groupSnapshotsPstmt.executeBatch();
-                            templatePstmt.executeBatch();
-
-                            String sqlSnapshots = "SELECT f.* FROM `cloud`.`snapshots1` f LEFT JOIN `cloud`.`snapshot_details` v ON f.name=v.value where v.value is NULL";
-                            findMissingRecordsInCS(txn, sqlSnapshots, "snapshot");
-
-                            String sqlVmSnapshots = "SELECT f.* FROM `cloud`.`vm_snapshots1` f LEFT JOIN `cloud`.`vm_snapshot_details` v ON f.name=v.value where v.value is NULL";
-                            findMissingRecordsInCS(txn, sqlVmSnapshots, "snapshot");
-
-                            String sqlTemplates = "SELECT temp.*"
-                                    + " FROM `cloud`.`vm_templates1` temp"
-                                    + " LEFT JOIN `cloud`.`template_store_ref` store"
-                                    + " ON temp.name=store.local_path"
-                                    + " LEFT JOIN `cloud`.`template_spool_ref` spool"
-                                    + " ON temp.name=spool.local_path"
-                                    + " where store.local_path is NULL"
-                                    + " and spool.local_path is NULL";
-                            findMissingRecordsInCS(txn, sqlTemplates, "snapshot");
-                        } catch (SQLException e) {
-                            log.info(String.format("[ignored] SQL failed due to: %s ",
-                                    e.getLocalizedMessage()));
-                        } catch (Throwable e) {
-                            log.info(String.format("[ignored] caught an error: %s",
-                                    e.getLocalizedMessage()));
-                        } finally {
-                            try {
-                                PreparedStatement pstmt = txn.prepareStatement("DROP TABLE `cloud`.`snapshots1`");
-                                pstmt.executeUpdate();
-                                pstmt = txn.prepareStatement("DROP TABLE `cloud`.`vm_snapshots1`");
-                                pstmt.executeUpdate();
-                                pstmt = txn.prepareStatement("DROP TABLE `cloud`.`vm_templates1`");
-                                pstmt.executeUpdate();
-                            } catch (SQLException e) {
-                                txn.close();
-                                log.info(String.format("createTemporaryVolumeTable %s", e.getMessage()));
+                    public void accept(SpConnectionDesc conn, SpObjectInfo snapshot) {
+                        if (isCloudStackObject(snapshot)) {
+                            ObjectType type = ObjectType.SNAPSHOT;
+                            if (snapshot.getCsTag().equals("group")) {
+                                type = ObjectType.VM_SNAPSHOT;
+                            } else if (snapshot.getCsTag().equals("template")) {
+                                type = ObjectType.TEMPLATE;
                             }
-                            txn.close();
+                            listedSnapshots.put(snapshot.getName(), new StorPoolAbandonedObject(type, snapshot, conn));
                         }
                     }
                 });
+                Map<String, StorPoolAbandonedObject> snapshots = snapshotsReconciliation.objectsToReconcile(listedSnapshots, complete);
+                Set<ObjectType> failed = findMissingRecordsInCS(listedSnapshots, snapshots, true, complete);
+                snapshotsReconciliation.reconciled(listedSnapshots, snapshots, failed, complete);
+                reapAbandonedObjects(true);
+            }
+        }
+    }
+
+    /**
+     * Lists the volumes or the snapshots of all StorPool primary storages. The primary storages
+     * which use the same API endpoint are listed once, and the distinct endpoints are listed in
+     * parallel, by at most storpool.abandon.objects.list.threads threads. The consumer is called
+     * concurrently from these threads, with the endpoint which listed the object.
+     *
+     * @return false if some of the endpoints could not be listed
+     */
+    private boolean listObjects(List<StoragePoolVO> spPools, final boolean snapshots, final BiConsumer<SpConnectionDesc, SpObjectInfo> consumer) {
+        boolean complete = true;
+        Map<String, SpConnectionDesc> endpoints = new LinkedHashMap<>();
+        for (StoragePoolVO storagePoolVO : spPools) {
+            try {
+                SpConnectionDesc conn = StorpoolUtil.getSpConnection(storagePoolVO.getUuid(), storagePoolVO.getId(), storagePoolDetailsDao, storagePoolDao);
+                String key = conn.getHostPort() + ";" + conn.getAuthToken();
+                if (!endpoints.containsKey(key)) {
+                    endpoints.put(key, conn);
+                }
+            } catch (Exception e) {
+                complete = false;
+                log.debug(String.format("Could not collect abandon objects of primary storage %s due to %s", storagePoolVO.getName(), e.getMessage()));
+            }
+        }
+
+        final String objects = snapshots ? "snapshots" : "volumes";
+        Map<SpConnectionDesc, Future<?>> listings = new LinkedHashMap<>();
+        for (final SpConnectionDesc conn : endpoints.values()) {
+            listings.put(conn, listExecutor.submit(new Runnable() {
+                @Override
+                public void run() {
+                    final long start = System.currentTimeMillis();
+                    final long[] count = new long[1];
+                    Consumer<SpObjectInfo> counter = new Consumer<SpObjectInfo>() {
+                        @Override
+                        public void accept(SpObjectInfo object) {
+                            count[0]++;
+                            consumer.accept(conn, object);
+                        }
+                    };
+                    if (snapshots) {
+                        StorpoolUtil.snapshotsList(conn, counter);
+                    } else {
+                        StorpoolUtil.volumesList(conn, counter);
+                    }
+                    log.info(String.format("Listed %s StorPool %s from %s in %s ms", count[0], objects, conn.getHostPort(),
+                            System.currentTimeMillis() - start));
+                }
+            }));
+        }
+        for (Map.Entry<SpConnectionDesc, Future<?>> listing : listings.entrySet()) {
+            try {
+                listing.getValue().get();
+            } catch (InterruptedException e) {
+                Thread.currentThread().interrupt();
+                complete = false;
+            } catch (ExecutionException e) {
+                complete = false;
+                log.info(String.format("Could not list StorPool %s from %s due to %s", objects, listing.getKey().getHostPort(), e.getCause().getMessage()));
+            }
+        }
+        return complete;
+    }
+
+    /**
+     * Groups StorPool objects by type, with the device paths under which CloudStack keeps them. The
+     * objects created with a plain name are included also with their path before the migration to global IDs.
+     */
+    private static Map<ObjectType, Map<String, String>> groupByType(Collection<StorPoolAbandonedObject> objects) {
+        Map<ObjectType, Map<String, String>> byType = new EnumMap<>(ObjectType.class);
+        for (StorPoolAbandonedObject object : objects) {
+            Map<String, String> ofType = byType.get(object.getType());
+            if (ofType == null) {
+                ofType = new HashMap<>();
+                byType.put(object.getType(), ofType);
+            }
+            ofType.put(object.getPath(), object.getTag());
+            if (object.getLegacyPath() != null) {
+                ofType.put(object.getLegacyPath(), object.getTag());
+            }
+        }
+        return byType;
+    }
+
+    /**
+     * @param abandoned the paths found by the engine, as returned by findAbandoned or findWithoutRecords
+     * @return true if CloudStack knows the object neither by its path nor by its path before the migration to global IDs
+     */
+    private static boolean isAbandoned(StorPoolAbandonedObject object, Map<String, String> abandoned) {
+        return abandoned.containsKey(object.getPath()) && (object.getLegacyPath() == null || abandoned.containsKey(object.getLegacyPath()));
+    }
+
+    /**
+     * Remembers which StorPool objects were already checked in the CloudStack database, so that a
+     * check looks up only the objects created since its previous run. All objects are checked again
+     * by a full scan every storpool.abandon.objects.full.scan.interval seconds, which finds also the
+     * objects whose CloudStack records were removed after they had been checked.
+     *
+     * The time of the last full scan and a digest of the objects seen by the last check are kept in
+     * the DB, so after a restart an unchanged set of objects is not checked again. An object is
+     * seen only when the check of its type succeeded, and the state is kept only when all checks did.
+     */
+    private class Reconciliation {
+        private final String objects;
+        private final ConfigKey<String> stateKey;
+        private Set<String> seen;
+        // the state kept by reconciled(), when the objects returned by objectsToReconcile() are checked
+        private String pendingState;
+
+        Reconciliation(String objects, ConfigKey<String> stateKey) {
+            this.objects = objects;
+            this.stateKey = stateKey;
+        }
+
+        /**
+         * @param listed every object listed in StorPool, by name
+         * @param complete false if some of the StorPool clusters could not be listed
+         * @return the objects which have to be checked in the CloudStack database
+         */
+        synchronized Map<String, StorPoolAbandonedObject> objectsToReconcile(Map<String, StorPoolAbandonedObject> listed, boolean complete) {
+            final long now = System.currentTimeMillis();
+            final long digest = digest(listed);
+            long lastFullScan = 0;
+            long lastDigest = 0;
+            String state = configurationDao.getValue(stateKey.key());
+            if (state != null && state.contains(":")) {
+                try {
+                    lastFullScan = Long.parseLong(state.substring(0, state.indexOf(':')));
+                    lastDigest = Long.parseLong(state.substring(state.indexOf(':') + 1));
+                } catch (NumberFormatException e) {
+                    log.debug(String.format("Invalid %s: %s", stateKey.key(), state));
+                }
+            }
+
+            boolean fullScan = now - lastFullScan >= TimeUnit.SECONDS.toMillis(fullScanInterval.value());
+            Map<String, StorPoolAbandonedObject> toReconcile;
+            if (fullScan) {
+                toReconcile = listed;
+            } else if (seen == null) {
+                // the first check after a restart, the objects are not known if they changed since the last check
+                fullScan = digest != lastDigest;
+                toReconcile = fullScan ? listed : Collections.<String, StorPoolAbandonedObject>emptyMap();
+            } else {
+                toReconcile = new HashMap<>();
+                for (Map.Entry<String, StorPoolAbandonedObject> object : listed.entrySet()) {
+                    if (!seen.contains(object.getKey())) {
+                        toReconcile.put(object.getKey(), object.getValue());
+                    }
+                }
+            }
+
+            pendingState = (fullScan ? now : lastFullScan) + ":" + digest;
+            log.debug(String.format("Checking %s of %s StorPool %s in the CloudStack database (full scan=%s)", toReconcile.size(), listed.size(),
+                    objects, fullScan));
+            return toReconcile;
+        }
+
+        /**
+         * Marks the listed objects as seen, except the ones which were to be checked, but whose
+         * type could not be checked in the CloudStack database. They are checked again next time.
+         *
+         * @param listed every object listed in StorPool, by name
+         * @param toReconcile the objects returned by objectsToReconcile
+         * @param failed the types of objects whose check failed
+         * @param complete false if some of the StorPool clusters could not be listed
+         */
+        synchronized void reconciled(Map<String, StorPoolAbandonedObject> listed, Map<String, StorPoolAbandonedObject> toReconcile,
+                Set<ObjectType> failed, boolean complete) {
+            Set<String> checked = new HashSet<>(listed.keySet());
+            for (Map.Entry<String, StorPoolAbandonedObject> object : toReconcile.entrySet()) {
+                if (failed.contains(object.getValue().getType())) {
+                    checked.remove(object.getKey());
+                }
+            }
+            if (complete) {
+                seen = checked;
+                if (failed.isEmpty() && pendingState != null) {
+                    configurationDao.update(stateKey.key(), DBEncryptionUtil.encrypt(pendingState));
+                }
+            } else {
+                // the objects of the unavailable clusters are not removed from the seen ones
+                if (seen == null) {
+                    seen = new HashSet<>();
+                }
+                seen.addAll(checked);
+            }
+            pendingState = null;
+            if (!failed.isEmpty()) {
+                log.debug(String.format("The StorPool %s of types %s will be checked again, their check failed", objects, failed));
+            }
+        }
+    }
+
+    /**
+     * A digest of a set of objects, which does not depend on the order in which they are listed.
+     */
+    private static long digest(Map<String, StorPoolAbandonedObject> objects) {
+        long digest = objects.size();
+        for (Map.Entry<String, StorPoolAbandonedObject> object : objects.entrySet()) {
+            // 64-bit FNV-1a hash of the name and the tag, summed over the objects
+            long hash = 0xcbf29ce484222325L;
+            for (byte b : (object.getKey() + "\0" + object.getValue().getTag()).getBytes(StandardCharsets.UTF_8)) {
+                hash ^= b & 0xff;
+                hash *= 0x100000001b3L;
+            }
+            digest += hash;
+        }
+        return digest;
+    }
+
+    /**
+     * Checks the objects in the CloudStack database and updates the abandoned objects of the same
+     * kind. The abandoned objects found by the previous checks are checked again, because their
+     * records could have been created since then, and are removed when StorPool does not list them.
+     *
+     * @param listed every object listed in StorPool, by name
+     * @param toReconcile the listed objects which were not checked by the previous check
+     * @param complete false if some of the StorPool clusters could not be listed
+     * @return the types of objects which could not be checked
+     */
+    private Set<ObjectType> findMissingRecordsInCS(Map<String, StorPoolAbandonedObject> listed, Map<String, StorPoolAbandonedObject> toReconcile,
+            boolean snapshots, boolean complete) {
+        Map<String, StorPoolAbandonedObject> candidates = new HashMap<>();
+        for (StorPoolAbandonedObject object : toReconcile.values()) {
+            candidates.put(object.getPath(), object);
+        }
+        for (StorPoolAbandonedObject reported : abandonedObjects.values()) {
+            if (reported.getType().isSnapshot() != snapshots) {
+                continue;
+            }
+            StorPoolAbandonedObject current = listed.get(reported.getName());
+            if (current != null) {
+                if (!current.getPath().equals(reported.getPath())) {
+                    // reported under the path built from its plain name, before the paths were built from the global ID
+                    abandonedObjects.remove(reported.getPath());
+                }
+                candidates.put(current.getPath(), current);
+            } else if (complete) {
+                abandonedObjects.remove(reported.getPath());
+            }
+        }
+
+        StorPoolAbandonedObjectsEngine engine = getEngine();
+        long now = System.currentTimeMillis();
+        Set<ObjectType> failed = EnumSet.noneOf(ObjectType.class);
+        for (Map.Entry<ObjectType, Map<String, String>> entry : groupByType(candidates.values()).entrySet()) {
+            ObjectType type = entry.getKey();
+            long start = System.currentTimeMillis();
+            Map<String, String> abandoned;
+            try {
+                abandoned = engine.findAbandoned(type, entry.getValue());
+            } catch (CloudRuntimeException e) {
+                log.info(String.format("[ignored] could not check StorPool %s objects: %s", type, e.getMessage()));
+                failed.add(type);
+                continue;
+            }
+            log.debug(String.format("Checked %s StorPool %s objects with the %s engine in %s ms", entry.getValue().size(), type, engine.getName(),
+                    System.currentTimeMillis() - start));
+            for (String path : entry.getValue().keySet()) {
+                StorPoolAbandonedObject object = candidates.get(path);
+                if (object == null) {
+                    // the path of an object before the migration to global IDs
+                    continue;
+                }
+                if (!isAbandoned(object, abandoned)) {
+                    abandonedObjects.remove(path);
+                    continue;
+                }
+                StorPoolAbandonedObject previous = abandonedObjects.get(path);
+                object.setFirstSeen(previous != null ? previous.getFirstSeen() : now);
+                abandonedObjects.put(path, object);
+                log.info(String.format(
+                        "CloudStack does not know about StorPool %s %s, it had to be a %s", type.getReportName(), path, object.getTag()));
+            }
+        }
+        writeReport();
+        return failed;
+    }
+
+    /**
+     * Deletes the abandoned objects of one kind, which were found for the first time at least
+     * storpool.abandon.objects.reaper.min.age hours ago, if storpool.abandon.objects.reaper.enabled is set.
+     * They are deleted in batches of storpool.abandon.objects.reaper.batch.size objects, with a pause of
+     * storpool.abandon.objects.reaper.batch.interval seconds between the batches.
+     *
+     * A StorPool cluster can be shared with other CloudStack installations or other users, whose objects
+     * are never known to this CloudStack. Only the objects in the StorPool template of one of the StorPool
+     * primary storages and in the StorPool cluster of a CloudStack cluster using them are deleted, the
+     * other ones are only reported.
+     */
+    private void reapAbandonedObjects(boolean snapshots) {
+        if (!reaperEnabled.value()) {
+            return;
+        }
+        long minFirstSeen = System.currentTimeMillis() - TimeUnit.HOURS.toMillis(reaperMinAge.value());
+        Set<String> templates = new HashSet<>();
+        Set<String> clusterIds = new HashSet<>();
+        findPrimaryStoragesScope(templates, clusterIds);
+        List<StorPoolAbandonedObject> expired = new ArrayList<>();
+        for (StorPoolAbandonedObject object : abandonedObjects.values()) {
+            // the objects without a connection were not listed by the last check
+            if (object.getType().isSnapshot() != snapshots || object.getConnection() == null || object.getFirstSeen() > minFirstSeen) {
+                continue;
+            }
+            if (templates.contains(object.getTemplate()) && clusterIds.contains(object.getClusterId())) {
+                expired.add(object);
+            } else {
+                log.debug(String.format("Not deleting abandoned StorPool %s %s, its template %s and cluster %s are not used by a StorPool primary storage",
+                        object.getType().getReportName(), object.getPath(), object.getTemplate(), object.getClusterId()));
+            }
+        }
+        expired = withoutRecords(expired);
+        if (expired.isEmpty()) {
+            return;
+        }
+        log.info(String.format("Deleting %s abandoned StorPool %s", expired.size(), snapshots ? "snapshots" : "volumes"));
+        int batchSize = Math.max(1, reaperBatchSize.value());
+        for (int i = 0; i < expired.size(); i += batchSize) {
+            if (i > 0) {
+                try {
+                    Thread.sleep(TimeUnit.SECONDS.toMillis(reaperBatchInterval.value()));
+                } catch (InterruptedException e) {
+                    Thread.currentThread().interrupt();
+                    break;
+                }
             }
+            deleteAbandonedObjects(expired.subList(i, Math.min(i + batchSize, expired.size())));
         }
+        writeReport();
     }
 
-    private void addRecordToDb(String name, PreparedStatement pstmt, String tag, boolean pathNeeded)
-            throws SQLException {
-        name = name.startsWith("~") ? name.split("~")[1] : name;
-        pstmt.setString(1, pathNeeded ? StorpoolUtil.devPath(name) : name);
-        pstmt.setString(2, tag);
-        pstmt.addBatch();
+    /**
+     * Collects the StorPool templates of the StorPool primary storages, and the StorPool cluster IDs
+     * (sp.cluster.id) of the CloudStack clusters which can use them. The primary storages whose
+     * connection details could not be read are left out.
+     */
+    private void findPrimaryStoragesScope(Set<String> templates, Set<String> clusterIds) {
+        for (StoragePoolVO pool : storagePoolDao.findPoolsByProvider(StorpoolUtil.SP_PROVIDER_NAME)) {
+            try {
+                SpConnectionDesc conn = StorpoolUtil.getSpConnection(pool.getUuid(), pool.getId(), storagePoolDetailsDao, storagePoolDao);
+                templates.add(conn.getTemplateName());
+            } catch (Exception e) {
+                log.debug(String.format("Could not read the StorPool template of primary storage %s due to %s", pool.getName(), e.getMessage()));
+                continue;
+            }
+            List<ClusterVO> clusters = pool.getClusterId() != null ? Collections.singletonList(clusterDao.findById(pool.getClusterId()))
+                    : clusterDao.listByZoneId(pool.getDataCenterId());
+            for (ClusterVO cluster : clusters) {
+                if (cluster == null) {
+                    continue;
+                }
+                String clusterId = BackupManager.StorPoolClusterId.valueIn(cluster.getId());
+                if (clusterId != null && !clusterId.equals(BackupManager.StorPoolClusterId.defaultValue())) {
+                    clusterIds.add(clusterId);
+                }
+            }
+        }
     }
 
-    private void findMissingRecordsInCS(TransactionLegacy txn, String sql, String object) throws SQLException {
-        ResultSet rs;
-        PreparedStatement pstmt2 = txn.prepareStatement(sql);
-        if (object.equals("volume")) {
-            pstmt2.setString(1, "Ready");
+    /**
+     * Checks the objects again before they are deleted, their records could have been created since
+     * the last check. It is done once per reaper run, with one read of the CloudStack tables per type.
+     * Only the objects without any record are returned, a volume which is not Ready is still used by CloudStack.
+     */
+    private List<StorPoolAbandonedObject> withoutRecords(List<StorPoolAbandonedObject> objects) {
+        StorPoolAbandonedObjectsEngine engine = getEngine();
+        List<StorPoolAbandonedObject> withoutRecords = new ArrayList<>();
+        for (Map.Entry<ObjectType, Map<String, String>> entry : groupByType(objects).entrySet()) {
+            ObjectType type = entry.getKey();
+            Map<String, String> abandoned;
+            try {
+                abandoned = engine.findWithoutRecords(type, entry.getValue());
+            } catch (CloudRuntimeException e) {
+                log.info(String.format("[ignored] could not check StorPool %s objects before deleting them: %s", type, e.getMessage()));
+                continue;
+            }
+            for (StorPoolAbandonedObject object : objects) {
+                // the objects with a record are removed from the abandoned ones by the next check, unless the record is not Ready
+                if (object.getType() == type && isAbandoned(object, abandoned)) {
+                    withoutRecords.add(object);
+                }
+            }
         }
-        rs = pstmt2.executeQuery();
-        String name = null;
-        while (rs.next()) {
-            name = rs.getString(2);
-            log.info(String.format(
-                    "CloudStack does not know about StorPool %s %s, it had to be a %s", object, name, rs.getString(3)));
+        return withoutRecords;
+    }
+
+    private void deleteAbandonedObjects(List<StorPoolAbandonedObject> batch) {
+        for (StorPoolAbandonedObject object : batch) {
+            ObjectType type = object.getType();
+            SpApiResponse resp = type.isSnapshot() ? StorpoolUtil.snapshotDelete(object.getName(), object.getConnection())
+                    : StorpoolUtil.volumeDelete(object.getName(), object.getConnection());
+            if (resp.getError() == null || resp.getError().getName().equals("objectDoesNotExist")) {
+                abandonedObjects.remove(object.getPath());
+                log.info(String.format("Deleted abandoned StorPool %s %s with tag %s and size %s", type.getReportName(), object.getPath(),
+                        object.getTag(), object.getSize()));
+            } else {
+                log.info(String.format("Could not delete abandoned StorPool %s %s due to %s", type.getReportName(), object.getPath(),
+                        resp.getError()));
+            }
         }
     }
 
-    private Map<String,String> getStorPoolNamesAndCsTag(JsonArray arr) {
-        Map<String, String> map = new HashMap<>();
-        for (int i = 0; i < arr.size(); i++) {
-            String name = arr.get(i).getAsJsonObject().get("name").getAsString();
-            String tag = null;
-            if (!name.startsWith("*") && !name.contains("@")) {
-                JsonObject tags = arr.get(i).getAsJsonObject().get("tags").getAsJsonObject();
-                if (tags != null && tags.getAsJsonPrimitive("cs") != null && !(arr.get(i).getAsJsonObject().get("deleted") != null && arr.get(i).getAsJsonObject().get("deleted").getAsBoolean())) {
-                    tag = tags.getAsJsonPrimitive("cs").getAsString();
-                    map.put(name, tag);
+    /**
+     * @return the StorPool objects which were not known to CloudStack when they were checked for the last time
+     */
+    public List<StorPoolAbandonedObject> getAbandonedObjects() {
+        return new ArrayList<>(abandonedObjects.values());
+    }
+
+    /**
+     * Rewrites the report with one JSON object per line for each abandoned object. The report
+     * is read on start, so the time when an object was found abandoned is kept after a restart.
+     */
+    private synchronized void writeReport() {
+        Path report = Paths.get(ABANDON_REPORT);
+        Path tmp = Paths.get(ABANDON_REPORT + ".tmp");
+        try (BufferedWriter writer = Files.newBufferedWriter(tmp, StandardCharsets.UTF_8)) {
+            for (StorPoolAbandonedObject object : abandonedObjects.values()) {
+                writer.write(GSON.toJson(object));
+                writer.newLine();
+            }
+        } catch (IOException e) {
+            log.warn(String.format("Could not write the abandoned StorPool objects to %s due to %s", tmp, e.getMessage()));
+            return;
+        }
+        try {
+            Files.move(tmp, report, StandardCopyOption.REPLACE_EXISTING, StandardCopyOption.ATOMIC_MOVE);
+        } catch (IOException e) {
+            log.warn(String.format("Could not replace %s due to %s", report, e.getMessage()));
+        }
+    }
+
+    private void readReport() {
+        Path report = Paths.get(ABANDON_REPORT);
+        if (!Files.exists(report)) {
+            return;
+        }
+        try (BufferedReader reader = Files.newBufferedReader(report, StandardCharsets.UTF_8)) {
+            String line;
+            while ((line = reader.readLine()) != null) {
+                try {
+                    StorPoolAbandonedObject object = GSON.fromJson(line, StorPoolAbandonedObject.class);
+                    if (object != null && object.getType() != null && object.getPath() != null) {
+                        abandonedObjects.put(object.getPath(), object);
+                    }
+                } catch (JsonSyntaxException e) {
+                    log.debug(String.format("Invalid line in %s: %s", report, line));
                 }
             }
+        } catch (IOException e) {
+            log.warn(String.format("Could not read the abandoned StorPool objects from %s due to %s", report, e.getMessage()));
+        }
+    }
+
+    private StorPoolAbandonedObjectsEngine getEngine() {
+        String name = abandonedObjectsEngine.value();
+        StorPoolAbandonedObjectsEngine engine = engines.get(name);
+        if (engine == null) {
+            log.warn(String.format("Unknown %s: %s, using %s", abandonedObjectsEngine.key(), name, StorPoolSqlAbandonedObjectsEngine.NAME));
+            engine = engines.get(StorPoolSqlAbandonedObjectsEngine.NAME);
         }
-        return map;
+        return engine;
+    }
+
+    private static boolean isCloudStackObject(SpObjectInfo object) {
+        String name = object.getName();
+        return name != null && !name.startsWith("*") && !name.contains("@") && object.getCsTag() != null && !object.isDeleted();
     }
 }
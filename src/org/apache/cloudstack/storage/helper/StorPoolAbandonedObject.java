@@ -0,0 +1,101 @@
+package org.apache.cloudstack.storage.helper;
+
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil;
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpConnectionDesc;
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpObjectInfo;
+import org.apache.cloudstack.storage.helper.StorPoolAbandonedObjectsEngine.ObjectType;
+
+/**
+ * A StorPool volume or snapshot listed by StorPoolAbandonObjectsCollector. The objects
+ * which are not known to CloudStack are kept with the time when they were found for
+ * the first time, and are written as JSON lines to the abandoned objects report.
+ */
+public class StorPoolAbandonedObject {
+    private ObjectType type;
+    // the StorPool name, "~" followed by the global ID
+    private String name;
+    // the device path, under which CloudStack keeps the object
+    private String path;
+    // the device path before the migration to global IDs, only for the objects with a plain name
+    private String legacyPath;
+    private String tag;
+    private long size;
+    private String clusterId;
+    // the StorPool template of the object
+    private String template;
+    // in milliseconds, 0 for volumes, StorPool does not report when they are created
+    private long created;
+    // in milliseconds, 0 until the object is found abandoned
+    private long firstSeen;
+    // the API endpoint which listed the object, not written to the report
+    private transient SpConnectionDesc connection;
+
+    private StorPoolAbandonedObject() {
+    }
+
+    public StorPoolAbandonedObject(ObjectType type, SpObjectInfo info, SpConnectionDesc connection) {
+        this.type = type;
+        this.name = info.getName();
+        // CloudStack refers to the objects by global ID, also to the ones created with a plain name
+        this.path = StorpoolUtil.devPath(info.getGlobalId() != null ? info.getGlobalId() : name.startsWith("~") ? name.substring(1) : name);
+        this.legacyPath = name.startsWith("~") ? null : StorpoolUtil.SP_OLD_PATH + name;
+        this.tag = info.getCsTag();
+        this.size = info.getSize();
+        this.clusterId = info.getClusterId();
+        this.template = info.getTemplateName();
+        this.created = info.getCreationTimestamp() * 1000;
+        this.connection = connection;
+    }
+
+    public ObjectType getType() {
+        return type;
+    }
+
+    public String getName() {
+        return name;
+    }
+
+    public String getPath() {
+        return path;
+    }
+
+    /**
+     * @return the path under which CloudStack kept the object before the migration to global IDs,
+     *         or null if the object was created with a global ID
+     */
+    public String getLegacyPath() {
+        return legacyPath;
+    }
+
+    public String getTag() {
+        return tag;
+    }
+
+    public long getSize() {
+        return size;
+    }
+
+    public String getClusterId() {
+        return clusterId;
+    }
+
+    public String getTemplate() {
+        return template;
+    }
+
+    public long getCreated() {
+        return created;
+    }
+
+    public long getFirstSeen() {
+        return firstSeen;
+    }
+
+    public void setFirstSeen(long firstSeen) {
+        this.firstSeen = firstSeen;
+    }
+
+    public SpConnectionDesc getConnection() {
+        return connection;
+    }
+}
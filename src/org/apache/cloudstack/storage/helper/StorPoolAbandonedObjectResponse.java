@@ -0,0 +1,64 @@
+package org.apache.cloudstack.storage.helper;
+
+import java.util.Date;
+
+import org.apache.cloudstack.api.BaseResponse;
+
+import com.cloud.serializer.Param;
+import com.google.gson.annotations.SerializedName;
+
+public class StorPoolAbandonedObjectResponse extends BaseResponse {
+    @SerializedName("type")
+    @Param(description = "the type of the StorPool object: volume, volume_on_host, snapshot, vm_snapshot or template")
+    private String type;
+
+    @SerializedName("name")
+    @Param(description = "the name of the StorPool object")
+    private String name;
+
+    @SerializedName("path")
+    @Param(description = "the device path of the StorPool object")
+    private String path;
+
+    @SerializedName("tag")
+    @Param(description = "the cs tag of the StorPool object")
+    private String tag;
+
+    @SerializedName("size")
+    @Param(description = "the size of the StorPool object in bytes")
+    private Long size;
+
+    @SerializedName("clusterid")
+    @Param(description = "the ID of the StorPool cluster of the object")
+    private String clusterId;
+
+    @SerializedName("template")
+    @Param(description = "the StorPool template of the object")
+    private String template;
+
+    @SerializedName("created")
+    @Param(description = "the date the StorPool snapshot was created, not returned for volumes")
+    private Date created;
+
+    @SerializedName("firstseen")
+    @Param(description = "the date the object was found for the first time not known to CloudStack")
+    private Date firstSeen;
+
+    @SerializedName("age")
+    @Param(description = "the number of hours since the object was found for the first time not known to CloudStack")
+    private Long age;
+
+    public StorPoolAbandonedObjectResponse(StorPoolAbandonedObject object) {
+        setObjectName("storpoolabandonedobject");
+        this.type = object.getType().name().toLowerCase();
+        this.name = object.getName();
+        this.path = object.getPath();
+        this.tag = object.getTag();
+        this.size = object.getSize();
+        this.clusterId = object.getClusterId();
+        this.template = object.getTemplate();
+        this.created = object.getCreated() > 0 ? new Date(object.getCreated()) : null;
+        this.firstSeen = new Date(object.getFirstSeen());
+        this.age = (System.currentTimeMillis() - object.getFirstSeen()) / 3600000;
+    }
+}
@@ -0,0 +1,61 @@
+package org.apache.cloudstack.storage.helper;
+
+import java.util.Map;
+
+import com.cloud.utils.exception.CloudRuntimeException;
+
+/**
+ * Finds the StorPool objects which are not known to CloudStack. The engine used by
+ * StorPoolAbandonObjectsCollector is selected with storpool.abandon.objects.engine.
+ */
+public interface StorPoolAbandonedObjectsEngine {
+
+    /**
+     * The kinds of StorPool objects and the names under which they are reported
+     */
+    enum ObjectType {
+        VOLUME("volume", false), VOLUME_ON_HOST("volumes_on_host", false), SNAPSHOT("snapshot", true), VM_SNAPSHOT("snapshot", true),
+        TEMPLATE("snapshot", true);
+
+        private final String reportName;
+        private final boolean snapshot;
+
+        ObjectType(String reportName, boolean snapshot) {
+            this.reportName = reportName;
+            this.snapshot = snapshot;
+        }
+
+        public String getReportName() {
+            return reportName;
+        }
+
+        /**
+         * @return true if the objects are StorPool snapshots, false if they are volumes
+         */
+        public boolean isSnapshot() {
+            return snapshot;
+        }
+    }
+
+    String getName();
+
+    /**
+     * @param objects the device paths of StorPool objects of one type, with their "cs" tags
+     * @return the objects which are not known to CloudStack, with their tags
+     * @throws CloudRuntimeException if the CloudStack tables could not be read, an empty
+     *         result always means that all objects are known to CloudStack
+     */
+    Map<String, String> findAbandoned(ObjectType type, Map<String, String> objects);
+
+    /**
+     * Like findAbandoned, but returns only the objects without any CloudStack record. A volume
+     * whose record is not Ready is not returned, it can be destroyed, migrated or snapshotted.
+     * Besides the tables of findAbandoned, the objects are looked up in every other table from
+     * which the plugin resolves StorPool names: volume_details for the volumes, snapshot_store_ref
+     * for the snapshots and the install_path of template_spool_ref for the templates. Only the
+     * objects returned by this check may be deleted.
+     *
+     * @throws CloudRuntimeException if the CloudStack tables could not be read
+     */
+    Map<String, String> findWithoutRecords(ObjectType type, Map<String, String> objects);
+}
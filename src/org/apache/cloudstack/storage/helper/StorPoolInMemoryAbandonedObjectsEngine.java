@@ -0,0 +1,144 @@
+package org.apache.cloudstack.storage.helper;
+
+import java.sql.PreparedStatement;
+import java.sql.ResultSet;
+import java.sql.SQLException;
+import java.util.HashMap;
+import java.util.HashSet;
+import java.util.Map;
+import java.util.Set;
+
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil;
+import org.apache.log4j.Logger;
+
+import com.cloud.utils.db.TransactionLegacy;
+import com.cloud.utils.exception.CloudRuntimeException;
+
+/**
+ * Reads the StorPool device paths known to CloudStack with one streamed SELECT per
+ * table and finds the missing objects with a set difference in memory, without
+ * writing the StorPool objects to the DB.
+ *
+ * Only the part of the paths after /dev/storpool-byid/ is kept in the sets. The paths
+ * under /dev/storpool/, kept before the migration to global IDs, are read as well.
+ */
+public class StorPoolInMemoryAbandonedObjectsEngine implements StorPoolAbandonedObjectsEngine {
+    private static Logger log = Logger.getLogger(StorPoolInMemoryAbandonedObjectsEngine.class);
+
+    public static final String NAME = "memory";
+
+    private static final String READY = "Ready";
+
+    @Override
+    public String getName() {
+        return NAME;
+    }
+
+    @Override
+    public Map<String, String> findAbandoned(ObjectType type, Map<String, String> objects) {
+        return find(type, objects, false);
+    }
+
+    @Override
+    public Map<String, String> findWithoutRecords(ObjectType type, Map<String, String> objects) {
+        return find(type, objects, true);
+    }
+
+    private Map<String, String> find(ObjectType type, Map<String, String> objects, boolean withoutRecords) {
+        Set<String> known = new HashSet<>();
+        Set<String> notReady = new HashSet<>();
+        TransactionLegacy txn = TransactionLegacy.open(TransactionLegacy.CLOUD_DB);
+        try {
+            switch (type) {
+            case VOLUME:
+                readVolumePaths(txn, known, notReady);
+                if (withoutRecords) {
+                    readPaths(txn, "SELECT value FROM `cloud`.`volume_details` WHERE value LIKE ? OR value LIKE ?", known);
+                }
+                break;
+            case VOLUME_ON_HOST:
+                readPaths(txn, "SELECT value FROM `cloud`.`storage_pool_details` WHERE value LIKE ? OR value LIKE ?", known);
+                break;
+            case SNAPSHOT:
+                readPaths(txn, "SELECT value FROM `cloud`.`snapshot_details` WHERE value LIKE ? OR value LIKE ?", known);
+                if (withoutRecords) {
+                    readPaths(txn, "SELECT install_path FROM `cloud`.`snapshot_store_ref` WHERE install_path LIKE ? OR install_path LIKE ?", known);
+                }
+                break;
+            case VM_SNAPSHOT:
+                readPaths(txn, "SELECT value FROM `cloud`.`vm_snapshot_details` WHERE value LIKE ? OR value LIKE ?", known);
+                break;
+            default:
+                readPaths(txn, "SELECT local_path FROM `cloud`.`template_store_ref` WHERE local_path LIKE ? OR local_path LIKE ?", known);
+                readPaths(txn, "SELECT local_path FROM `cloud`.`template_spool_ref` WHERE local_path LIKE ? OR local_path LIKE ?", known);
+                if (withoutRecords) {
+                    readPaths(txn, "SELECT install_path FROM `cloud`.`template_spool_ref` WHERE install_path LIKE ? OR install_path LIKE ?", known);
+                }
+            }
+        } catch (SQLException e) {
+            // without the known paths every object would be reported
+            throw new CloudRuntimeException(String.format("Could not read the StorPool paths of %s objects due to %s", type, e.getMessage()), e);
+        } finally {
+            txn.close();
+        }
+
+        Map<String, String> abandoned = difference(objects, known, notReady, withoutRecords);
+        log.debug(String.format("Found %s abandoned of %s StorPool %s objects, compared with %s known paths", abandoned.size(), objects.size(), type,
+                known.size()));
+        return abandoned;
+    }
+
+    /**
+     * The set difference of the StorPool objects and the paths known to CloudStack, without the DB access,
+     * so it can be measured on its own (StorPoolInMemoryAbandonedObjectsEngineBenchmark)
+     *
+     * @param known the compacted paths of the CloudStack records
+     * @param notReady the compacted paths of the volumes whose record is not Ready
+     */
+    static Map<String, String> difference(Map<String, String> objects, Set<String> known, Set<String> notReady, boolean withoutRecords) {
+        Map<String, String> abandoned = new HashMap<>();
+        for (Map.Entry<String, String> object : objects.entrySet()) {
+            String key = compact(object.getKey());
+            // the same as the LEFT JOIN of the SQL engine, a volume is reported also if any of its records is not Ready
+            if (!known.contains(key) || (!withoutRecords && notReady.contains(key))) {
+                abandoned.put(object.getKey(), object.getValue());
+            }
+        }
+        return abandoned;
+    }
+
+    private static void readVolumePaths(TransactionLegacy txn, Set<String> known, Set<String> notReady) throws SQLException {
+        PreparedStatement pstmt = streamingStatement(txn, "SELECT path, state FROM `cloud`.`volumes` WHERE path LIKE ? OR path LIKE ?");
+        ResultSet rs = pstmt.executeQuery();
+        while (rs.next()) {
+            String key = compact(rs.getString(1));
+            known.add(key);
+            if (!READY.equals(rs.getString(2))) {
+                notReady.add(key);
+            }
+        }
+        rs.close();
+    }
+
+    private static void readPaths(TransactionLegacy txn, String sql, Set<String> known) throws SQLException {
+        PreparedStatement pstmt = streamingStatement(txn, sql);
+        ResultSet rs = pstmt.executeQuery();
+        while (rs.next()) {
+            known.add(compact(rs.getString(1)));
+        }
+        rs.close();
+    }
+
+    private static PreparedStatement streamingStatement(TransactionLegacy txn, String sql) throws SQLException {
+        PreparedStatement pstmt = txn.prepareStatement(sql);
+        pstmt.setString(1, StorpoolUtil.SP_DEV_PATH + "%");
+        pstmt.setString(2, StorpoolUtil.SP_OLD_PATH + "%");
+        // makes the MySQL driver return the rows while they are read, instead of loading the whole result
+        pstmt.setFetchSize(Integer.MIN_VALUE);
+        return pstmt;
+    }
+
+    static String compact(String path) {
+        return path.startsWith(StorpoolUtil.SP_DEV_PATH) ? path.substring(StorpoolUtil.SP_DEV_PATH.length()) : path;
+    }
+}
@@ -0,0 +1,72 @@
+package org.apache.cloudstack.storage.helper;
+
+import java.util.ArrayList;
+import java.util.Collections;
+import java.util.Comparator;
+import java.util.List;
+
+import javax.inject.Inject;
+
+import org.apache.cloudstack.acl.RoleType;
+import org.apache.cloudstack.api.APICommand;
+import org.apache.cloudstack.api.ApiConstants;
+import org.apache.cloudstack.api.BaseListCmd;
+import org.apache.cloudstack.api.Parameter;
+import org.apache.cloudstack.api.response.ListResponse;
+
+import com.cloud.user.Account;
+
+@APICommand(name = "listStorPoolAbandonedObjects",
+            description = "Lists the StorPool volumes and snapshots, which were not known to CloudStack when they were checked for the last time",
+            responseObject = StorPoolAbandonedObjectResponse.class,
+            requestHasSensitiveInfo = false, responseHasSensitiveInfo = false, authorized = {RoleType.Admin})
+public class StorPoolListAbandonedObjectsCmd extends BaseListCmd {
+    private static final String s_name = "liststorpoolabandonedobjectsresponse";
+
+    @Parameter(name = ApiConstants.TYPE, type = CommandType.STRING, description = "list only the objects of this type: volume, volume_on_host, snapshot, vm_snapshot or template")
+    private String type;
+
+    @Parameter(name = "minage", type = CommandType.INTEGER, description = "list only the objects, which are not known to CloudStack for at least this number of hours")
+    private Integer minAge;
+
+    @Inject
+    private StorPoolAbandonObjectsCollector abandonObjectsCollector;
+
+    @Override
+    public String getCommandName() {
+        return s_name;
+    }
+
+    @Override
+    public long getEntityOwnerId() {
+        return Account.ACCOUNT_ID_SYSTEM;
+    }
+
+    @Override
+    public void execute() {
+        long maxFirstSeen = System.currentTimeMillis() - (minAge != null ? minAge * 3600000L : 0);
+        List<StorPoolAbandonedObject> objects = new ArrayList<>();
+        for (StorPoolAbandonedObject object : abandonObjectsCollector.getAbandonedObjects()) {
+            if ((type == null || object.getType().name().equalsIgnoreCase(type)) && object.getFirstSeen() <= maxFirstSeen) {
+                objects.add(object);
+            }
+        }
+        Collections.sort(objects, new Comparator<StorPoolAbandonedObject>() {
+            @Override
+            public int compare(StorPoolAbandonedObject o1, StorPoolAbandonedObject o2) {
+                return Long.compare(o1.getFirstSeen(), o2.getFirstSeen());
+            }
+        });
+
+        List<StorPoolAbandonedObjectResponse> responses = new ArrayList<>();
+        int start = getStartIndex() != null ? getStartIndex().intValue() : 0;
+        int end = getPageSizeVal() != null && getPageSizeVal() > 0 ? (int)Math.min(objects.size(), start + getPageSizeVal()) : objects.size();
+        for (int i = start; i < end; i++) {
+            responses.add(new StorPoolAbandonedObjectResponse(objects.get(i)));
+        }
+        ListResponse<StorPoolAbandonedObjectResponse> response = new ListResponse<>();
+        response.setResponses(responses, objects.size());
+        response.setResponseName(getCommandName());
+        setResponseObject(response);
+    }
+}
@@ -3,13 +3,18 @@ package org.apache.cloudstack.storage.helper;
 import java.sql.PreparedStatement;
 import java.sql.ResultSet;
 import java.sql.SQLException;
+import java.sql.Statement;
 import java.util.ArrayList;
-import java.util.Arrays;
 import java.util.HashMap;
+import java.util.LinkedHashMap;
 import java.util.List;
 import java.util.Map;
 import java.util.concurrent.ExecutorService;
 import java.util.concurrent.Executors;
+import java.util.concurrent.TimeUnit;
+import java.util.concurrent.atomic.AtomicBoolean;
+import java.util.concurrent.atomic.AtomicInteger;
+import java.util.function.Consumer;
 
 import javax.inject.Inject;
 import javax.naming.ConfigurationException;
@@ -21,11 +26,10 @@ import org.apache.cloudstack.storage.datastore.db.PrimaryDataStoreDao;
 import org.apache.cloudstack.storage.datastore.db.StoragePoolDetailVO;
 import org.apache.cloudstack.storage.datastore.db.StoragePoolDetailsDao;
 import org.apache.cloudstack.storage.datastore.db.StoragePoolVO;
-import org.apache.cloudstack.storage.datastore.db.TemplateDataStoreDao;
-import org.apache.cloudstack.storage.datastore.db.TemplateDataStoreVO;
 import org.apache.cloudstack.storage.datastore.util.StorPoolHelper;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpConnectionDesc;
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpObjectInfo;
 import org.apache.cloudstack.storage.snapshot.BackupManager;
 import org.apache.cloudstack.storage.to.VolumeObjectTO;
 import org.apache.cloudstack.storage.vmsnapshot.VMSnapshotHelper;
@@ -33,68 +37,71 @@ import org.apache.log4j.Logger;
 
 import com.cloud.api.ApiServer;
 import com.cloud.hypervisor.kvm.storage.StorpoolStorageAdaptor;
-import com.cloud.storage.VMTemplateDetailVO;
-import com.cloud.storage.VMTemplateStoragePoolVO;
 import com.cloud.storage.Volume;
-import com.cloud.storage.VolumeDetailVO;
 import com.cloud.storage.VolumeVO;
-import com.cloud.storage.dao.SnapshotDetailsDao;
-import com.cloud.storage.dao.SnapshotDetailsVO;
-import com.cloud.storage.dao.VMTemplateDetailsDao;
-import com.cloud.storage.dao.VMTemplatePoolDao;
 import com.cloud.storage.dao.VolumeDao;
-import com.cloud.storage.dao.VolumeDetailsDao;
 import com.cloud.utils.component.ComponentContext;
 import com.cloud.utils.component.ManagerBase;
 import com.cloud.utils.concurrency.NamedThreadFactory;
 import com.cloud.utils.crypt.DBEncryptionUtil;
-import com.cloud.utils.db.QueryBuilder;
-import com.cloud.utils.db.SearchCriteria.Op;
 import com.cloud.utils.db.TransactionLegacy;
 import com.cloud.utils.exception.CloudRuntimeException;
-import com.cloud.vm.snapshot.VMSnapshotDetailsVO;
-import com.cloud.vm.snapshot.VMSnapshotVO;
-import com.cloud.vm.snapshot.dao.VMSnapshotDao;
 import com.cloud.vm.snapshot.dao.VMSnapshotDetailsDao;
-import com.google.gson.JsonArray;
 
+/**
+ * Migrates the paths of the StorPool volumes, snapshots, group snapshots and templates, created
+ * with names, to StorPool's globalIds.
+ *
+ * The records of each kind are migrated by a separate phase, in chunks of
+ * sp.migration.to.global.ids.batch.size records ordered by id, each chunk in one transaction
+ * with batched updates. At most sp.migration.to.global.ids.threads phases run in parallel.
+ * After every chunk the last migrated id of the phase is kept in
+ * sp.migration.to.global.ids.checkpoint, so a migration interrupted by a restart of the
+ * management server continues from there. sp.migration.to.global.ids.completed is set only
+ * after all phases are finished.
+ */
 public class StorPoolMigrationToGlobalId extends ManagerBase {
     private static Logger log = Logger.getLogger(StorPoolMigrationToGlobalId.class);
     @Inject
     private VolumeDao volumeDao;
     @Inject
-    private VMSnapshotDao vmSnapshotDao;
-    @Inject
     private PrimaryDataStoreDao storageDao;
     @Inject
     private VMSnapshotHelper vmSnapshotHelper;
     @Inject
-    private SnapshotDetailsDao snapshotDetailsDao;
-    @Inject
     private VMSnapshotDetailsDao vmSnapshotDetailsDao;
     @Inject
-    private VMTemplatePoolDao vmTemplatePoolDao;
-    @Inject
-    private TemplateDataStoreDao vmTemplateDataStoreDao;
-    @Inject
-    private VMTemplateDetailsDao vmTemplateDetailsDao;
-    @Inject
     private ConfigurationDao configurationDao;
     @Inject
-    private VolumeDetailsDao volumeDetailsDao;
-    @Inject
     private StoragePoolDetailsDao storagePoolDetailsDao;
 
     private ExecutorService _executorService;
-    private Map<String, ArrayList<String>> storpoolVolumes = new HashMap<>();
-    private Map<String, ArrayList<String>> storpoolSnapshots = new HashMap<>();
+    private Map<String, GlobalIdAndTemplate> storpoolVolumes = new HashMap<>();
+    private Map<String, GlobalIdAndTemplate> storpoolSnapshots = new HashMap<>();
+    // the first StorPool primary storage of each StorPool template
+    private Map<String, Long> poolsByTemplate = new HashMap<>();
+    private final Map<String, Long> checkpoint = new LinkedHashMap<>();
+    private final AtomicInteger remainingPhases = new AtomicInteger();
+    private final AtomicBoolean failed = new AtomicBoolean();
     private static final String LOG_FILE = "/var/log/cloudstack/management/storpool-migrate-to-globalids";
     private static final String SELECT_READY_SNAPSHOTS_NO_ON_SNAPSHOT_DETAILS = "SELECT S.id, S.uuid \n" +
             "FROM    `cloud`.`snapshots` S\n" +
             "LEFT JOIN \n" +
             "`cloud`.`snapshot_details` D\n" +
             "ON      S.uuid = D.name\n" +
-            "WHERE D.name is null and S.status=\"BackedUp\"";
+            "WHERE D.name is null and S.status=\"BackedUp\" and S.id > ?";
+    private static final String SELECT_VOLUMES = "SELECT id, path FROM `cloud`.`volumes` WHERE state=? and path LIKE ? and id > ?";
+    private static final String SELECT_TEMPLATES_ON_STORE = "SELECT id, template_id, local_path FROM `cloud`.`template_store_ref` WHERE state=? and local_path LIKE ? and id > ?";
+    private static final String SELECT_TEMPLATES_ON_POOL = "SELECT id, local_path FROM `cloud`.`template_spool_ref` WHERE state=? and local_path LIKE ? and id > ?";
+    private static final String SELECT_VM_SNAPSHOTS = "SELECT id, uuid, vm_id FROM `cloud`.`vm_snapshots` WHERE removed is null and id > ?";
+    private static final String ORDER_AND_LIMIT = " ORDER BY id LIMIT ?";
+    private static final String UPDATE_VOLUME_PATH = "UPDATE `cloud`.`volumes` SET path=? WHERE id=? and path=?";
+    private static final String UPDATE_TEMPLATE_ON_STORE_PATH = "UPDATE `cloud`.`template_store_ref` SET local_path=? WHERE id=? and local_path=?";
+    private static final String UPDATE_TEMPLATE_ON_POOL_PATH = "UPDATE `cloud`.`template_spool_ref` SET local_path=? WHERE id=? and local_path=?";
+    private static final String INSERT_VOLUME_DETAIL = "INSERT INTO `cloud`.`volume_details` (volume_id, name, value, display) VALUES (?, ?, ?, 0)";
+    private static final String INSERT_SNAPSHOT_DETAIL = "INSERT INTO `cloud`.`snapshot_details` (snapshot_id, name, value, display) VALUES (?, ?, ?, 0)";
+    private static final String INSERT_VM_SNAPSHOT_DETAIL = "INSERT INTO `cloud`.`vm_snapshot_details` (vm_snapshot_id, name, value, display) VALUES (?, ?, ?, 0)";
+    private static final String INSERT_TEMPLATE_DETAIL = "INSERT INTO `cloud`.`vm_template_details` (template_id, name, value, display) VALUES (?, ?, ?, 0)";
 
     public StorPoolMigrationToGlobalId() {
         setRunLevel(RUN_LEVEL_FRAMEWORK_BOOTSTRAP);
@@ -113,6 +120,7 @@ public class StorPoolMigrationToGlobalId extends ManagerBase {
 
             if (poolList != null && poolList.size() > 0) {
                 StorPoolHelper.appendLogger(log, LOG_FILE, "update");
+                Map<String, SpConnectionDesc> endpoints = new LinkedHashMap<>();
                 for (StoragePoolVO storagePoolVO : poolList) {
                     String spTemplate = storagePoolVO.getUuid();
                     SpConnectionDesc conn = null;
@@ -121,300 +129,505 @@ public class StorPoolMigrationToGlobalId extends ManagerBase {
                     } catch (Exception e) {
                         throw e;
                     }
-                    JsonArray volumesList = StorpoolUtil.volumesList(conn);
-                    storpoolVolumes.putAll(getStorPoolNamesAndGlobalIds(volumesList));
-
-                    JsonArray snapshotsList = StorpoolUtil.snapshotsList(conn);
-                    storpoolSnapshots.putAll(getStorPoolNamesAndGlobalIds(snapshotsList));
+                    // the primary storages with the same API endpoint list the same objects
+                    String key = conn.getHostPort() + ";" + conn.getAuthToken();
+                    if (!endpoints.containsKey(key)) {
+                        endpoints.put(key, conn);
+                    }
+                    StoragePoolDetailVO detail = storagePoolDetailsDao.findDetail(storagePoolVO.getId(), StorpoolUtil.SP_TEMPLATE);
+                    if (detail != null && !poolsByTemplate.containsKey(detail.getValue())) {
+                        poolsByTemplate.put(detail.getValue(), storagePoolVO.getId());
+                    }
+                }
+                for (SpConnectionDesc conn : endpoints.values()) {
+                    StorpoolUtil.volumesList(conn, new StorPoolNamesAndGlobalIds(storpoolVolumes));
+                    StorpoolUtil.snapshotsList(conn, new StorPoolNamesAndGlobalIds(storpoolSnapshots));
                 }
-                Map<VMSnapshotVO, List<VolumeVO>> vmSnapshotsVO = getVmSnapshotsOnStorPool(vmSnapshotDao.listAll());
-                Map<Long, String> activeSnapshots = listReadySnapshots();
-                List<TemplateDataStoreVO> templatesStoreRefs = listStorpoolStoreTemplates();
-                List<VMTemplateStoragePoolVO> templatesOnPool = listStorpoolPoolTemplates();
-                List<VolumeVO> volumes = listStorpoolVolumes();
-                if (vmSnapshotsVO.size() > 0 || templatesStoreRefs.size() > 0
-                        || templatesOnPool.size() > 0 || volumes.size() > 0 || activeSnapshots.size() > 0) {
-                    _executorService = Executors.newCachedThreadPool(new NamedThreadFactory("StorPoolMigrationToGlobalId"));
-                    _executorService.submit(new VolumesUpdater(storpoolVolumes, volumes));
-                    _executorService.submit(new VmSnapshotsUpdater(storpoolSnapshots, vmSnapshotsVO, poolList));
-                    _executorService.submit(new ActiveSnapshotsUpdater(storpoolSnapshots, activeSnapshots, poolList));
-                    _executorService.submit(new TemplatesOnStoreUpdater(storpoolSnapshots, templatesStoreRefs, poolList));
-                    _executorService.submit(new TemplatesOnPoolUpdater(storpoolSnapshots, templatesOnPool));
-                    _executorService.shutdown();
+                log.info(String.format("Listed %s StorPool volumes and %s snapshots with names", storpoolVolumes.size(), storpoolSnapshots.size()));
+                readCheckpoint();
+
+                List<MigrationPhase> phases = new ArrayList<>();
+                phases.add(new VolumesUpdater());
+                phases.add(new VmSnapshotsUpdater());
+                phases.add(new ActiveSnapshotsUpdater());
+                phases.add(new TemplatesOnStoreUpdater());
+                phases.add(new TemplatesOnPoolUpdater());
+                remainingPhases.set(phases.size());
+                _executorService = Executors.newFixedThreadPool(Math.max(1, BackupManager.MigrationToGlobalIdsThreads.value()),
+                        new NamedThreadFactory("StorPoolMigrationToGlobalId"));
+                for (MigrationPhase phase : phases) {
+                    _executorService.submit(phase);
                 }
+                _executorService.shutdown();
+                return;
             }
-            configurationDao.update(BackupManager.IsMigrationCompleted.key(), DBEncryptionUtil.encrypt(Boolean.TRUE.toString()));
+            markMigrationCompleted();
         }
     }
 
-    private class VmSnapshotsUpdater extends ManagedContextRunnable {
-        private Map<String, ArrayList<String>> clone;
-        private Map<VMSnapshotVO, List<VolumeVO>> vmSnapshotsVO;
-        private List<StoragePoolVO> poolList;
-        public VmSnapshotsUpdater(Map<String, ArrayList<String>> realMap, Map<VMSnapshotVO, List<VolumeVO>> vmSnapshotsVO, List<StoragePoolVO> poolList) {
-            this.clone = new HashMap<>(realMap);
-            this.vmSnapshotsVO = vmSnapshotsVO;
-            this.poolList = poolList;
+    private void markMigrationCompleted() {
+        configurationDao.update(BackupManager.IsMigrationCompleted.key(), DBEncryptionUtil.encrypt(Boolean.TRUE.toString()));
+    }
+
+    private synchronized void readCheckpoint() {
+        String value = configurationDao.getValue(BackupManager.MigrationToGlobalIdsCheckpoint.key());
+        if (value == null || value.isEmpty()) {
+            return;
         }
+        for (String phase : value.split(",")) {
+            String[] nameAndId = phase.split(":");
+            try {
+                checkpoint.put(nameAndId[0], Long.parseLong(nameAndId[1]));
+            } catch (NumberFormatException | ArrayIndexOutOfBoundsException e) {
+                log.warn(String.format("Invalid %s: %s", BackupManager.MigrationToGlobalIdsCheckpoint.key(), value));
+            }
+        }
+        log.info(String.format("Resuming the migration to globalIds after %s", checkpoint));
+    }
+
+    private synchronized long getCheckpoint(String phase) {
+        Long lastId = checkpoint.get(phase);
+        return lastId != null ? lastId : 0;
+    }
+
+    private synchronized void saveCheckpoint(String phase, long lastId) {
+        checkpoint.put(phase, lastId);
+        StringBuilder value = new StringBuilder();
+        for (Map.Entry<String, Long> entry : checkpoint.entrySet()) {
+            if (value.length() > 0) {
+                value.append(',');
+            }
+            value.append(entry.getKey()).append(':').append(entry.getValue());
+        }
+        configurationDao.update(BackupManager.MigrationToGlobalIdsCheckpoint.key(), DBEncryptionUtil.encrypt(value.toString()));
+    }
+
+    /**
+     * The records of one chunk, read and updated in one transaction
+     */
+    private static class Chunk {
+        private int records;
+        private int updated;
+        private long lastId;
+    }
+
+    /**
+     * Migrates the records of one kind in chunks, keeps the last migrated id after each chunk
+     * and logs the progress with the estimated remaining time.
+     */
+    private abstract class MigrationPhase extends ManagedContextRunnable {
+        // the name under which the last migrated id is kept in the checkpoint
+        private final String key;
+        private final String name;
+
+        MigrationPhase(String key, String name) {
+            this.key = key;
+            this.name = name;
+        }
+
+        /**
+         * @return the number of records after afterId, which could have to be migrated
+         */
+        protected abstract long countRecords(TransactionLegacy txn, long afterId) throws SQLException;
+
+        /**
+         * Reads at most limit records after afterId, ordered by id, and updates the ones found in StorPool
+         */
+        protected abstract Chunk migrateChunk(TransactionLegacy txn, long afterId, int limit) throws SQLException;
 
         @Override
         protected void runInContext() {
-            log.info(String.format("%s group snapshots has to be updated with their globalIds", vmSnapshotsVO.size()));
+            try {
+                migrate();
+                if (remainingPhases.decrementAndGet() == 0 && !failed.get()) {
+                    markMigrationCompleted();
+                    log.info("The migration of StorPool's objects to globalIds is completed");
+                }
+            } catch (RuntimeException e) {
+                failed.set(true);
+                remainingPhases.decrementAndGet();
+                log.error(String.format("The migration of StorPool's %s to globalIds failed, it will be resumed on the next start of the management server: %s",
+                        name, e.getMessage()), e);
+            }
+        }
+
+        private void migrate() {
+            final int batchSize = Math.max(1, BackupManager.MigrationToGlobalIdsBatchSize.value());
+            long lastId = getCheckpoint(key);
+            long total = 0;
+            TransactionLegacy txn = TransactionLegacy.open(TransactionLegacy.CLOUD_DB);
+            try {
+                total = countRecords(txn, lastId);
+            } catch (SQLException e) {
+                throw new CloudRuntimeException(String.format("Could not count the %s to migrate due to %s", name, e.getMessage()), e);
+            } finally {
+                txn.close();
+            }
+            log.info(String.format("%s %s have to be checked for an update with their globalIds, starting after id=%s", total, name, lastId));
+
+            final long start = System.currentTimeMillis();
+            long records = 0;
+            long updated = 0;
+            while (true) {
+                Chunk chunk;
+                txn = TransactionLegacy.open(TransactionLegacy.CLOUD_DB);
+                try {
+                    txn.start();
+                    chunk = migrateChunk(txn, lastId, batchSize);
+                    txn.commit();
+                } catch (SQLException e) {
+                    txn.rollback();
+                    throw new CloudRuntimeException(String.format("Could not update the %s after id=%s due to %s", name, lastId, e.getMessage()), e);
+                } finally {
+                    txn.close();
+                }
+                if (chunk.records == 0) {
+                    break;
+                }
+                lastId = chunk.lastId;
+                records += chunk.records;
+                updated += chunk.updated;
+                saveCheckpoint(key, lastId);
+
+                long elapsed = System.currentTimeMillis() - start;
+                long remaining = Math.max(0, total - records);
+                log.info(String.format("Checked %s of %s %s (%s%%), %s updated with their globalIds, last id=%s, estimated remaining time %s s",
+                        records, total, name, total > 0 ? Math.min(100, records * 100 / total) : 100, updated, lastId,
+                        TimeUnit.MILLISECONDS.toSeconds(elapsed * remaining / records)));
+            }
+            log.info(String.format("StorPool's %s were updated with their globalIds, %s of %s checked records in %s ms", name, updated, records,
+                    System.currentTimeMillis() - start));
+        }
+    }
+
+    private class VmSnapshotsUpdater extends MigrationPhase {
+        VmSnapshotsUpdater() {
+            super("vm_snapshots", "group snapshots");
+        }
 
-            for (Map.Entry<VMSnapshotVO, List<VolumeVO>> element : vmSnapshotsVO.entrySet()) {
-                for (VolumeVO volume : element.getValue()) {
-                    String snapshotName = element.getKey().getUuid() + "_" + volume.getUuid();
-                    ArrayList<String> globalIdAndTemplate = this.clone.get(snapshotName);
+        @Override
+        protected long countRecords(TransactionLegacy txn, long afterId) throws SQLException {
+            return count(txn, SELECT_VM_SNAPSHOTS, afterId);
+        }
+
+        @Override
+        protected Chunk migrateChunk(TransactionLegacy txn, long afterId, int limit) throws SQLException {
+            Chunk chunk = new Chunk();
+            PreparedStatement select = txn.prepareAutoCloseStatement(SELECT_VM_SNAPSHOTS + ORDER_AND_LIMIT);
+            select.setLong(1, afterId);
+            select.setInt(2, limit);
+            ResultSet rs = select.executeQuery();
+            PreparedStatement insert = txn.prepareAutoCloseStatement(INSERT_VM_SNAPSHOT_DETAIL);
+            while (rs.next()) {
+                long vmSnapshotId = rs.getLong(1);
+                String vmSnapshotUuid = rs.getString(2);
+                chunk.records++;
+                chunk.lastId = vmSnapshotId;
+                boolean poolAdded = vmSnapshotDetailsDao.findDetail(vmSnapshotId, StorpoolUtil.SP_STORAGE_POOL_ID) != null;
+                for (VolumeVO volume : getVolumesOnStorPool(vmSnapshotId, rs.getLong(3))) {
+                    String snapshotName = vmSnapshotUuid + "_" + volume.getUuid();
+                    GlobalIdAndTemplate globalIdAndTemplate = storpoolSnapshots.get(snapshotName);
                     if (globalIdAndTemplate != null) {
-                        String name = globalIdAndTemplate.get(0);
-                        for (StoragePoolVO storagePoolVO : poolList) {
-                            StoragePoolDetailVO detail = storagePoolDetailsDao.findDetail(storagePoolVO.getId(), StorpoolUtil.SP_TEMPLATE);
-                            if (detail != null && detail.getValue().equals(globalIdAndTemplate.get(1))) {
-                                VMSnapshotDetailsVO details = new VMSnapshotDetailsVO(element.getKey().getId(),
-                                        StorpoolUtil.SP_STORAGE_POOL_ID, String.valueOf(storagePoolVO.getId()), false);
-                                vmSnapshotDetailsDao.persist(details);
-                                break;
-                            }
+                        Long poolId = poolsByTemplate.get(globalIdAndTemplate.template);
+                        if (poolId != null && !poolAdded) {
+                            addDetail(insert, vmSnapshotId, StorpoolUtil.SP_STORAGE_POOL_ID, String.valueOf(poolId));
+                            poolAdded = true;
                         }
-                        VMSnapshotDetailsVO details = new VMSnapshotDetailsVO(element.getKey().getId(),
-                                volume.getUuid(), StorpoolUtil.devPath(name), false);
-                        vmSnapshotDetailsDao.persist(details);
-                        log.info(String.format("Group snapshot was updated. Old name was %s and the new name is %s for volume with id=%s", snapshotName, name, volume.getId()));
+                        addDetail(insert, vmSnapshotId, volume.getUuid(), StorpoolUtil.devPath(globalIdAndTemplate.globalId));
+                        chunk.updated++;
+                        log.info(String.format("Group snapshot was updated. Old name was %s and the new name is %s for volume with id=%s", snapshotName,
+                                globalIdAndTemplate.globalId, volume.getId()));
                     } else {
                         log.info(String.format("Snapshot of a group with name=%s was not found in StorPool", snapshotName));
                     }
                 }
             }
-            log.info("StorPool's group snapshots were added into DB table \"vm_snapshot_details\" with their globalIds of each attached volume");
+            insert.executeBatch();
+            return chunk;
         }
-    }
 
-    private class ActiveSnapshotsUpdater extends ManagedContextRunnable {
-        private Map<String, ArrayList<String>> clone;
-        private Map<Long, String> snapshots;
-        private List<StoragePoolVO> poolList;
+        /**
+         * @return the volumes of the VM on StorPool, which are not migrated yet for this group snapshot
+         */
+        private List<VolumeVO> getVolumesOnStorPool(long vmSnapshotId, long vmId) {
+            List<VolumeVO> volumesOnStorPool = new ArrayList<VolumeVO>();
+            for (VolumeObjectTO volumeObjectTO : vmSnapshotHelper.getVolumeTOList(vmId)) {
+                VolumeVO volumeVO = volumeDao.findById(volumeObjectTO.getId());
+                StoragePoolVO storagePoolVO = storageDao.findById(volumeVO.getPoolId());
+                if (storagePoolVO.getStorageProviderName().equals(StorpoolUtil.SP_PROVIDER_NAME)
+                        && vmSnapshotDetailsDao.findDetail(vmSnapshotId, volumeVO.getUuid()) == null) {
+                    volumesOnStorPool.add(volumeVO);
+                }
+            }
+            return volumesOnStorPool;
+        }
+    }
 
-        public ActiveSnapshotsUpdater(Map<String, ArrayList<String>> realMap, Map<Long, String> snapshots, List<StoragePoolVO> poolList) {
-            this.clone = new HashMap<>(realMap);
-            this.snapshots = snapshots;
-            this.poolList = poolList;
+    private class ActiveSnapshotsUpdater extends MigrationPhase {
+        ActiveSnapshotsUpdater() {
+            super("snapshots", "snapshots");
         }
 
         @Override
-        protected void runInContext() {
+        protected long countRecords(TransactionLegacy txn, long afterId) throws SQLException {
+            return count(txn, SELECT_READY_SNAPSHOTS_NO_ON_SNAPSHOT_DETAILS, afterId);
+        }
 
-            for (Map.Entry<Long, String> snapshot : snapshots.entrySet()) {
-                String oldPath = snapshot.getValue();
-                ArrayList<String> globalIdAndTemplate = this.clone.get(oldPath);
+        @Override
+        protected Chunk migrateChunk(TransactionLegacy txn, long afterId, int limit) throws SQLException {
+            Chunk chunk = new Chunk();
+            PreparedStatement select = txn.prepareAutoCloseStatement(SELECT_READY_SNAPSHOTS_NO_ON_SNAPSHOT_DETAILS + " ORDER BY S.id LIMIT ?");
+            select.setLong(1, afterId);
+            select.setInt(2, limit);
+            ResultSet rs = select.executeQuery();
+            PreparedStatement insert = txn.prepareAutoCloseStatement(INSERT_SNAPSHOT_DETAIL);
+            while (rs.next()) {
+                long snapshotId = rs.getLong(1);
+                String oldPath = rs.getString(2);
+                chunk.records++;
+                chunk.lastId = snapshotId;
+                GlobalIdAndTemplate globalIdAndTemplate = storpoolSnapshots.get(oldPath);
                 if (globalIdAndTemplate != null) {
-                    String path = globalIdAndTemplate.get(0);
-                    for (StoragePoolVO storagePoolVO : poolList) {
-                        StoragePoolDetailVO detail = storagePoolDetailsDao.findDetail(storagePoolVO.getId(), StorpoolUtil.SP_TEMPLATE);
-                        if (detail != null && detail.getValue().equals(globalIdAndTemplate.get(1))) {
-                            SnapshotDetailsVO details = new SnapshotDetailsVO(snapshot.getKey(), StorpoolUtil.SP_STORAGE_POOL_ID, String.valueOf(storagePoolVO.getId()), false);
-                            snapshotDetailsDao.persist(details);
-                            break;
-                        }
+                    Long poolId = poolsByTemplate.get(globalIdAndTemplate.template);
+                    if (poolId != null) {
+                        addDetail(insert, snapshotId, StorpoolUtil.SP_STORAGE_POOL_ID, String.valueOf(poolId));
                     }
-                    String newPath = StorpoolUtil.devPath(path);
-                    SnapshotDetailsVO details = new SnapshotDetailsVO(snapshot.getKey(), oldPath, newPath, false);
-                    snapshotDetailsDao.persist(details);
-
+                    String newPath = StorpoolUtil.devPath(globalIdAndTemplate.globalId);
+                    addDetail(insert, snapshotId, oldPath, newPath);
+                    chunk.updated++;
                     log.info(String.format("StorPool's snapshot was added in \"snapshot_details\" DB table. The old path was %s and the new path is %s",
                             oldPath, newPath));
                 }
             }
-            log.info("StorPool's snapshots were updated in db table \"snapshot_details\" with path to globalId");
+            insert.executeBatch();
+            return chunk;
         }
     }
 
-    private class TemplatesOnStoreUpdater extends ManagedContextRunnable {
-        private Map<String, ArrayList<String>> clone;
-        private List<TemplateDataStoreVO> templatesStoreRefs;
-        private List<StoragePoolVO> poolList;
-
-        public TemplatesOnStoreUpdater(Map<String, ArrayList<String>> realMap, List<TemplateDataStoreVO> templatesStoreRefs, List<StoragePoolVO> poolList) {
-            this.clone = new HashMap<>(realMap);
-            this.templatesStoreRefs = templatesStoreRefs;
-            this.poolList = poolList;
+    private class TemplatesOnStoreUpdater extends MigrationPhase {
+        TemplatesOnStoreUpdater() {
+            super("template_store_ref", "templates in DB table \"template_store_ref\"");
         }
 
         @Override
-        protected void runInContext() {
-            log.info(String.format("%s templates in DB table \"template_store_ref\" has to be updated with their globalid",
-                    templatesStoreRefs.size()));
+        protected long countRecords(TransactionLegacy txn, long afterId) throws SQLException {
+            return count(txn, SELECT_TEMPLATES_ON_STORE, afterId, ObjectInDataStoreStateMachine.State.Ready.toString(), StorpoolUtil.SP_OLD_PATH + "%");
+        }
 
-            for (TemplateDataStoreVO template : templatesStoreRefs) {
-                String oldPath = template.getLocalDownloadPath();
+        @Override
+        protected Chunk migrateChunk(TransactionLegacy txn, long afterId, int limit) throws SQLException {
+            Chunk chunk = new Chunk();
+            ResultSet rs = select(txn, SELECT_TEMPLATES_ON_STORE, afterId, limit, ObjectInDataStoreStateMachine.State.Ready.toString(),
+                    StorpoolUtil.SP_OLD_PATH + "%");
+            PreparedStatement update = txn.prepareAutoCloseStatement(UPDATE_TEMPLATE_ON_STORE_PATH);
+            List<String[]> updates = new ArrayList<>();
+            while (rs.next()) {
+                long id = rs.getLong(1);
+                String oldPath = rs.getString(3);
+                chunk.records++;
+                chunk.lastId = id;
                 String key = StorpoolStorageAdaptor.getVolumeNameFromPath(oldPath, false);
-                ArrayList<String> globalIdAndTemplate = clone.get(key);
+                GlobalIdAndTemplate globalIdAndTemplate = storpoolSnapshots.get(key);
                 if (globalIdAndTemplate != null) {
-                    String newPath = StorpoolUtil.devPath(globalIdAndTemplate.get(0));
-                    vmTemplateDataStoreDao.acquireInLockTable(template.getId());
-                    template.setLocalDownloadPath(newPath);
-                    vmTemplateDataStoreDao.update(template.getId(), template);
-                    vmTemplateDataStoreDao.releaseFromLockTable(template.getId());
-                    for (StoragePoolVO storagePoolVO : poolList) {
-                        StoragePoolDetailVO detail = storagePoolDetailsDao.findDetail(storagePoolVO.getId(), StorpoolUtil.SP_TEMPLATE);
-                        if (detail != null && detail.getValue().equals(globalIdAndTemplate.get(1))) {
-                        VMTemplateDetailVO templateDetails = new VMTemplateDetailVO(template.getId(), StorpoolUtil.SP_STORAGE_POOL_ID, String.valueOf(storagePoolVO.getId()),
-                                false);
-                        vmTemplateDetailsDao.persist(templateDetails);
-                        }
-                    }
-                    log.info(String.format("StorPool's snapshot for a template in DB table \"template_store_ref\" was updated. Old path was %s and the new path is %s.", oldPath, newPath));
+                    String newPath = StorpoolUtil.devPath(globalIdAndTemplate.globalId);
+                    addUpdate(update, newPath, id, oldPath);
+                    updates.add(new String[] {String.valueOf(rs.getLong(2)), globalIdAndTemplate.template, oldPath, newPath});
                 } else {
-                    log.info(String.format("Store template with id=%s in DB table \"template_store_ref\" was not found as a snapshot in StorPool", template.getId()));
+                    log.info(String.format("Store template with id=%s in DB table \"template_store_ref\" was not found as a snapshot in StorPool", id));
                 }
             }
-            log.info("StorPool's snapshots of templates were updated in db table \"template_store_ref\" with path to globalId's path");
+            int[] results = update.executeBatch();
+            PreparedStatement insert = txn.prepareAutoCloseStatement(INSERT_TEMPLATE_DETAIL);
+            for (int i = 0; i < results.length; i++) {
+                // the record was changed since it was read
+                if (!isUpdated(results[i])) {
+                    continue;
+                }
+                String[] template = updates.get(i);
+                Long poolId = poolsByTemplate.get(template[1]);
+                if (poolId != null) {
+                    addDetail(insert, Long.parseLong(template[0]), StorpoolUtil.SP_STORAGE_POOL_ID, String.valueOf(poolId));
+                }
+                chunk.updated++;
+                log.info(String.format("StorPool's snapshot for a template in DB table \"template_store_ref\" was updated. Old path was %s and the new path is %s.",
+                        template[2], template[3]));
+            }
+            insert.executeBatch();
+            return chunk;
         }
     }
 
-    private class TemplatesOnPoolUpdater extends ManagedContextRunnable {
-        private Map<String, ArrayList<String>> clone;
-        private List<VMTemplateStoragePoolVO> templatesOnPool;
-
-        public TemplatesOnPoolUpdater(Map<String, ArrayList<String>> realMap, List<VMTemplateStoragePoolVO> templatesOnPool) {
-            this.clone = new HashMap<>(realMap);
-            this.templatesOnPool = templatesOnPool;
+    private class TemplatesOnPoolUpdater extends MigrationPhase {
+        TemplatesOnPoolUpdater() {
+            super("template_spool_ref", "templates in DB table \"template_spool_ref\"");
         }
 
         @Override
-        protected void runInContext() {
+        protected long countRecords(TransactionLegacy txn, long afterId) throws SQLException {
+            return count(txn, SELECT_TEMPLATES_ON_POOL, afterId, ObjectInDataStoreStateMachine.State.Ready.toString(), StorpoolUtil.SP_OLD_PATH + "%");
+        }
 
-            log.info(String.format("%s templates in DB table \"template_spool_ref\" has to be updated with their globalid",
-                    templatesOnPool.size()));
-            for (VMTemplateStoragePoolVO template : templatesOnPool) {
-                String oldPath = template.getLocalDownloadPath();
+        @Override
+        protected Chunk migrateChunk(TransactionLegacy txn, long afterId, int limit) throws SQLException {
+            Chunk chunk = new Chunk();
+            ResultSet rs = select(txn, SELECT_TEMPLATES_ON_POOL, afterId, limit, ObjectInDataStoreStateMachine.State.Ready.toString(),
+                    StorpoolUtil.SP_OLD_PATH + "%");
+            PreparedStatement update = txn.prepareAutoCloseStatement(UPDATE_TEMPLATE_ON_POOL_PATH);
+            List<String[]> updates = new ArrayList<>();
+            while (rs.next()) {
+                long id = rs.getLong(1);
+                String oldPath = rs.getString(2);
+                chunk.records++;
+                chunk.lastId = id;
                 String key = StorpoolStorageAdaptor.getVolumeNameFromPath(oldPath, false);
-                ArrayList<String> globalIdAndTemplate = clone.get(key);
+                GlobalIdAndTemplate globalIdAndTemplate = storpoolSnapshots.get(key);
                 if (globalIdAndTemplate != null) {
-                    String newPath = StorpoolUtil.devPath(globalIdAndTemplate.get(0));
-                    vmTemplatePoolDao.acquireInLockTable(template.getId());
-                    template.setLocalDownloadPath(newPath);
-                    vmTemplatePoolDao.update(template.getId(), template);
-                    vmTemplatePoolDao.releaseFromLockTable(template.getId());
-                    log.info(String.format("StorPool's snapshot for a template in DB table \"template_spool_ref\" was updated. Old path was %s and the new path is %s.", oldPath, newPath));
-                }else {
-                    log.info(String.format("Pool template with id=%s in DB table \"template_spool_ref\" was not found as a snapshot in StorPool", template.getId()));
+                    String newPath = StorpoolUtil.devPath(globalIdAndTemplate.globalId);
+                    addUpdate(update, newPath, id, oldPath);
+                    updates.add(new String[] {oldPath, newPath});
+                } else {
+                    log.info(String.format("Pool template with id=%s in DB table \"template_spool_ref\" was not found as a snapshot in StorPool", id));
                 }
             }
-            log.info("StorPool's snapshots of templates were updated in db table \"template_spool_ref\" with path to globalId's path");
+            int[] results = update.executeBatch();
+            for (int i = 0; i < results.length; i++) {
+                if (isUpdated(results[i])) {
+                    chunk.updated++;
+                    log.info(String.format("StorPool's snapshot for a template in DB table \"template_spool_ref\" was updated. Old path was %s and the new path is %s.",
+                            updates.get(i)[0], updates.get(i)[1]));
+                }
+            }
+            return chunk;
         }
     }
 
-    private class VolumesUpdater extends ManagedContextRunnable {
-        private Map<String, ArrayList<String>> clone;
-        private List<VolumeVO> volumes;
-
-        public VolumesUpdater(Map<String, ArrayList<String>> realMap, List<VolumeVO> volumes) {
-            this.clone = new HashMap<>(realMap);
-            this.volumes = volumes;
+    private class VolumesUpdater extends MigrationPhase {
+        VolumesUpdater() {
+            super("volumes", "volumes");
         }
 
         @Override
-        protected void runInContext() {
-            log.info(String.format("%s StorPool volume has to be updated with their globalIds", volumes.size()));
+        protected long countRecords(TransactionLegacy txn, long afterId) throws SQLException {
+            return count(txn, SELECT_VOLUMES, afterId, Volume.State.Ready.toString(), StorpoolUtil.SP_OLD_PATH + "%");
+        }
 
-            for (VolumeVO volume : volumes) {
-                String oldPath = volume.getPath();
+        @Override
+        protected Chunk migrateChunk(TransactionLegacy txn, long afterId, int limit) throws SQLException {
+            Chunk chunk = new Chunk();
+            ResultSet rs = select(txn, SELECT_VOLUMES, afterId, limit, Volume.State.Ready.toString(), StorpoolUtil.SP_OLD_PATH + "%");
+            PreparedStatement update = txn.prepareAutoCloseStatement(UPDATE_VOLUME_PATH);
+            List<String[]> updates = new ArrayList<>();
+            while (rs.next()) {
+                long id = rs.getLong(1);
+                String oldPath = rs.getString(2);
+                chunk.records++;
+                chunk.lastId = id;
                 String key = StorpoolStorageAdaptor.getVolumeNameFromPath(oldPath, false);
-                ArrayList<String> listWithGlobaIds = clone.get(key);
-                if (listWithGlobaIds != null) {
-                    String path = listWithGlobaIds.get(0);
-                    volumeDao.acquireInLockTable(volume.getId());
-                    volume.setPath(StorpoolUtil.devPath(path));
-                    volumeDao.update(volume.getId(), volume);
-                    volumeDao.releaseFromLockTable(volume.getId());
-                    volumeDetailsDao.persist(new VolumeDetailVO(volume.getId(), StorpoolUtil.SP_PROVIDER_NAME, oldPath, false));
-                    log.info(String.format("StorPool's volume was updated with globalId. Old path=%s, new path=%s.", oldPath, volume.getPath()));
+                GlobalIdAndTemplate globalIdAndTemplate = storpoolVolumes.get(key);
+                if (globalIdAndTemplate != null) {
+                    String newPath = StorpoolUtil.devPath(globalIdAndTemplate.globalId);
+                    addUpdate(update, newPath, id, oldPath);
+                    updates.add(new String[] {String.valueOf(id), oldPath, newPath});
                 } else {
-                    log.info(String.format("Volume with id=%s was not found as a volume in StorPool", volume.getId()));
+                    log.info(String.format("Volume with id=%s was not found as a volume in StorPool", id));
                 }
             }
-            log.info("StorPool's volumes were updated in db table \"volumes\" with path to globalIds");
+            int[] results = update.executeBatch();
+            PreparedStatement insert = txn.prepareAutoCloseStatement(INSERT_VOLUME_DETAIL);
+            for (int i = 0; i < results.length; i++) {
+                // the volume was changed since it was read
+                if (!isUpdated(results[i])) {
+                    continue;
+                }
+                String[] volume = updates.get(i);
+                addDetail(insert, Long.parseLong(volume[0]), StorpoolUtil.SP_PROVIDER_NAME, volume[1]);
+                chunk.updated++;
+                log.info(String.format("StorPool's volume was updated with globalId. Old path=%s, new path=%s.", volume[1], volume[2]));
+            }
+            insert.executeBatch();
+            return chunk;
         }
     }
 
-    private List<StoragePoolVO> listStorPoolStorage() {
-        return storageDao.findPoolsByProvider(StorpoolUtil.SP_PROVIDER_NAME);
+    private static long count(TransactionLegacy txn, String select, long afterId, String... params) throws SQLException {
+        PreparedStatement pstmt = txn.prepareAutoCloseStatement("SELECT COUNT(*) FROM (" + select + ") records");
+        setParameters(pstmt, afterId, params);
+        ResultSet rs = pstmt.executeQuery();
+        return rs.next() ? rs.getLong(1) : 0;
     }
 
-    private Map<String, ArrayList<String>> getStorPoolNamesAndGlobalIds(JsonArray arr) {
-        Map<String, ArrayList<String>> map = new HashMap<>();
-        for (int i = 0; i < arr.size(); i++) {
-            String name = arr.get(i).getAsJsonObject().get("name").getAsString();
-            String glid = arr.get(i).getAsJsonObject().get("globalId").getAsString();
-            String templateName = arr.get(i).getAsJsonObject().get("templateName").getAsString();
-            if ((!name.startsWith("~") || !name.startsWith("*")) && !name.contains("@")) {
-                map.put(name, new ArrayList<>(Arrays.asList(glid, templateName)));
-            }
-        }
-        return map;
+    private static ResultSet select(TransactionLegacy txn, String select, long afterId, int limit, String... params) throws SQLException {
+        PreparedStatement pstmt = txn.prepareAutoCloseStatement(select + ORDER_AND_LIMIT);
+        int index = setParameters(pstmt, afterId, params);
+        pstmt.setInt(index, limit);
+        return pstmt.executeQuery();
     }
 
-    private Map<VMSnapshotVO, List<VolumeVO>> getVmSnapshotsOnStorPool(List<VMSnapshotVO> vmSnapshots) {
-        Map<VMSnapshotVO, List<VolumeVO>> vmSnapshotsOnStorPool = new HashMap<>();
-        for (VMSnapshotVO vmSnapshot : vmSnapshots) {
-            List<VolumeObjectTO> volumeTOs = vmSnapshotHelper.getVolumeTOList(vmSnapshot.getVmId());
-            List<VolumeVO> volumesOnStorPool = new ArrayList<VolumeVO>();
-            for (VolumeObjectTO volumeObjectTO : volumeTOs) {
-                VolumeVO volumeVO = volumeDao.findById(volumeObjectTO.getId());
-                StoragePoolVO storagePoolVO = storageDao.findById(volumeVO.getPoolId());
-                VMSnapshotDetailsVO vmDetail = vmSnapshotDetailsDao.findDetail(vmSnapshot.getId(), volumeVO.getUuid());
-                if (storagePoolVO.getStorageProviderName().equals(StorpoolUtil.SP_PROVIDER_NAME) && vmDetail == null) {
-                    volumesOnStorPool.add(volumeVO);
-                }
-            }
-            if (!volumesOnStorPool.isEmpty()) {
-                vmSnapshotsOnStorPool.put(vmSnapshot, volumesOnStorPool);
-            }
+    /**
+     * Sets the parameters of the query, followed by the id after which the records are read
+     *
+     * @return the index of the next parameter
+     */
+    private static int setParameters(PreparedStatement pstmt, long afterId, String... params) throws SQLException {
+        int index = 1;
+        for (String param : params) {
+            pstmt.setString(index++, param);
         }
-        return vmSnapshotsOnStorPool;
+        pstmt.setLong(index++, afterId);
+        return index;
     }
 
-    private List<TemplateDataStoreVO> listStorpoolStoreTemplates() {
-        QueryBuilder<TemplateDataStoreVO> sc = QueryBuilder.create(TemplateDataStoreVO.class);
-        sc.and(sc.entity().getState(), Op.EQ, ObjectInDataStoreStateMachine.State.Ready);
-        sc.and(sc.entity().getLocalDownloadPath(), Op.LIKE, StorpoolUtil.SP_OLD_PATH + "%");
-        return sc.list();
+    private static void addUpdate(PreparedStatement update, String newPath, long id, String oldPath) throws SQLException {
+        update.setString(1, newPath);
+        update.setLong(2, id);
+        update.setString(3, oldPath);
+        update.addBatch();
     }
 
-    private Map<Long, String> listReadySnapshots() {
-        final TransactionLegacy txn = TransactionLegacy.currentTxn();
-        PreparedStatement pstmt = null;
-        Map<Long, String> result = new HashMap<>();
-        try {
-            pstmt = txn.prepareAutoCloseStatement(SELECT_READY_SNAPSHOTS_NO_ON_SNAPSHOT_DETAILS);
+    private static void addDetail(PreparedStatement insert, long resourceId, String name, String value) throws SQLException {
+        insert.setLong(1, resourceId);
+        insert.setString(2, name);
+        insert.setString(3, value);
+        insert.addBatch();
+    }
 
-            final ResultSet rs = pstmt.executeQuery();
-            while (rs.next()) {
-                result.put(rs.getLong("id"), rs.getString("uuid"));
-            }
-            return result;
-        } catch (final SQLException e) {
-            throw new CloudRuntimeException("DB Exception on: " + pstmt, e);
-        } catch (final Throwable e) {
-            throw new CloudRuntimeException("Caught: " + pstmt, e);
-        }
-//        QueryBuilder<SnapshotVO> sc = QueryBuilder.create(SnapshotVO.class);
-//        sc.and(sc.entity().getState(), Op.EQ, Snapshot.State.BackedUp);
-//        return sc.list();
+    private static boolean isUpdated(int result) {
+        return result > 0 || result == Statement.SUCCESS_NO_INFO;
     }
 
-    private List<VMTemplateStoragePoolVO> listStorpoolPoolTemplates() {
-        QueryBuilder<VMTemplateStoragePoolVO> sc = QueryBuilder.create(VMTemplateStoragePoolVO.class);
-        sc.and(sc.entity().getState(), Op.EQ, ObjectInDataStoreStateMachine.State.Ready);
-        sc.and(sc.entity().getLocalDownloadPath(), Op.LIKE, StorpoolUtil.SP_OLD_PATH + "%");
-        return sc.list();
+    private List<StoragePoolVO> listStorPoolStorage() {
+        return storageDao.findPoolsByProvider(StorpoolUtil.SP_PROVIDER_NAME);
+    }
+
+    private static final class GlobalIdAndTemplate {
+        private final String globalId;
+        private final String template;
+
+        GlobalIdAndTemplate(String globalId, String template) {
+            this.globalId = globalId;
+            this.template = template;
+        }
     }
 
-    private List<VolumeVO> listStorpoolVolumes() {
-        QueryBuilder<VolumeVO> sc = QueryBuilder.create(VolumeVO.class);
-        sc.and(sc.entity().getState(), Op.EQ, Volume.State.Ready);
-        sc.and(sc.entity().getPath(), Op.LIKE, StorpoolUtil.SP_OLD_PATH + "%");
-        return sc.list();
+    /**
+     * Collects the globalId and the template name of each StorPool object created with a name
+     * while the list is received
+     */
+    private static class StorPoolNamesAndGlobalIds implements Consumer<SpObjectInfo> {
+        private final Map<String, GlobalIdAndTemplate> map;
+
+        StorPoolNamesAndGlobalIds(Map<String, GlobalIdAndTemplate> map) {
+            this.map = map;
+        }
+
+        @Override
+        public void accept(SpObjectInfo object) {
+            String name = object.getName();
+            // the objects named by their globalIds are not referenced with their names in the DB
+            if (!name.startsWith("~") && !name.startsWith("*") && !name.contains("@")) {
+                map.put(name, new GlobalIdAndTemplate(object.getGlobalId(), object.getTemplateName()));
+            }
+        }
     }
 
     private String getStoragePoolName(String url) {
@@ -204,7 +204,8 @@ public class StorPoolReplaceCommandsHelper implements PluggableService{
                         StorPoolResizeVolumeCmd.class,
                         StorPoolResizeVolumeCmdByAdmin.class,
                         StorPoolScaleVMCmd.class,
-                        StorPoolScaleVMCmdByAdmin.class
+                        StorPoolScaleVMCmdByAdmin.class,
+                        StorPoolListAbandonedObjectsCmd.class
                         ));
         return cmdList;
     }
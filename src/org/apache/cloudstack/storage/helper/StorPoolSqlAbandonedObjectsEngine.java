@@ -0,0 +1,140 @@
+package org.apache.cloudstack.storage.helper;
+
+import java.sql.PreparedStatement;
+import java.sql.ResultSet;
+import java.sql.SQLException;
+import java.util.HashMap;
+import java.util.Map;
+
+import org.apache.log4j.Logger;
+
+import com.cloud.utils.db.TransactionLegacy;
+import com.cloud.utils.exception.CloudRuntimeException;
+
+/**
+ * Loads the StorPool objects in a temporary table and finds the missing ones with
+ * a LEFT JOIN against the CloudStack tables.
+ */
+public class StorPoolSqlAbandonedObjectsEngine implements StorPoolAbandonedObjectsEngine {
+    private static Logger log = Logger.getLogger(StorPoolSqlAbandonedObjectsEngine.class);
+
+    public static final String NAME = "sql";
+
+    private static final int BATCH_SIZE = 1000;
+
+    @Override
+    public String getName() {
+        return NAME;
+    }
+
+    @Override
+    public Map<String, String> findAbandoned(ObjectType type, Map<String, String> objects) {
+        return find(type, objects, false);
+    }
+
+    @Override
+    public Map<String, String> findWithoutRecords(ObjectType type, Map<String, String> objects) {
+        return find(type, objects, true);
+    }
+
+    private Map<String, String> find(ObjectType type, Map<String, String> objects, boolean withoutRecords) {
+        Map<String, String> abandoned = new HashMap<>();
+        String table = getTemporaryTable(type);
+        TransactionLegacy txn = TransactionLegacy.open(TransactionLegacy.CLOUD_DB);
+        try {
+            PreparedStatement pstmt = txn.prepareAutoCloseStatement(String.format(
+                    "CREATE TEMPORARY TABLE `cloud`.`%s`(`id` bigint unsigned NOT NULL auto_increment, `name` varchar(255) NOT NULL,`tag` varchar(255) NOT NULL, PRIMARY KEY (`id`))",
+                    table));
+            pstmt.executeUpdate();
+
+            pstmt = txn.prepareStatement(String.format("INSERT INTO `cloud`.`%s` (name, tag) VALUES (?, ?)", table));
+            int pending = 0;
+            for (Map.Entry<String, String> object : objects.entrySet()) {
+                pstmt.setString(1, object.getKey());
+                pstmt.setString(2, object.getValue());
+                pstmt.addBatch();
+                if (++pending >= BATCH_SIZE) {
+                    pstmt.executeBatch();
+                    pending = 0;
+                }
+            }
+            if (pending > 0) {
+                pstmt.executeBatch();
+            }
+
+            pstmt = txn.prepareStatement(getMissingObjectsQuery(type, table, withoutRecords));
+            if (type == ObjectType.VOLUME && !withoutRecords) {
+                pstmt.setString(1, "Ready");
+            }
+            ResultSet rs = pstmt.executeQuery();
+            while (rs.next()) {
+                abandoned.put(rs.getString(1), rs.getString(2));
+            }
+        } catch (SQLException e) {
+            // an empty result would hide the abandoned objects until their next check
+            throw new CloudRuntimeException(String.format("Could not find the abandoned StorPool %s objects due to %s", type, e.getMessage()), e);
+        } finally {
+            try {
+                PreparedStatement pstmt = txn.prepareStatement(String.format("DROP TABLE `cloud`.`%s`", table));
+                pstmt.executeUpdate();
+            } catch (SQLException e) {
+                log.info(String.format("Could not drop temporary table %s: %s", table, e.getMessage()));
+            }
+            txn.close();
+        }
+        return abandoned;
+    }
+
+    private static String getTemporaryTable(ObjectType type) {
+        switch (type) {
+        case VOLUME:
+            return "volumes1";
+        case VOLUME_ON_HOST:
+            return "volumes_on_host1";
+        case SNAPSHOT:
+            return "snapshots1";
+        case VM_SNAPSHOT:
+            return "vm_snapshots1";
+        default:
+            return "vm_templates1";
+        }
+    }
+
+    /**
+     * @param withoutRecords if true, the objects are looked up also in the other tables from which the
+     *        plugin resolves StorPool names: the paths of the volumes before the migration to global IDs
+     *        in volume_details, the snapshots on primary storage in snapshot_store_ref and the templates
+     *        by their install path in template_spool_ref
+     */
+    private static String getMissingObjectsQuery(ObjectType type, String table, boolean withoutRecords) {
+        switch (type) {
+        case VOLUME:
+            if (withoutRecords) {
+                return "SELECT DISTINCT f.name, f.tag FROM `cloud`.`" + table + "` f LEFT JOIN `cloud`.`volumes` v ON f.name=v.path"
+                        + " LEFT JOIN `cloud`.`volume_details` d ON f.name=d.value where v.path is NULL and d.value is NULL";
+            }
+            return "SELECT DISTINCT f.name, f.tag FROM `cloud`.`" + table + "` f LEFT JOIN `cloud`.`volumes` v ON f.name=v.path where v.path is NULL OR NOT state=?";
+        case VOLUME_ON_HOST:
+            return "SELECT DISTINCT f.name, f.tag FROM `cloud`.`" + table + "` f LEFT JOIN `cloud`.`storage_pool_details` v ON f.name=v.value where v.value is NULL";
+        case SNAPSHOT:
+            if (withoutRecords) {
+                return "SELECT DISTINCT f.name, f.tag FROM `cloud`.`" + table + "` f LEFT JOIN `cloud`.`snapshot_details` v ON f.name=v.value"
+                        + " LEFT JOIN `cloud`.`snapshot_store_ref` s ON f.name=s.install_path where v.value is NULL and s.install_path is NULL";
+            }
+            return "SELECT DISTINCT f.name, f.tag FROM `cloud`.`" + table + "` f LEFT JOIN `cloud`.`snapshot_details` v ON f.name=v.value where v.value is NULL";
+        case VM_SNAPSHOT:
+            return "SELECT DISTINCT f.name, f.tag FROM `cloud`.`" + table + "` f LEFT JOIN `cloud`.`vm_snapshot_details` v ON f.name=v.value where v.value is NULL";
+        default:
+            return "SELECT DISTINCT temp.name, temp.tag"
+                    + " FROM `cloud`.`" + table + "` temp"
+                    + " LEFT JOIN `cloud`.`template_store_ref` store"
+                    + " ON temp.name=store.local_path"
+                    + " LEFT JOIN `cloud`.`template_spool_ref` spool"
+                    + " ON temp.name=spool.local_path"
+                    + (withoutRecords ? " LEFT JOIN `cloud`.`template_spool_ref` installed ON temp.name=installed.install_path" : "")
+                    + " where store.local_path is NULL"
+                    + " and spool.local_path is NULL"
+                    + (withoutRecords ? " and installed.install_path is NULL" : "");
+        }
+    }
+}
@@ -2,9 +2,18 @@ package org.apache.cloudstack.storage.motion;
 
 import java.lang.reflect.InvocationTargetException;
 import java.util.ArrayList;
+import java.util.Collections;
 import java.util.HashMap;
+import java.util.HashSet;
+import java.util.LinkedHashMap;
 import java.util.List;
 import java.util.Map;
+import java.util.Set;
+import java.util.concurrent.Callable;
+import java.util.concurrent.ExecutionException;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.Future;
 
 import javax.inject.Inject;
 
@@ -33,6 +42,7 @@ import org.apache.cloudstack.storage.datastore.db.SnapshotDataStoreDao;
 import org.apache.cloudstack.storage.datastore.db.StoragePoolDetailsDao;
 import org.apache.cloudstack.storage.datastore.db.StoragePoolVO;
 import org.apache.cloudstack.storage.datastore.db.TemplateDataStoreDao;
+import org.apache.cloudstack.storage.datastore.util.StorPoolApiBatch;
 import org.apache.cloudstack.storage.datastore.util.StorPoolHelper;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpApiResponse;
@@ -67,6 +77,7 @@ import com.cloud.host.Host;
 import com.cloud.host.HostVO;
 import com.cloud.host.dao.HostDao;
 import com.cloud.hypervisor.Hypervisor.HypervisorType;
+import com.cloud.hypervisor.kvm.storage.StorpoolStorageAdaptor;
 import com.cloud.storage.StorageManager;
 import com.cloud.storage.VMTemplateDetailVO;
 import com.cloud.storage.Volume;
@@ -81,6 +92,7 @@ import com.cloud.storage.dao.SnapshotDetailsVO;
 import com.cloud.storage.dao.VMTemplateDetailsDao;
 import com.cloud.storage.dao.VolumeDao;
 import com.cloud.upgrade.dao.VersionDao;
+import com.cloud.utils.concurrency.NamedThreadFactory;
 import com.cloud.utils.exception.CloudRuntimeException;
 import com.cloud.vm.VMInstanceVO;
 import com.cloud.vm.VirtualMachineManager;
@@ -283,8 +295,10 @@ public class StorPoolDataMotionStrategy implements DataMotionStrategy {
     public void copyAsync(Map<VolumeInfo, DataStore> volumeDataStoreMap, VirtualMachineTO vmTO, Host srcHost,
             Host destHost, AsyncCompletionCallback<CopyCommandResult> callback) {
         String errMsg = null;
-        String newVolName = null;
-        SpConnectionDesc conn = null;
+        Map<String, SpConnectionDesc> newVolumes = new HashMap<>();
+        Map<VolumeInfo, VolumeInfo> srcVolumeInfoToDestVolumeInfo = new LinkedHashMap<>();
+        Set<VolumeInfo> inPlaceVolumes = new HashSet<>();
+        boolean migrationSent = false;
 
         try {
             if (srcHost.getHypervisorType() != HypervisorType.KVM) {
@@ -305,7 +319,8 @@ public class StorPoolDataMotionStrategy implements DataMotionStrategy {
             List<MigrateDiskInfo> migrateDiskInfoList = new ArrayList<MigrateDiskInfo>();
 
             Map<String, MigrateCommand.MigrateDiskInfo> migrateStorage = new HashMap<>();
-            Map<VolumeInfo, VolumeInfo> srcVolumeInfoToDestVolumeInfo = new HashMap<>();
+            inPlaceVolumes.addAll(getVolumesMigratedInPlace(volumeDataStoreMap));
+            Map<VolumeInfo, SpApiResponse> createdVolumes = createDestinationVolumes(volumeDataStoreMap, inPlaceVolumes, vmTO, newVolumes);
 
             for (Map.Entry<VolumeInfo, DataStore> entry : volumeDataStoreMap.entrySet()) {
                 VolumeInfo srcVolumeInfo = entry.getKey();
@@ -322,28 +337,29 @@ public class StorPoolDataMotionStrategy implements DataMotionStrategy {
                 destVolumeInfo.processEvent(Event.MigrationCopySucceeded);
                 destVolumeInfo.processEvent(Event.MigrationRequested);
 
-                conn = StorpoolUtil.getSpConnection(destDataStore.getUuid(), destDataStore.getId(), _storagePoolDetails, _storagePool);
-                SpApiResponse resp = StorpoolUtil.volumeCreate(srcVolume.getUuid(), null, srcVolume.getSize(), vmTO.getUuid(), null, "volume", srcVolume.getMaxIops(), conn);
-
-                if (resp.getError() == null) {
-                    newVolName = StorpoolUtil.getNameFromResponse(resp, true);
+                boolean inPlace = inPlaceVolumes.contains(srcVolumeInfo);
+                if (inPlace) {
+                    // the VM keeps using the same StorPool volume, it is not copied by the hypervisor
+                    destVolume.setPath(srcVolumeInfo.getPath());
+                } else {
+                    String volumeName = StorpoolUtil.getNameFromResponse(createdVolumes.get(srcVolumeInfo), false);
+                    destVolume.setPath(StorpoolUtil.devPath(volumeName));
                 }
-
-                String volumeName = StorpoolUtil.getNameFromResponse(resp, false);
-                destVolume.setPath(StorpoolUtil.devPath(volumeName));
                 _volumeDao.update(destVolume.getId(), destVolume);
                 destVolume = _volumeDao.findById(destVolume.getId());
 
                 destVolumeInfo = _volumeDataFactory.getVolume(destVolume.getId(), destDataStore);
 
-                String destPath = generateDestPath(destHost, destStoragePool, destVolumeInfo);
+                srcVolumeInfoToDestVolumeInfo.put(srcVolumeInfo, destVolumeInfo);
+            }
 
-                MigrateCommand.MigrateDiskInfo migrateDiskInfo = configureMigrateDiskInfo(srcVolumeInfo, destPath);
+            Map<VolumeInfo, String> destPaths = connectDestinationVolumes(destHost, srcVolumeInfoToDestVolumeInfo, inPlaceVolumes);
+            for (Map.Entry<VolumeInfo, String> entry : destPaths.entrySet()) {
+                VolumeInfo srcVolumeInfo = entry.getKey();
+                MigrateCommand.MigrateDiskInfo migrateDiskInfo = configureMigrateDiskInfo(srcVolumeInfo, entry.getValue());
                 migrateDiskInfoList.add(migrateDiskInfo);
 
                 migrateStorage.put(srcVolumeInfo.getPath(), migrateDiskInfo);
-
-                srcVolumeInfoToDestVolumeInfo.put(srcVolumeInfo, destVolumeInfo);
             }
 
             PrepareForMigrationCommand pfmc = new PrepareForMigrationCommand(spVmTO);
@@ -377,11 +393,12 @@ public class StorPoolDataMotionStrategy implements DataMotionStrategy {
 
             migrateCommand.setAutoConvergence(kvmAutoConvergence);
 
+            migrationSent = true;
             MigrateAnswer migrateAnswer = (MigrateAnswer) agentManager.send(srcHost.getId(), migrateCommand);
 
             boolean success = migrateAnswer != null && migrateAnswer.getResult();
 
-            handlePostMigration(success, srcVolumeInfoToDestVolumeInfo, vmTO, destHost);
+            handlePostMigration(success, srcVolumeInfoToDestVolumeInfo, inPlaceVolumes, vmTO, destHost);
 
             if (migrateAnswer == null) {
                 throw new CloudRuntimeException("Unable to get an answer to the migrate command");
@@ -399,10 +416,15 @@ public class StorPoolDataMotionStrategy implements DataMotionStrategy {
                     ex.getMessage());
             log.error(errMsg, ex);
 
+            if (!migrationSent && !srcVolumeInfoToDestVolumeInfo.isEmpty()) {
+                // the destination volumes were prepared, but the VM was not migrated
+                handlePostMigration(false, srcVolumeInfoToDestVolumeInfo, inPlaceVolumes, vmTO, destHost);
+            }
+
             throw new CloudRuntimeException(errMsg);
         } finally {
             if (errMsg != null) {
-                deleteVolumeOnFail(newVolName, conn);
+                deleteVolumesOnFail(newVolumes);
             }
             CopyCmdAnswer copyCmdAnswer = new CopyCmdAnswer(errMsg);
 
@@ -414,10 +436,155 @@ public class StorPoolDataMotionStrategy implements DataMotionStrategy {
         }
     }
 
-    private void deleteVolumeOnFail(String newVolName, SpConnectionDesc conn) {
-        if (newVolName != null && conn != null) {
-            StorpoolUtil.volumeDelete(newVolName, conn);
+    /**
+     * Connects the destination host to the new StorPool volumes of the migrated disks. Every
+     * connection is a ModifyTargetsCommand sent to the host, so they are sent in parallel, by at
+     * most sp.migration.max.parallel.volumes threads. All commands are completed before an error
+     * is thrown, so the rollback in handlePostMigration sees the final state of every volume.
+     *
+     * @return the device path on the destination host of each copied volume, in the order of the disks
+     */
+    private Map<VolumeInfo, String> connectDestinationVolumes(final Host destHost, Map<VolumeInfo, VolumeInfo> srcVolumeInfoToDestVolumeInfo,
+            Set<VolumeInfo> inPlaceVolumes) {
+        Map<VolumeInfo, ModifyTargetsCommand> commands = new LinkedHashMap<>();
+        for (Map.Entry<VolumeInfo, VolumeInfo> entry : srcVolumeInfoToDestVolumeInfo.entrySet()) {
+            if (!inPlaceVolumes.contains(entry.getKey())) {
+                VolumeInfo destVolumeInfo = entry.getValue();
+                commands.put(entry.getKey(), getModifyTargetsCommand(destVolumeInfo.getPoolId(), destVolumeInfo.getPath(), true));
+            }
+        }
+        Map<VolumeInfo, String> destPaths = new LinkedHashMap<>();
+        if (commands.isEmpty()) {
+            return destPaths;
         }
+
+        int threads = Math.max(1, Math.min(BackupManager.MigrationMaxParallelVolumes.value(), commands.size()));
+        ExecutorService executor = Executors.newFixedThreadPool(threads, new NamedThreadFactory("StorPoolMigrationConnect"));
+        Map<VolumeInfo, Future<List<String>>> futures = new LinkedHashMap<>();
+        String error = null;
+        try {
+            for (Map.Entry<VolumeInfo, ModifyTargetsCommand> entry : commands.entrySet()) {
+                final ModifyTargetsCommand cmd = entry.getValue();
+                futures.put(entry.getKey(), executor.submit(new Callable<List<String>>() {
+                    @Override
+                    public List<String> call() {
+                        return sendModifyTargetsCommand(cmd, destHost.getId());
+                    }
+                }));
+            }
+            for (Map.Entry<VolumeInfo, Future<List<String>>> entry : futures.entrySet()) {
+                try {
+                    destPaths.put(entry.getKey(), entry.getValue().get().get(0));
+                } catch (InterruptedException e) {
+                    Thread.currentThread().interrupt();
+                    error = String.format("Interrupted while connecting host [%s] to the new volumes", destHost.getId());
+                } catch (ExecutionException e) {
+                    if (error == null) {
+                        error = String.format("Could not connect host [%s] to the new volume of [%s] due to %s", destHost.getId(),
+                                entry.getKey().getUuid(), e.getCause().getMessage());
+                    }
+                }
+            }
+        } finally {
+            executor.shutdown();
+        }
+
+        if (error != null) {
+            throw new CloudRuntimeException(error);
+        }
+        return destPaths;
+    }
+
+    /**
+     * Finds the StorPool volumes, which are migrated to a primary storage in the same StorPool
+     * cluster. Their data is not copied through the hypervisor, the VM keeps the same StorPool
+     * volume and after the migration only its template is changed to the template of the
+     * destination primary storage. StorPool moves the data to the new placement in the background.
+     *
+     * The volumes are migrated in place only if all of them can be. When any disk is copied, the
+     * migrate command sets VIR_MIGRATE_NON_SHARED_DISK for the whole VM and libvirt would mirror
+     * also the in place volumes onto themselves through both hosts.
+     */
+    private Set<VolumeInfo> getVolumesMigratedInPlace(Map<VolumeInfo, DataStore> volumeDataStoreMap) {
+        Set<VolumeInfo> volumes = new HashSet<>();
+        for (Map.Entry<VolumeInfo, DataStore> entry : volumeDataStoreMap.entrySet()) {
+            VolumeInfo srcVolumeInfo = entry.getKey();
+            StoragePoolVO srcPool = _storagePool.findById(srcVolumeInfo.getPoolId());
+            if (srcPool == null || !StorpoolUtil.SP_PROVIDER_NAME.equals(srcPool.getStorageProviderName())) {
+                continue;
+            }
+            String name = StorpoolStorageAdaptor.getVolumeNameFromPath(srcVolumeInfo.getPath(), true);
+            if (name == null) {
+                continue;
+            }
+            DataStore destDataStore = entry.getValue();
+            SpConnectionDesc conn = StorpoolUtil.getSpConnection(destDataStore.getUuid(), destDataStore.getId(), _storagePoolDetails, _storagePool);
+            try {
+                if (StorpoolUtil.volumeExistsInCluster(name, conn)) {
+                    StorpoolUtil.spLog("Volume %s can be migrated to primary storage %s without a copy", name, destDataStore.getName());
+                    volumes.add(srcVolumeInfo);
+                }
+            } catch (CloudRuntimeException e) {
+                log.warn(String.format("Could not check if StorPool volume %s is in the cluster of primary storage %s, it will be copied: %s", name,
+                        destDataStore.getName(), e.getMessage()));
+            }
+        }
+        if (!volumes.isEmpty() && volumes.size() < volumeDataStoreMap.size()) {
+            StorpoolUtil.spLog("%s of %s volumes could be migrated without a copy, all of them will be copied", volumes.size(), volumeDataStoreMap.size());
+            volumes.clear();
+        }
+        return volumes;
+    }
+
+    /**
+     * Creates the StorPool volumes for all migrated disks of the VM in one batch
+     * of parallel requests. The names of the created volumes are added to newVolumes,
+     * so all of them could be cleaned up if the migration fails.
+     */
+    private Map<VolumeInfo, SpApiResponse> createDestinationVolumes(Map<VolumeInfo, DataStore> volumeDataStoreMap, Set<VolumeInfo> inPlaceVolumes,
+            VirtualMachineTO vmTO, Map<String, SpConnectionDesc> newVolumes) {
+        StorPoolApiBatch batch = new StorPoolApiBatch();
+        List<VolumeInfo> volumes = new ArrayList<>();
+        List<SpConnectionDesc> connections = new ArrayList<>();
+        for (Map.Entry<VolumeInfo, DataStore> entry : volumeDataStoreMap.entrySet()) {
+            if (inPlaceVolumes.contains(entry.getKey())) {
+                continue;
+            }
+            DataStore destDataStore = entry.getValue();
+            VolumeVO srcVolume = _volumeDao.findById(entry.getKey().getId());
+            SpConnectionDesc conn = StorpoolUtil.getSpConnection(destDataStore.getUuid(), destDataStore.getId(), _storagePoolDetails, _storagePool);
+            batch.volumeCreate(srcVolume.getUuid(), null, srcVolume.getSize(), vmTO.getUuid(), null, "volume", srcVolume.getMaxIops(), conn);
+            volumes.add(entry.getKey());
+            connections.add(conn);
+        }
+
+        List<SpApiResponse> responses = batch.execute();
+        Map<VolumeInfo, SpApiResponse> createdVolumes = new HashMap<>();
+        String error = null;
+        for (int i = 0; i < responses.size(); i++) {
+            SpApiResponse resp = responses.get(i);
+            if (resp.getError() == null) {
+                newVolumes.put(StorpoolUtil.getNameFromResponse(resp, true), connections.get(i));
+                createdVolumes.put(volumes.get(i), resp);
+            } else if (error == null) {
+                error = String.format("Could not create StorPool volume for volume [%s] due to %s", volumes.get(i).getUuid(), resp.getError());
+            }
+        }
+        if (error != null) {
+            throw new CloudRuntimeException(error);
+        }
+        return createdVolumes;
+    }
+
+    private void deleteVolumesOnFail(Map<String, SpConnectionDesc> newVolumes) {
+        if (newVolumes.isEmpty()) {
+            return;
+        }
+        StorPoolApiBatch batch = new StorPoolApiBatch();
+        for (Map.Entry<String, SpConnectionDesc> volume : newVolumes.entrySet()) {
+            batch.volumeDelete(volume.getKey(), volume.getValue());
+        }
+        batch.execute();
     }
 
     private VolumeVO duplicateVolumeOnAnotherStorage(Volume volume, StoragePoolVO storagePoolVO) {
@@ -436,7 +603,7 @@ public class StorPoolDataMotionStrategy implements DataMotionStrategy {
         return _volumeDao.persist(newVol);
     }
 
-    private void handlePostMigration(boolean success, Map<VolumeInfo, VolumeInfo> srcVolumeInfoToDestVolumeInfo,
+    private void handlePostMigration(boolean success, Map<VolumeInfo, VolumeInfo> srcVolumeInfoToDestVolumeInfo, Set<VolumeInfo> inPlaceVolumes,
             VirtualMachineTO vmTO, Host destHost) {
         if (!success) {
             try {
@@ -457,14 +624,26 @@ public class StorPoolDataMotionStrategy implements DataMotionStrategy {
             }
         }
 
-        for (Map.Entry<VolumeInfo, VolumeInfo> entry : srcVolumeInfoToDestVolumeInfo.entrySet()) {
+        List<Map.Entry<VolumeInfo, VolumeInfo>> entries = new ArrayList<>(srcVolumeInfoToDestVolumeInfo.entrySet());
+        if (!success) {
+            // roll back in the reverse order of the preparation
+            Collections.reverse(entries);
+        }
+        for (Map.Entry<VolumeInfo, VolumeInfo> entry : entries) {
             VolumeInfo srcVolumeInfo = entry.getKey();
             VolumeInfo destVolumeInfo = entry.getValue();
+            boolean inPlace = inPlaceVolumes.contains(srcVolumeInfo);
 
             if (success) {
                 srcVolumeInfo.processEvent(Event.OperationSuccessed);
                 destVolumeInfo.processEvent(Event.OperationSuccessed);
 
+                if (inPlace) {
+                    updateTemplateOfMigratedVolume(destVolumeInfo);
+                    // the StorPool volume belongs to the new volume now, it must not be deleted with the old one
+                    clearVolumePath(srcVolumeInfo.getId());
+                }
+
                 _volumeDao.updateUuid(srcVolumeInfo.getId(), destVolumeInfo.getId());
 
                 VolumeVO volumeVO = _volumeDao.findById(destVolumeInfo.getId());
@@ -493,16 +672,21 @@ public class StorPoolDataMotionStrategy implements DataMotionStrategy {
                     _snapshotStoreDao.updateVolumeIds(srcVolumeInfo.getId(), destVolumeInfo.getId());
                 }
             } else {
-                try {
-                    disconnectHostFromVolume(destHost, destVolumeInfo.getPoolId(), destVolumeInfo.getPath());
-                } catch (Exception e) {
-                    log.debug("Failed to disconnect (new) dest volume", e);
-                }
+                if (inPlace) {
+                    // the VM still uses the StorPool volume on the source host
+                    clearVolumePath(destVolumeInfo.getId());
+                } else {
+                    try {
+                        disconnectHostFromVolume(destHost, destVolumeInfo.getPoolId(), destVolumeInfo.getPath());
+                    } catch (Exception e) {
+                        log.debug("Failed to disconnect (new) dest volume", e);
+                    }
 
-                try {
-                    _volumeService.revokeAccess(destVolumeInfo, destHost, destVolumeInfo.getDataStore());
-                } catch (Exception e) {
-                    log.debug("Failed to revoke access from dest volume", e);
+                    try {
+                        _volumeService.revokeAccess(destVolumeInfo, destHost, destVolumeInfo.getDataStore());
+                    } catch (Exception e) {
+                        log.debug("Failed to revoke access from dest volume", e);
+                    }
                 }
 
                 destVolumeInfo.processEvent(Event.OperationFailed);
@@ -525,15 +709,23 @@ public class StorPoolDataMotionStrategy implements DataMotionStrategy {
         }
     }
 
-
-    private String generateDestPath(Host destHost, StoragePoolVO destStoragePool, VolumeInfo destVolumeInfo) {
-        return connectHostToVolume(destHost, destVolumeInfo.getPoolId(), destVolumeInfo.getPath());
+    private void updateTemplateOfMigratedVolume(VolumeInfo destVolumeInfo) {
+        DataStore destDataStore = destVolumeInfo.getDataStore();
+        SpConnectionDesc conn = StorpoolUtil.getSpConnection(destDataStore.getUuid(), destDataStore.getId(), _storagePoolDetails, _storagePool);
+        String name = StorpoolStorageAdaptor.getVolumeNameFromPath(destVolumeInfo.getPath(), true);
+        SpApiResponse resp = StorpoolUtil.volumeUpadate(name, conn.getTemplateName(), conn);
+        if (resp.getError() != null) {
+            // the VM is already migrated, the volume can be moved later with a change of its template
+            log.warn(String.format("Could not change the template of StorPool volume %s to %s due to %s", name, conn.getTemplateName(), resp.getError()));
+        } else {
+            StorpoolUtil.spLog("Changed the template of volume %s to %s", name, conn.getTemplateName());
+        }
     }
 
-    private String connectHostToVolume(Host host, long storagePoolId, String iqn) {
-        ModifyTargetsCommand modifyTargetsCommand = getModifyTargetsCommand(storagePoolId, iqn, true);
-
-        return sendModifyTargetsCommand(modifyTargetsCommand, host.getId()).get(0);
+    private void clearVolumePath(long volumeId) {
+        VolumeVO volume = _volumeDao.findById(volumeId);
+        volume.setPath(null);
+        _volumeDao.update(volumeId, volume);
     }
 
     private void disconnectHostFromVolume(Host host, long storagePoolId, String iqn) {
@@ -27,6 +27,36 @@ public class BackupManager implements Configurable{
     public static final ConfigKey<String> AlternativeEndpoint = new ConfigKey<String>(String.class, "sp.alternative.endpoint", "Advanced", "",
             "Used for StorPool primary storage for an alternative endpoint. Structure of the endpoint is - SP_API_HTTP=address:port;SP_AUTH_TOKEN=token;SP_TEMPLATE=template_name", true, ConfigKey.Scope.StoragePool, null);
 
+    public static final ConfigKey<Integer> SpConnectionCacheTtl = new ConfigKey<Integer>(Integer.class, "sp.connection.cache.ttl", "Advanced", "60",
+            "Time in seconds for which the StorPool API connection details of a primary storage are cached. Set to 0 to disable the cache", false, ConfigKey.Scope.Global, null);
+
+    public static final ConfigKey<Integer> ApiMaxConnections = new ConfigKey<Integer>(Integer.class, "sp.api.max.connections", "Advanced", "32",
+            "Maximum number of kept alive HTTP connections to a StorPool API endpoint", false, ConfigKey.Scope.Global, null);
+
+    public static final ConfigKey<Integer> ApiConnectionIdleTimeout = new ConfigKey<Integer>(Integer.class, "sp.api.connection.idle.timeout", "Advanced", "60",
+            "Time in seconds after which an idle HTTP connection to a StorPool API endpoint is closed", false, ConfigKey.Scope.Global, null);
+
+    public static final ConfigKey<Integer> ApiClientIdleTimeout = new ConfigKey<Integer>(Integer.class, "sp.api.client.idle.timeout", "Advanced", "3600",
+            "Time in seconds after which the HTTP client of a StorPool API endpoint, which was not used and has no open requests, is closed", false, ConfigKey.Scope.Global, null);
+
+    public static final ConfigKey<Integer> ApiMaxConcurrentRequests = new ConfigKey<Integer>(Integer.class, "sp.api.max.concurrent.requests", "Advanced", "8",
+            "Maximum number of asynchronous StorPool API requests (e.g. creating or deleting the volumes of a VM) sent in parallel to one API endpoint", false, ConfigKey.Scope.Global, null);
+
+    public static final ConfigKey<Integer> SnapshotBackupMaxChain = new ConfigKey<Integer>(Integer.class, "sp.snapshot.backup.max.chain", "Advanced", "0",
+            "Maximum number of incremental backups of a volume's snapshots on secondary storage after a full one. Set to 0 to always make full backups", true, ConfigKey.Scope.Global, null);
+
+    public static final ConfigKey<Integer> MigrationMaxParallelVolumes = new ConfigKey<Integer>(Integer.class, "sp.migration.max.parallel.volumes", "Advanced", "4",
+            "Maximum number of volumes of a VM which are prepared in parallel on the destination host, when the VM is migrated with its volumes to StorPool", true, ConfigKey.Scope.Global, null);
+
+    public static final ConfigKey<String> MigrationToGlobalIdsCheckpoint = new ConfigKey<String>(String.class, "sp.migration.to.global.ids.checkpoint", "Hidden", "",
+            "The last migrated id of each kind of StorPool objects, from which an interrupted migration to StorPool's globalIds is resumed", true, ConfigKey.Scope.Global, null);
+
+    public static final ConfigKey<Integer> MigrationToGlobalIdsBatchSize = new ConfigKey<Integer>(Integer.class, "sp.migration.to.global.ids.batch.size", "Advanced", "500",
+            "Number of DB records which are read and updated in one transaction when StorPool objects are migrated to StorPool's globalIds", false, ConfigKey.Scope.Global, null);
+
+    public static final ConfigKey<Integer> MigrationToGlobalIdsThreads = new ConfigKey<Integer>(Integer.class, "sp.migration.to.global.ids.threads", "Advanced", "2",
+            "Maximum number of kinds of StorPool objects (volumes, snapshots, group snapshots and templates) migrated to StorPool's globalIds in parallel", false, ConfigKey.Scope.Global, null);
+
     private static final String SELECT_VALUE = "Select value FROM `cloud`.`configuration` where name=\"sp.migration.to.global.ids.completed\"";
     private static final String UPDATE_CONFIG = "UPDATE `cloud`.`configuration` set category=?, value=? where name=\"sp.migration.to.global.ids.completed\"";
 
@@ -38,7 +68,9 @@ public class BackupManager implements Configurable{
     @Override
     public ConfigKey<?>[] getConfigKeys() {
         getAndUpdateMigrationConfig();
-        return new ConfigKey<?>[] { BypassSecondaryStorage, StorPoolClusterId, IsMigrationCompleted, AlternativeEndPointEnabled, AlternativeEndpoint };
+        return new ConfigKey<?>[] { BypassSecondaryStorage, StorPoolClusterId, IsMigrationCompleted, AlternativeEndPointEnabled, AlternativeEndpoint, SpConnectionCacheTtl,
+                ApiMaxConnections, ApiConnectionIdleTimeout, ApiClientIdleTimeout, ApiMaxConcurrentRequests,
+                SnapshotBackupMaxChain, MigrationMaxParallelVolumes, MigrationToGlobalIdsCheckpoint, MigrationToGlobalIdsBatchSize, MigrationToGlobalIdsThreads };
     }
 
     private void getAndUpdateMigrationConfig() {
@@ -20,6 +20,7 @@ import java.util.List;
 
 import javax.inject.Inject;
 
+import org.apache.cloudstack.engine.subsystem.api.storage.DataStore;
 import org.apache.cloudstack.engine.subsystem.api.storage.ObjectInDataStoreStateMachine.Event;
 import org.apache.cloudstack.engine.subsystem.api.storage.ObjectInDataStoreStateMachine.State;
 import org.apache.cloudstack.engine.subsystem.api.storage.SnapshotDataFactory;
@@ -33,12 +34,14 @@ import org.apache.cloudstack.storage.datastore.db.SnapshotDataStoreVO;
 import org.apache.cloudstack.storage.datastore.db.StoragePoolDetailsDao;
 import org.apache.cloudstack.storage.datastore.db.StoragePoolVO;
 import org.apache.cloudstack.storage.datastore.util.StorPoolHelper;
+import org.apache.cloudstack.storage.datastore.util.StorPoolHelper.SnapshotLocation;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpApiResponse;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpConnectionDesc;
 import org.apache.log4j.Logger;
 import org.springframework.stereotype.Component;
 
+import com.cloud.agent.api.storage.StorpoolBackupSnapshotCommand;
 import com.cloud.exception.InvalidParameterValueException;
 import com.cloud.hypervisor.kvm.storage.StorpoolStorageAdaptor;
 import com.cloud.storage.DataStoreRole;
@@ -95,11 +98,11 @@ public class StorpoolSnapshotStrategy implements SnapshotStrategy {
     public boolean deleteSnapshot(Long snapshotId) {
 
         final SnapshotVO snapshotVO = _snapshotDao.findById(snapshotId);
-        VolumeVO volume = _volumeDao.findByIdIncludingRemoved(snapshotVO.getVolumeId());
-        String name = StorPoolHelper.getSnapshotName(snapshotId, snapshotVO.getUuid(), _snapshotStoreDao, _snapshotDetailsDao);
+        SnapshotLocation location = StorPoolHelper.getSnapshotLocation(snapshotId, snapshotVO.getUuid(), _snapshotStoreDao, _snapshotDetailsDao);
+        String name = location != null ? location.getName() : null;
         boolean res = false;
         // clean-up snapshot from Storpool storage pools
-        StoragePoolVO storage = _primaryDataStoreDao.findById(volume.getPoolId());
+        StoragePoolVO storage = getSnapshotStoragePool(snapshotVO, location);
         if (storage.getStorageProviderName().equals(StorpoolUtil.SP_PROVIDER_NAME)) {
             try {
                 SpConnectionDesc conn = StorpoolUtil.getSpConnection(storage.getUuid(), storage.getId(), storagePoolDetailsDao, _primaryDataStoreDao);
@@ -113,6 +116,7 @@ public class StorpoolSnapshotStrategy implements SnapshotStrategy {
                     if (snapshotDetails != null) {
                         _snapshotDetailsDao.removeDetails(snapshotId);
                     }
+                    StorPoolHelper.invalidateSnapshotLocation(snapshotId);
                     res = deleteSnapshotFromDb(snapshotId);
                     StorpoolUtil.spLog("StorpoolSnapshotStrategy.deleteSnapshot: executed successfuly=%s, snapshot uuid=%s, name=%s", res, snapshotVO.getUuid(), name);
                 }
@@ -133,9 +137,9 @@ public class StorpoolSnapshotStrategy implements SnapshotStrategy {
             return StrategyPriority.CANT_HANDLE;
         }
 
-        VolumeVO volume = _volumeDao.findByIdIncludingRemoved(snapshot.getVolumeId());
-        StoragePoolVO storage = _primaryDataStoreDao.findById(volume.getPoolId());
-        String name = StorPoolHelper.getSnapshotName(snapshot.getId(), snapshot.getUuid(), _snapshotStoreDao, _snapshotDetailsDao);
+        SnapshotLocation location = StorPoolHelper.getSnapshotLocation(snapshot.getId(), snapshot.getUuid(), _snapshotStoreDao, _snapshotDetailsDao);
+        String name = location != null ? location.getName() : null;
+        StoragePoolVO storage = getSnapshotStoragePool(snapshot, location);
         if (storage.getStorageProviderName().equals(StorpoolUtil.SP_PROVIDER_NAME)) {
             if (name != null) {
                 StorpoolUtil.spLog("StorpoolSnapshotStrategy.canHandle: globalId=%s", name);
@@ -147,9 +151,103 @@ public class StorpoolSnapshotStrategy implements SnapshotStrategy {
         if (snapshotDetails != null) {
             _snapshotDetailsDao.remove(snapshotDetails.getId());
         }
+        StorPoolHelper.invalidateSnapshotLocation(snapshot.getId());
         return StrategyPriority.CANT_HANDLE;
     }
 
+    /**
+     * @return the primary storage on which the snapshot was taken or, if it is not known, the
+     * current primary storage of the snapshot's volume
+     */
+    private StoragePoolVO getSnapshotStoragePool(Snapshot snapshot, SnapshotLocation location) {
+        if (location != null && location.getPoolId() != null) {
+            StoragePoolVO storage = _primaryDataStoreDao.findById(location.getPoolId());
+            if (storage != null) {
+                return storage;
+            }
+        }
+        VolumeVO volume = _volumeDao.findByIdIncludingRemoved(snapshot.getVolumeId());
+        return _primaryDataStoreDao.findById(volume.getPoolId());
+    }
+
+    /**
+     * Prepares an incremental backup of a snapshot to secondary storage. The backup is based
+     * on the last backed up snapshot of the same volume on the same image store, if that
+     * snapshot still exists on StorPool and its backup chain is shorter than "sp.snapshot.backup.max.chain".
+     * The base snapshot is recorded as the parent of the backup by {@link #updateBackupParent}, only
+     * after the agent reports that the backup was made incremental.
+     *
+     * @return the ID of the base snapshot, or null if a full backup has to be made
+     */
+    public Long prepareIncrementalBackup(SnapshotInfo snapshot, DataStore imageStore, StorpoolBackupSnapshotCommand cmd, SpConnectionDesc conn) {
+        final int maxChain = BackupManager.SnapshotBackupMaxChain.value();
+        if (maxChain <= 0) {
+            return null;
+        }
+
+        SnapshotVO parent = null;
+        for (SnapshotVO snap : _snapshotDao.listByVolumeId(snapshot.getVolumeId())) {
+            if (snap.getId() < snapshot.getId() && snap.getState() == Snapshot.State.BackedUp && (parent == null || snap.getId() > parent.getId())) {
+                parent = snap;
+            }
+        }
+        if (parent == null) {
+            return null;
+        }
+
+        SnapshotDataStoreVO parentOnImage = _snapshotStoreDao.findByStoreSnapshot(DataStoreRole.Image, imageStore.getId(), parent.getId());
+        // with bypassed secondary storage the install path is the StorPool snapshot
+        if (parentOnImage == null || parentOnImage.getState() != State.Ready || parentOnImage.getInstallPath() == null
+                || StorpoolStorageAdaptor.getVolumeNameFromPath(parentOnImage.getInstallPath(), true) != null) {
+            return null;
+        }
+        if (getBackupChainLength(parentOnImage, imageStore.getId()) >= maxChain) {
+            return null;
+        }
+
+        String parentName = StorPoolHelper.getSnapshotName(parent.getId(), parent.getUuid(), _snapshotStoreDao, _snapshotDetailsDao);
+        try {
+            if (parentName == null || StorpoolUtil.snapshotSize(parentName, conn) == null) {
+                return null;
+            }
+        } catch (CloudRuntimeException e) {
+            StorpoolUtil.spLog("StorpoolSnapshotStrategy.prepareIncrementalBackup: could not check StorPool snapshot %s: %s", parentName, e.getMessage());
+            return null;
+        }
+
+        cmd.setParentSnapshotPath(parentName.startsWith("~") ? StorpoolUtil.devPath(parentName.substring(1)) : StorpoolUtil.SP_OLD_PATH + parentName);
+        cmd.setParentBackupPath(parentOnImage.getInstallPath());
+
+        StorpoolUtil.spLog("StorpoolSnapshotStrategy.prepareIncrementalBackup: snapshot=%s, parent=%s, parent backup=%s", snapshot.getUuid(), parent.getUuid(),
+                parentOnImage.getInstallPath());
+        return parent.getId();
+    }
+
+    /**
+     * Records the base snapshot of a backup on the image store, so that it's not removed from
+     * secondary storage while the backup needs it. A failed or a full backup has no base snapshot.
+     *
+     * @param parentId the ID of the base snapshot, or 0 for a full backup
+     */
+    public void updateBackupParent(SnapshotInfo snapshot, DataStore imageStore, long parentId) {
+        SnapshotDataStoreVO snapshotOnImage = _snapshotStoreDao.findByStoreSnapshot(DataStoreRole.Image, imageStore.getId(), snapshot.getId());
+        if (snapshotOnImage == null || snapshotOnImage.getParentSnapshotId() == parentId) {
+            return;
+        }
+        snapshotOnImage.setParentSnapshotId(parentId);
+        _snapshotStoreDao.update(snapshotOnImage.getId(), snapshotOnImage);
+        StorpoolUtil.spLog("StorpoolSnapshotStrategy.updateBackupParent: snapshot=%s, parent id=%s", snapshot.getUuid(), parentId);
+    }
+
+    private int getBackupChainLength(SnapshotDataStoreVO snapshotOnImage, long imageStoreId) {
+        int length = 0;
+        while (snapshotOnImage != null && snapshotOnImage.getParentSnapshotId() > 0) {
+            length++;
+            snapshotOnImage = _snapshotStoreDao.findByStoreSnapshot(DataStoreRole.Image, imageStoreId, snapshotOnImage.getParentSnapshotId());
+        }
+        return length;
+    }
+
     private boolean deleteSnapshotChain(SnapshotInfo snapshot) {
         log.debug("delete snapshot chain for snapshot: " + snapshot.getId());
         boolean result = false;
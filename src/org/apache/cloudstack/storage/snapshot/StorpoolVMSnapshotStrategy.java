@@ -18,6 +18,7 @@
 //
 package org.apache.cloudstack.storage.snapshot;
 
+import java.util.Collections;
 import java.util.List;
 
 import javax.inject.Inject;
@@ -34,6 +35,8 @@ import org.apache.cloudstack.storage.datastore.db.StoragePoolVO;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpApiResponse;
 import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpConnectionDesc;
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpGroupSnapshotData;
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil.SpGroupSnapshotMember;
 import org.apache.cloudstack.storage.to.VolumeObjectTO;
 import org.apache.cloudstack.storage.vmsnapshot.DefaultVMSnapshotStrategy;
 import org.apache.cloudstack.storage.vmsnapshot.VMSnapshotHelper;
@@ -77,9 +80,6 @@ import com.cloud.vm.snapshot.VMSnapshotDetailsVO;
 import com.cloud.vm.snapshot.VMSnapshotVO;
 import com.cloud.vm.snapshot.dao.VMSnapshotDao;
 import com.cloud.vm.snapshot.dao.VMSnapshotDetailsDao;
-import com.google.gson.JsonArray;
-import com.google.gson.JsonElement;
-import com.google.gson.JsonObject;
 
 @Component
 public class StorpoolVMSnapshotStrategy extends DefaultVMSnapshotStrategy {
@@ -163,16 +163,14 @@ public class StorpoolVMSnapshotStrategy extends DefaultVMSnapshotStrategy {
             }
 
             SpApiResponse resp = StorpoolUtil.volumesGroupSnapshot(volumeTOs, userVm.getUuid(), vmSnapshotVO.getUuid(), "group", conn);
-            JsonObject obj = resp.fullJson.getAsJsonObject();
-            JsonArray snapshots = obj.getAsJsonObject("data").getAsJsonArray("snapshots");
+            SpGroupSnapshotData groupSnapshot = resp.getData(SpGroupSnapshotData.class);
+            List<SpGroupSnapshotMember> snapshots = groupSnapshot != null ? groupSnapshot.getSnapshots() : Collections.<SpGroupSnapshotMember>emptyList();
             StorpoolUtil.spLog("Volumes=%s attached to virtual machine", volumeTOs.toString());
             for (VolumeObjectTO vol : volumeTOs) {
-                for (JsonElement jsonElement : snapshots) {
-                    JsonObject snapshotObject = jsonElement.getAsJsonObject();
-                    String snapshot = StorpoolUtil
-                            .devPath(snapshotObject.getAsJsonPrimitive(StorpoolUtil.GLOBAL_ID).getAsString());
-                    if (snapshotObject.getAsJsonPrimitive("volume").getAsString().equals(StorpoolStorageAdaptor.getVolumeNameFromPath(vol.getPath(), true))
-                            || snapshotObject.getAsJsonPrimitive("volumeGlobalId").getAsString().equals(StorpoolStorageAdaptor.getVolumeNameFromPath(vol.getPath(), false))) {
+                for (SpGroupSnapshotMember snapshotObject : snapshots) {
+                    String snapshot = StorpoolUtil.devPath(snapshotObject.getSnapshotGlobalId());
+                    if (StorpoolStorageAdaptor.getVolumeNameFromPath(vol.getPath(), true).equals(snapshotObject.getVolume())
+                            || StorpoolStorageAdaptor.getVolumeNameFromPath(vol.getPath(), false).equals(snapshotObject.getVolumeGlobalId())) {
                         VMSnapshotDetailsVO vmSnapshotDetailsVO = new VMSnapshotDetailsVO(vmSnapshot.getId(), vol.getUuid(), snapshot, false);
                         vmSnapshotDetailsDao.persist(vmSnapshotDetailsVO);
                         Long poolId = volumeDao.findById(vol.getId()).getPoolId();
@@ -0,0 +1,79 @@
+package org.apache.cloudstack.storage.helper;
+
+import java.util.HashMap;
+import java.util.HashSet;
+import java.util.Map;
+import java.util.Random;
+import java.util.Set;
+import java.util.concurrent.TimeUnit;
+
+import org.apache.cloudstack.storage.datastore.util.StorpoolUtil;
+
+/**
+ * Measures the in-memory part of StorPoolInMemoryAbandonedObjectsEngine on synthetic objects, without
+ * a database: building the set of the known paths from the rows and the set difference with the
+ * objects listed in StorPool. 1% of the listed objects have no record.
+ *
+ * Run it with the plugin and its dependencies on the classpath, e.g.:
+ *
+ *     mvn test-compile dependency:build-classpath -Dmdep.outputFile=cp.txt
+ *     java -Xmx2g -cp target/classes:target/test-classes:$(cat cp.txt) \
+ *         org.apache.cloudstack.storage.helper.StorPoolInMemoryAbandonedObjectsEngineBenchmark 100000 1000000
+ *
+ * The time to read the paths from the CloudStack tables is not included, it is measured with the
+ * procedure for the SQL engine in the README.
+ */
+public class StorPoolInMemoryAbandonedObjectsEngineBenchmark {
+    private static final int WARMUP_ROUNDS = 3;
+    private static final int ROUNDS = 5;
+
+    public static void main(String[] args) {
+        String[] sizes = args.length > 0 ? args : new String[] { "100000", "1000000" };
+        for (String size : sizes) {
+            run(Integer.parseInt(size));
+        }
+    }
+
+    private static void run(int count) {
+        Random random = new Random(count);
+        String[] rows = new String[count];
+        Map<String, String> objects = new HashMap<>();
+        for (int i = 0; i < count; i++) {
+            String path = StorpoolUtil.devPath(globalId(random));
+            objects.put(path, "volume");
+            // the records of 1% of the objects are missing
+            rows[i] = i % 100 == 0 ? StorpoolUtil.devPath(globalId(random)) : path;
+        }
+
+        long readNanos = 0;
+        long differenceNanos = 0;
+        int abandoned = 0;
+        for (int round = 0; round < WARMUP_ROUNDS + ROUNDS; round++) {
+            long start = System.nanoTime();
+            Set<String> known = new HashSet<>();
+            for (String row : rows) {
+                known.add(StorPoolInMemoryAbandonedObjectsEngine.compact(row));
+            }
+            long read = System.nanoTime();
+            abandoned = StorPoolInMemoryAbandonedObjectsEngine.difference(objects, known, new HashSet<String>(), true).size();
+            long end = System.nanoTime();
+            if (round >= WARMUP_ROUNDS) {
+                readNanos += read - start;
+                differenceNanos += end - read;
+            }
+        }
+
+        Runtime runtime = Runtime.getRuntime();
+        System.gc();
+        System.out.println(String.format("%s objects, %s abandoned: known set %s ms, difference %s ms (average of %s rounds), heap used %s MB",
+                count, abandoned, TimeUnit.NANOSECONDS.toMillis(readNanos / ROUNDS), TimeUnit.NANOSECONDS.toMillis(differenceNanos / ROUNDS), ROUNDS,
+                (runtime.totalMemory() - runtime.freeMemory()) / (1024 * 1024)));
+    }
+
+    /**
+     * A random name in the format of the StorPool global IDs, e.g. "b3ru.b.cz6"
+     */
+    private static String globalId(Random random) {
+        return Long.toString(random.nextInt(Integer.MAX_VALUE), 36) + ".b." + Long.toString(random.nextInt(50000), 36);
+    }
+}